@@ -0,0 +1,891 @@
+"""
+bench_pyxmldsig.py:
+
+Benchmarks for pyxmldsig, to measure the cost of XML-DSig signature and
+verification and to compare the different APIs of the module.
+
+A temporary RSA key and self-signed X509 certificate are generated with the
+openssl command-line tool, so it must be available in the PATH.
+
+USAGE:
+bench_pyxmldsig.py [-n NUMBER] [-s SIZE] [-t THREADS] [-p PROCESSES] [-m MEGABYTES]
+bench_pyxmldsig.py --suite [--sizes SIZES] [--max-time SECONDS] [-n NUMBER]
+                   [-o RESULTS.json] [-c PREVIOUS.json]
+bench_pyxmldsig.py --soak NUMBER [-s SIZE] [--max-growth PERCENT]
+bench_pyxmldsig.py --resign MEGABYTES [--sections SECTIONS]
+bench_pyxmldsig.py --parsers [-s SIZE] [-n NUMBER] [--max-time SECONDS]
+
+With -m, the peak memory (RSS) used to sign documents of the given sizes in
+MB (comma-separated) is measured in child processes, for sign_xmlstring and
+for sign_file writing to an output file.
+
+With --suite, sign_xmlstring, verify_xmlstring and sign_file are measured for
+documents of each size (1K to 100M by default), with and without embedded
+X509 certificate, and for each suite of signature algorithms (RSA, ECDSA
+and Ed25519 keys are generated, algorithms not supported by xmlsec or
+openssl are skipped), as well as key loading and library initialization. For each measure the number of
+operations per second, the p50/p99 latency and the peak memory are reported.
+Results may be written to a JSON file with -o, and compared with a previous
+JSON file with -c, for example before and after upgrading xmlsec.
+
+With --soak, NUMBER documents are signed and verified one by one (e.g.
+millions, to simulate a long-running signer), and the RSS of the process and
+the live xmlsec/libxml2 objects (see pyxmldsig.live_objects) are printed
+regularly. After a warm-up, the RSS must not grow more than --max-growth
+percent and the number of live objects must stay constant, otherwise the
+exit status is 1.
+
+With --resign, a document of the given size divided into sections is signed
+as a whole with sign_xmlstring, then with an IncrementalSigner, and signed
+again by the IncrementalSigner after a one-line change in one section:
+with the digests of the unchanged sections from the cache, and from the
+previous signature (changed sections given by the caller).
+
+With --parsers, the verification throughput of documents of SIZE bytes is
+measured for each parser profile (see pyxmldsig.PARSER_PROFILES), then
+hostile or unusual documents (entity expansion, external entity, deep
+nesting, size over the limit of the strict profile, huge text node) are
+verified with each profile in a child process, killed after --max-time
+seconds: the result (parsed, rejected or parse error), the duration and the
+peak RSS show the worst-case resources used with each profile.
+
+PROJECT WEBSITE: http://www.decalage.info/python/pyxmldsig
+
+LICENSE: same as pyxmldsig.py, see pyxmldsig.py for details.
+"""
+
+#=== IMPORTS ==================================================================
+
+import sys, os, time, shutil, tempfile, subprocess, threading, platform
+
+try:
+    import json
+except ImportError:
+    # Python 2.5
+    import simplejson as json
+
+import pyxmldsig
+
+
+#=== CONSTANTS ================================================================
+
+# default document sizes of the suite, in bytes:
+SUITE_SIZES = '1K,10K,100K,1M,10M,100M'
+
+# signature algorithms of the suite: (name in pyxmldsig.ALGORITHM_SUITES,
+# key type)
+SUITE_ALGORITHMS = [
+    ('rsa-sha1', 'rsa'),
+    ('rsa-sha256', 'rsa'),
+    ('rsa-sha512', 'rsa'),
+    ('ecdsa-sha256', 'ec'),
+    ('ed25519', 'ed25519'),
+    ]
+
+# openssl options to generate each type of key:
+KEY_TYPES = {
+    'rsa': ['-newkey', 'rsa:2048'],
+    'ec': ['-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1'],
+    'ed25519': ['-newkey', 'ed25519'],
+    }
+
+# signature templates of the suite: (name, KeyInfo children)
+SUITE_TEMPLATES = [
+    ('with_cert', ('KeyName', 'X509Data')),
+    ('without_cert', ('KeyName',)),
+    ]
+
+# name of the benchmark key, used as KeyName to verify without certificate:
+KEY_NAME = 'bench'
+
+# documents verified with each parser profile by --parsers:
+HOSTILE_DOCUMENTS = ['entities', 'external', 'deep', 'large', 'text']
+
+# code run in a new process to measure the import of the module and the
+# initialization of the libraries: the Python bindings are imported first,
+# to measure only pyxmldsig and the libraries.
+INIT_CODE = """
+import sys, time
+sys.path.insert(0, %r)
+import libxml2, xmlsec
+start = time.time()
+import pyxmldsig
+imported = time.time()
+pyxmldsig._ensure_init()
+print imported - start, time.time() - imported
+"""
+
+
+#=== FUNCTIONS ================================================================
+
+def make_keys(tempdir, name='bench', key_type='rsa'):
+    """
+    generate a private key of key_type (see KEY_TYPES) and a self-signed X509
+    certificate in tempdir, using the openssl command-line tool.
+    Returns a tuple (key_file, cert_file).
+    """
+    key_file = os.path.join(tempdir, name + '_key.pem')
+    cert_file = os.path.join(tempdir, name + '_cert.pem')
+    subprocess.check_call(['openssl', 'req', '-x509', '-nodes'] +
+        KEY_TYPES[key_type] + ['-days', '1', '-subj', '/CN=pyxmldsig benchmark',
+        '-keyout', key_file, '-out', cert_file],
+        stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    return key_file, cert_file
+
+
+def make_document(size, template=pyxmldsig.TEMPLATE_WITH_CERT):
+    """
+    generate a synthetic XML document of approximately size bytes, containing
+    the XML-DSig template.
+    """
+    item = '<item id="%06d">Lorem ipsum dolor sit amet</item>\n'
+    count = max(1, size / len(item % 0))
+    items = ''.join([item % i for i in xrange(count)])
+    return '<document>\n%s%s</document>\n' % (items, template)
+
+
+def write_document(filename, size, template=pyxmldsig.TEMPLATE_WITH_CERT):
+    """
+    write a synthetic XML document of approximately size bytes to filename,
+    without building it in memory.
+    """
+    item = '<item id="%09d">Lorem ipsum dolor sit amet</item>\n'
+    count = max(1, size / len(item % 0))
+    f = open(filename, 'wb')
+    try:
+        f.write('<document>\n')
+        for start in xrange(0, count, 10000):
+            f.write(''.join([item % i for i in xrange(start,
+                min(start + 10000, count))]))
+        f.write(template)
+        f.write('</document>\n')
+    finally:
+        f.close()
+
+
+def timeit(function, number):
+    """
+    call function number times, and return the mean duration of one call in
+    seconds.
+    """
+    start = time.time()
+    for i in xrange(number):
+        function()
+    return (time.time() - start) / number
+
+
+def measure(function, number, max_time):
+    """
+    call function up to number times or until max_time seconds have elapsed
+    (at least once, after a first call which is not measured).
+    Returns the list of durations of each call in seconds.
+    """
+    function()
+    durations = []
+    start = time.time()
+    while len(durations) < number:
+        t = time.time()
+        function()
+        durations.append(time.time() - t)
+        if time.time() - start >= max_time:
+            break
+    return durations
+
+
+def percentile(durations, percent):
+    """
+    return the given percentile of a list of durations.
+    """
+    durations = sorted(durations)
+    index = int(round(percent / 100.0 * (len(durations) - 1)))
+    return durations[index]
+
+
+def make_result(name, durations, **fields):
+    """
+    return a dictionary describing the result of a measure: name, number of
+    operations, operations per second, mean, p50 and p99 latency in seconds,
+    and any other fields given (size, template, algorithm, ...).
+    """
+    total = sum(durations)
+    result = dict(fields)
+    result.update(name=name, ops=len(durations),
+        ops_per_s=len(durations) / total if total else 0.0,
+        mean=total / len(durations), p50=percentile(durations, 50),
+        p99=percentile(durations, 99))
+    return result
+
+
+def result_key(result):
+    """
+    return the key identifying a measure, to compare results between runs.
+    """
+    return (result['name'], result.get('size'), result.get('template'),
+            result.get('algorithm'))
+
+
+def parse_size(size):
+    """
+    convert a size such as '100', '10K' or '1M' to a number of bytes.
+    """
+    size = size.strip().upper()
+    for suffix, factor in (('K', 1024), ('M', 1024 * 1024)):
+        if size.endswith(suffix):
+            return int(float(size[:-1]) * factor)
+    return int(size)
+
+
+def template_xml(key_info, algorithm):
+    """
+    return the XML signature template for a suite of algorithms: one of the
+    built-in templates for RSA-SHA1, else a template from suite_template.
+    """
+    if algorithm == 'rsa-sha1':
+        if 'X509Data' in key_info:
+            return pyxmldsig.TEMPLATE_WITH_CERT
+        return pyxmldsig.TEMPLATE_WITHOUT_CERT
+    return pyxmldsig.suite_template(algorithm, 'X509Data' in key_info)
+
+
+def make_signers(tempdir, key_file, cert_file):
+    """
+    create a signer and a verifier Xmldsig object for each algorithm of the
+    suite supported by xmlsec and openssl, generating a key for each key
+    type other than RSA.
+    Returns a dictionary {algorithm: (signer, verifier)}.
+    """
+    signers = {}
+    keys = {'rsa': (key_file, cert_file)}
+    for algorithm, key_type in SUITE_ALGORITHMS:
+        for uri in pyxmldsig.ALGORITHM_SUITES[algorithm]:
+            if not pyxmldsig.algorithm_supported(uri):
+                print >>sys.stderr, 'skipping %s: not supported by xmlsec' % algorithm
+                break
+        else:
+            try:
+                if key_type not in keys:
+                    keys[key_type] = make_keys(tempdir, 'bench_' + key_type,
+                        key_type)
+                signer = pyxmldsig.Xmldsig(keys[key_type][0],
+                    keys[key_type][1], key_name=KEY_NAME)
+            except (subprocess.CalledProcessError, RuntimeError), exc:
+                print >>sys.stderr, 'skipping %s: %s' % (algorithm, exc)
+                continue
+            verifier = pyxmldsig.Xmldsig()
+            verifier.load_certs([keys[key_type][1]])
+            verifier.load_public_key(KEY_NAME, keys[key_type][1])
+            signers[algorithm] = signer, verifier
+    return signers
+
+
+def bench_documents(signers, tempdir, size, number, max_time):
+    """
+    measure sign_xmlstring, verify_xmlstring and sign_file for a document of
+    size bytes, for each template and algorithm of the suite, with the
+    signers returned by make_signers.
+    Returns a list of results, see make_result.
+    """
+    results = []
+    xml_file = os.path.join(tempdir, 'suite.xml')
+    for template_name, key_info in SUITE_TEMPLATES:
+        for algorithm, key_type in SUITE_ALGORITHMS:
+            if algorithm not in signers:
+                continue
+            signer, verifier = signers[algorithm]
+            template = template_xml(key_info, algorithm)
+            xmlstring = make_document(size, template)
+            fields = dict(size=size, template=template_name,
+                algorithm=algorithm)
+            results.append(make_result('sign_xmlstring', measure(
+                lambda: signer.sign_xmlstring(xmlstring), number, max_time),
+                **fields))
+            signed = signer.sign_xmlstring(xmlstring)
+            if not verifier.verify_xmlstring(signed):
+                raise RuntimeError, 'benchmark signature is not valid'
+            results.append(make_result('verify_xmlstring', measure(
+                lambda: verifier.verify_xmlstring(signed), number, max_time),
+                **fields))
+            # free the documents before the measure of sign_file:
+            signed = xmlstring = None
+            write_document(xml_file, size, template)
+            results.append(make_result('sign_file', measure(
+                lambda: signer.sign_file(xml_file, os.devnull), number,
+                max_time), **fields))
+            os.remove(xml_file)
+    return results
+
+
+def bench_key_load(key_file, cert_file, number, max_time):
+    """
+    measure the loading of a private key with its certificate from files,
+    and the creation of an Xmldsig object without key cache.
+    Returns a list of results, see make_result.
+    """
+    def load_key():
+        pyxmldsig._load_key_file(key_file, cert_file, '', KEY_NAME).destroy()
+    results = [make_result('key_load', measure(load_key, number, max_time))]
+    pyxmldsig.set_key_cache_size(0)
+    try:
+        results.append(make_result('Xmldsig (no cache)', measure(
+            lambda: pyxmldsig.Xmldsig(key_file, cert_file, key_name=KEY_NAME),
+            number, max_time)))
+    finally:
+        pyxmldsig.set_key_cache_size(pyxmldsig.KEY_CACHE_SIZE)
+    return results
+
+
+def bench_init(number):
+    """
+    measure the import of the module (which does not initialize the
+    libraries) and the initialization of the libraries (_init), in a new
+    process for each measure.
+    Returns a list of results, see make_result.
+    """
+    import_durations, init_durations = [], []
+    for i in xrange(number):
+        output = subprocess.Popen([sys.executable, '-c', INIT_CODE % \
+            os.path.dirname(os.path.abspath(pyxmldsig.__file__))],
+            stdout=subprocess.PIPE).communicate()[0]
+        import_duration, init_duration = output.split()
+        import_durations.append(float(import_duration))
+        init_durations.append(float(init_duration))
+    return [make_result('import', import_durations),
+            make_result('_init', init_durations)]
+
+
+def run_suite(key_file, cert_file, tempdir, sizes, number, max_time):
+    """
+    run the full benchmark suite, and return a dictionary with information
+    about the environment and the list of results.
+    """
+    signers = make_signers(tempdir, key_file, cert_file)
+    results = []
+    for size in sizes:
+        print >>sys.stderr, 'measuring %d bytes documents...' % size
+        results += bench_documents(signers, tempdir, size, number, max_time)
+        for size, mode, rss in bench_memory(key_file, cert_file, tempdir,
+                                            [size]):
+            results.append(dict(name='peak_rss_' + mode, size=size,
+                rss_kb=rss))
+    results += bench_key_load(key_file, cert_file, number, max_time)
+    results += bench_init(min(number, 20))
+    return dict(pyxmldsig=pyxmldsig.__version__,
+        python=platform.python_version(), platform=platform.platform(),
+        date=time.strftime('%Y-%m-%d %H:%M:%S'), results=results)
+
+
+def print_results(results):
+    """
+    print a table of results.
+    """
+    print '%-18s %10s %-12s %-10s %8s %12s %10s %10s' % ('name', 'size',
+        'template', 'algorithm', 'ops', 'ops/s', 'p50 ms', 'p99 ms')
+    for result in results:
+        if 'rss_kb' in result:
+            print '%-18s %10s %-12s %-10s %8s %9.1f MB' % (result['name'],
+                result['size'], '', '', '', result['rss_kb'] / 1024.0)
+            continue
+        print '%-18s %10s %-12s %-10s %8d %12.1f %10.3f %10.3f' % (
+            result['name'], result.get('size', ''),
+            result.get('template', ''), result.get('algorithm', ''),
+            result['ops'], result['ops_per_s'], result['p50'] * 1000,
+            result['p99'] * 1000)
+
+
+def relative_change(new, old):
+    """
+    return the relative change from old to new, or None when old is zero or
+    missing (no meaningful baseline).
+    """
+    if not old:
+        return None
+    return float(new) / old - 1
+
+
+def format_change(change):
+    """
+    format a relative change as a percentage, 'n/a' if there is no baseline.
+    """
+    if change is None:
+        return 'n/a'
+    return '%+.1f%%' % (change * 100)
+
+
+def compare_results(previous, current, threshold):
+    """
+    print the relative change of throughput, p99 latency and peak memory for
+    each measure found in both runs, marking the regressions larger than
+    threshold (fraction, e.g. 0.1 for 10%).
+    Changes against a zero baseline are shown as n/a and never counted as
+    regressions.
+    Returns the number of regressions.
+    """
+    previous = dict([(result_key(r), r) for r in previous['results']])
+    regressions = 0
+    print '%-18s %10s %-12s %-10s %10s %10s' % ('name', 'size', 'template',
+        'algorithm', 'ops/s', 'p99/rss')
+    for result in current['results']:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        if 'rss_kb' in result:
+            speed = ''
+            change = relative_change(result['rss_kb'], old.get('rss_kb'))
+            regression = change is not None and change > threshold
+        else:
+            speed_change = relative_change(result['ops_per_s'],
+                                           old.get('ops_per_s'))
+            speed = format_change(speed_change)
+            change = relative_change(result['p99'], old.get('p99'))
+            regression = ((speed_change is not None
+                           and speed_change < -threshold)
+                          or (change is not None and change > threshold))
+        regressions += regression
+        print '%-18s %10s %-12s %-10s %10s %10s %s' % (result['name'],
+            result.get('size', ''), result.get('template', ''),
+            result.get('algorithm', ''), speed, format_change(change),
+            regression and 'REGRESSION' or '')
+    return regressions
+
+
+def current_rss():
+    """
+    return the current RSS of the process in KB on Linux, or the peak RSS on
+    other systems.
+    """
+    try:
+        f = open('/proc/self/statm')
+        try:
+            pages = int(f.read().split()[1])
+        finally:
+            f.close()
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024
+    except (IOError, OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def soak(xdsig, xmlstring, number, max_growth):
+    """
+    sign and verify number documents, printing the RSS and the live objects
+    regularly. The first 10% of the documents are a warm-up, after which the
+    RSS must not grow more than max_growth (fraction, e.g. 0.05 for 5%) and
+    the live objects must not change.
+    Returns True if the memory stayed flat, False otherwise.
+    """
+    report_every = max(1, number / 20)
+    warmup = max(1, number / 10)
+    start = time.time()
+    baseline_rss = baseline_objects = None
+    max_rss = 0
+    for i in xrange(1, number + 1):
+        signed = xdsig.sign_xmlstring(xmlstring)
+        if not xdsig.verify_xmlstring(signed):
+            raise RuntimeError, 'soak signature is not valid'
+        if i == warmup:
+            baseline_rss = current_rss()
+            baseline_objects = pyxmldsig.live_objects()
+        if i % report_every == 0 or i == number:
+            rss = current_rss()
+            max_rss = max(max_rss, rss)
+            print '%10d docs %8.1fs RSS %8.1f MB live objects %s' % (i,
+                time.time() - start, rss / 1024.0, pyxmldsig.live_objects())
+    objects = pyxmldsig.live_objects()
+    growth = float(max_rss) / baseline_rss - 1
+    print 'RSS growth after warm-up: %+.1f%%' % (growth * 100)
+    ok = True
+    if growth > max_growth:
+        print 'FAILED: RSS grew more than %.1f%%' % (max_growth * 100)
+        ok = False
+    if objects != baseline_objects:
+        print 'FAILED: live objects changed from %s to %s' % (baseline_objects,
+            objects)
+        ok = False
+    return ok
+
+
+def make_sectioned_document(size, sections):
+    """
+    generate a synthetic XML document of approximately size bytes, divided
+    into sections elements (children of the root element), without
+    signature template.
+    """
+    item = '<item id="i%09d">Lorem ipsum dolor sit amet</item>\n'
+    count = max(1, size / len(item % 0) / sections)
+    return '<document>\n%s</document>\n' % ''.join(['<section>\n%s</section>\n'
+        % ''.join([item % (s * count + i) for i in xrange(count)])
+        for s in xrange(sections)])
+
+
+def bench_resign(xdsig, size, sections):
+    """
+    measure a full signature and incremental signatures of a document of
+    size bytes divided into sections, before and after a one-line change.
+    Returns a list of tuples (name, duration in seconds).
+    """
+    xmlstring = make_sectioned_document(size, sections)
+    template = pyxmldsig.SignatureTemplate()
+    incremental = pyxmldsig.IncrementalSigner(xdsig, template=template)
+    results = []
+    start = time.time()
+    xdsig.sign_xmlstring(xmlstring, template)
+    results.append(('sign_xmlstring', time.time() - start))
+    start = time.time()
+    signed = incremental.sign_xmlstring(xmlstring)
+    results.append(('incremental first', time.time() - start))
+    # change one line of the first section:
+    xmlstring = signed.replace('Lorem', 'LOREM', 1)
+    signed = None
+    start = time.time()
+    signed = incremental.sign_xmlstring(xmlstring)
+    results.append(('incremental cache', time.time() - start))
+    start = time.time()
+    signed = incremental.sign_xmlstring(xmlstring, changed=['section-0'])
+    results.append(('incremental changed', time.time() - start))
+    if not incremental.verify_xmlstring(signed):
+        raise RuntimeError, 'incremental signature is not valid'
+    return results
+
+
+def bench_batch(xdsig, xmlstring, number):
+    """
+    compare the per-document cost of sign_xmlstring/verify_xmlstring with
+    sign_many/verify_many (both reuse the signature contexts of the pool).
+    """
+    signed = xdsig.sign_xmlstring(xmlstring)
+    results = []
+    results.append(('sign_xmlstring', timeit(
+        lambda: xdsig.sign_xmlstring(xmlstring), number)))
+    results.append(('sign_many', timeit(
+        lambda: list(xdsig.sign_many([xmlstring] * number)), 1) / number))
+    template = pyxmldsig.SignatureTemplate()
+    plain = xmlstring.replace(pyxmldsig.TEMPLATE_WITH_CERT, '')
+    results.append(('sign (template)', timeit(
+        lambda: xdsig.sign_xmlstring(plain, template), number)))
+    results.append(('verify_xmlstring', timeit(
+        lambda: xdsig.verify_xmlstring(signed), number)))
+    results.append(('verify_many', timeit(
+        lambda: list(xdsig.verify_many([signed] * number)), 1) / number))
+    return results
+
+
+def bench_key_cache(key_file, cert_file, xmlstring, number):
+    """
+    compare the cost of the module function sign_xmlstring, which loads the
+    key for each call when the key cache is disabled, with and without cache.
+    """
+    results = []
+    sign = lambda: pyxmldsig.sign_xmlstring(xmlstring, key_file, cert_file)
+    pyxmldsig.set_key_cache_size(0)
+    results.append(('sign (no cache)', timeit(sign, number)))
+    pyxmldsig.set_key_cache_size(pyxmldsig.KEY_CACHE_SIZE)
+    results.append(('sign (key cache)', timeit(sign, number)))
+    return results
+
+
+def bench_threads(xdsig, xmlstring, number, threads):
+    """
+    sign number documents with threads threads sharing the same Xmldsig
+    object, and return the mean duration for one document in seconds.
+    """
+    def worker():
+        for i in xrange(number / threads):
+            xdsig.sign_xmlstring(xmlstring)
+    start = time.time()
+    thread_list = [threading.Thread(target=worker) for i in xrange(threads)]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    return (time.time() - start) / (number / threads * threads)
+
+
+def bench_processes(key_file, cert_file, xmlstring, number, processes):
+    """
+    sign number documents with a ParallelSigner using processes workers, and
+    return the mean duration for one document in seconds.
+    """
+    signer = pyxmldsig.ParallelSigner(key_file, cert_file, processes=processes)
+    try:
+        start = time.time()
+        for index, signed_xml, error in signer.sign_many([xmlstring] * number):
+            pass
+        return (time.time() - start) / number
+    finally:
+        signer.shutdown()
+
+
+def memory_child(mode, xml_file, key_file, cert_file):
+    """
+    sign xml_file in the current process, using sign_xmlstring (mode
+    'string') or sign_file with an output file (mode 'file'), then print
+    the peak RSS of the process in KB.
+    """
+    import resource
+    xdsig = pyxmldsig.Xmldsig(key_file, cert_file)
+    if mode == 'string':
+        signed_xml = xdsig.sign_xmlstring(open(xml_file).read())
+    else:
+        xdsig.sign_file(xml_file, os.devnull)
+    print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_memory(key_file, cert_file, tempdir, sizes):
+    """
+    measure the peak RSS used to sign documents of each size in sizes (in
+    bytes), in a new process for each measure.
+    Returns a list of tuples (size, mode, peak RSS in KB).
+    """
+    results = []
+    xml_file = os.path.join(tempdir, 'memory.xml')
+    for size in sizes:
+        write_document(xml_file, size)
+        for mode in ('string', 'file'):
+            output = subprocess.Popen([sys.executable,
+                os.path.abspath(__file__), '--memory-child', mode, xml_file,
+                key_file, cert_file], stdout=subprocess.PIPE).communicate()[0]
+            results.append((size, mode, int(output)))
+        os.remove(xml_file)
+    return results
+
+
+def make_hostile_document(kind, tempdir):
+    """
+    generate an XML document of the given kind (see HOSTILE_DOCUMENTS) to be
+    verified with each parser profile:
+    - entities: exponential entity expansion ("billion laughs", 10**9 times
+      a 3-byte string).
+    - external: external entity reading a local file.
+    - deep: elements nested deeper than the limit of the strict profile.
+    - large: normal document larger than the limit of the strict profile.
+    - text: text node larger than the default limit of libxml2 (10 MB).
+    """
+    if kind == 'entities':
+        entities = ['<!ENTITY e0 "lol">'] + ['<!ENTITY e%d "%s">' % (i,
+            ('&e%d;' % (i - 1)) * 10) for i in xrange(1, 10)]
+        return '<!DOCTYPE document [%s]>\n<document>&e9;</document>\n' % (
+            ''.join(entities))
+    if kind == 'external':
+        secret = os.path.join(tempdir, 'secret.txt')
+        open(secret, 'w').write('secret')
+        return ('<!DOCTYPE document [<!ENTITY secret SYSTEM "file://%s">]>\n'
+            '<document>&secret;</document>\n' % secret)
+    if kind == 'deep':
+        depth = pyxmldsig.STRICT_MAX_DEPTH * 2
+        return '<document>%s%s</document>\n' % ('<e>' * depth, '</e>' * depth)
+    if kind == 'large':
+        return make_document(pyxmldsig.STRICT_MAX_SIZE + 1024)
+    if kind == 'text':
+        return '<document>%s</document>\n' % ('x' * (20 * 1024 * 1024))
+    raise ValueError, 'unknown document kind %s' % kind
+
+
+def parser_child(profile, xml_file):
+    """
+    verify xml_file with a parser profile in the current process, then print
+    the duration, the peak RSS of the process in KB and the result.
+    """
+    import resource
+    xmlstring = open(xml_file, 'rb').read()
+    xdsig = pyxmldsig.Xmldsig(parser_profile=profile)
+    start = time.time()
+    try:
+        xdsig.verify_xmlstring(xmlstring)
+        result = 'parsed'
+    except Exception, exc:
+        # the documents have no signature: this error means they were parsed
+        if 'XML-DSIG node not found' in str(exc):
+            result = 'parsed'
+        else:
+            result = str(exc)
+    print time.time() - start, resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss, result
+
+
+def bench_parsers(key_file, cert_file, tempdir, size, number, max_time):
+    """
+    measure the verification throughput of documents of size bytes with each
+    parser profile, and verify hostile documents with each profile in child
+    processes killed after max_time seconds.
+    Returns a list of tuples (profile, document, docs/s or None, duration,
+    peak RSS in KB, result).
+    """
+    results = []
+    xdsig = pyxmldsig.Xmldsig(key_file=key_file, cert_file=cert_file)
+    xdsig.load_certs([cert_file])
+    signed = xdsig.sign_xmlstring(make_document(size))
+    for profile in sorted(pyxmldsig.PARSER_PROFILES):
+        xdsig.set_parser_profile(profile)
+        if not xdsig.verify_xmlstring(signed):
+            raise RuntimeError, 'signature is not valid'
+        duration = timeit(lambda: xdsig.verify_xmlstring(signed), number)
+        results.append((profile, '%d bytes' % len(signed), 1.0 / duration,
+            duration, None, 'valid'))
+    xml_file = os.path.join(tempdir, 'hostile.xml')
+    for kind in HOSTILE_DOCUMENTS:
+        f = open(xml_file, 'wb')
+        try:
+            f.write(make_hostile_document(kind, tempdir))
+        finally:
+            f.close()
+        for profile in sorted(pyxmldsig.PARSER_PROFILES):
+            child = subprocess.Popen([sys.executable,
+                os.path.abspath(__file__), '--parser-child', profile,
+                xml_file], stdout=subprocess.PIPE)
+            start = time.time()
+            while child.poll() is None and time.time() - start < max_time:
+                time.sleep(0.01)
+            if child.poll() is None:
+                child.kill()
+                child.wait()
+                results.append((profile, kind, None, time.time() - start,
+                    None, 'killed after %.0fs' % max_time))
+                continue
+            duration, rss, result = child.stdout.read().split(None, 2)
+            results.append((profile, kind, None, float(duration), int(rss),
+                result.strip()))
+        os.remove(xml_file)
+    return results
+
+
+#=== MAIN =====================================================================
+
+def main():
+    if sys.argv[1:2] == ['--memory-child']:
+        memory_child(*sys.argv[2:6])
+        return
+    if sys.argv[1:2] == ['--parser-child']:
+        parser_child(*sys.argv[2:4])
+        return
+    from optparse import OptionParser
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-n", "--number", default=1000,
+        metavar="NUMBER", help="number of documents for each measure (maximum with --suite)",
+        action="store", type="int", dest="number")
+    parser.add_option("-s", "--size", default=1024,
+        metavar="SIZE", help="approximate size of each document in bytes",
+        action="store", type="int", dest="size")
+    parser.add_option("-t", "--threads", default=4,
+        metavar="THREADS", help="number of threads sharing an Xmldsig object",
+        action="store", type="int", dest="threads")
+    parser.add_option("-p", "--processes", default=None,
+        metavar="PROCESSES", help="number of ParallelSigner processes (default: number of CPUs)",
+        action="store", type="int", dest="processes")
+    parser.add_option("-m", "--memory", default=None,
+        metavar="MEGABYTES", help="measure peak memory for these document sizes in MB, e.g. 1,10,100",
+        action="store", type="string", dest="memory")
+    parser.add_option("--suite", default=False,
+        help="run the full benchmark suite",
+        action="store_true", dest="suite")
+    parser.add_option("--sizes", default=SUITE_SIZES,
+        metavar="SIZES", help="document sizes of the suite, e.g. 1K,1M (default: %s)" % SUITE_SIZES,
+        action="store", type="string", dest="sizes")
+    parser.add_option("--max-time", default=10.0,
+        metavar="SECONDS", help="maximum duration of each measure of the suite (default: 10)",
+        action="store", type="float", dest="max_time")
+    parser.add_option("-o", "--output", default=None,
+        metavar="RESULTS", help="write the results of the suite to a JSON file",
+        action="store", type="string", dest="output")
+    parser.add_option("-c", "--compare", default=None,
+        metavar="PREVIOUS", help="compare the results of the suite with a previous JSON file",
+        action="store", type="string", dest="compare")
+    parser.add_option("--soak", default=None,
+        metavar="NUMBER", help="sign and verify NUMBER documents, checking that memory stays flat",
+        action="store", type="int", dest="soak")
+    parser.add_option("--max-growth", default=5.0,
+        metavar="PERCENT", help="maximum RSS growth allowed by --soak after warm-up (default: 5)",
+        action="store", type="float", dest="max_growth")
+    parser.add_option("--resign", default=None,
+        metavar="MEGABYTES", help="measure incremental re-signing of a document of this size in MB",
+        action="store", type="float", dest="resign")
+    parser.add_option("--sections", default=100,
+        metavar="SECTIONS", help="number of sections of the document of --resign (default: 100)",
+        action="store", type="int", dest="sections")
+    parser.add_option("--parsers", default=False,
+        help="measure each parser profile with normal and hostile documents",
+        action="store_true", dest="parsers")
+    parser.add_option("--threshold", default=10.0,
+        metavar="PERCENT", help="change reported as a regression by --compare (default: 10)",
+        action="store", type="float", dest="threshold")
+    (options, args) = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp(prefix='bench_pyxmldsig')
+    try:
+        key_file, cert_file = make_keys(tempdir)
+        if options.soak:
+            xdsig = pyxmldsig.Xmldsig(key_file=key_file, cert_file=cert_file)
+            xdsig.load_certs([cert_file])
+            if not soak(xdsig, make_document(options.size), options.soak,
+                        options.max_growth / 100.0):
+                sys.exit(1)
+            return
+        if options.resign:
+            xdsig = pyxmldsig.Xmldsig(key_file=key_file, cert_file=cert_file)
+            xdsig.load_certs([cert_file])
+            for name, duration in bench_resign(xdsig,
+                    int(options.resign * 1024 * 1024), options.sections):
+                print '%-20s %10.3f s' % (name, duration)
+            return
+        if options.parsers:
+            for (profile, document, docs_per_s, duration, rss,
+                    result) in bench_parsers(key_file, cert_file, tempdir,
+                    options.size, options.number, options.max_time):
+                if docs_per_s is not None:
+                    print '%-8s %-12s %10.1f docs/s %10.1f us/doc  %s' % (
+                        profile, document, docs_per_s, duration * 1e6, result)
+                elif rss is None:
+                    print '%-8s %-12s %10.3f s  %s' % (profile, document,
+                        duration, result)
+                else:
+                    print '%-8s %-12s %10.3f s %8.1f MB  %s' % (profile,
+                        document, duration, rss / 1024.0, result)
+            return
+        if options.suite:
+            sizes = [parse_size(size) for size in options.sizes.split(',')]
+            suite = run_suite(key_file, cert_file, tempdir, sizes,
+                options.number, options.max_time)
+            print_results(suite['results'])
+            if options.output:
+                f = open(options.output, 'w')
+                try:
+                    json.dump(suite, f, indent=1)
+                finally:
+                    f.close()
+            if options.compare:
+                print
+                previous = json.load(open(options.compare))
+                if compare_results(previous, suite, options.threshold / 100.0):
+                    sys.exit(1)
+            return
+        xdsig = pyxmldsig.Xmldsig(key_file=key_file, cert_file=cert_file)
+        xdsig.load_certs([cert_file])
+        xmlstring = make_document(options.size)
+        print 'documents: %d x %d bytes' % (options.number, len(xmlstring))
+        results = bench_batch(xdsig, xmlstring, options.number)
+        results += bench_key_cache(key_file, cert_file, xmlstring,
+            options.number)
+        for name, duration in results:
+            print '%-20s %10.1f us/doc %10.1f docs/s' % (name,
+                duration * 1e6, 1.0 / duration)
+        duration = bench_threads(xdsig, xmlstring, options.number,
+            options.threads)
+        print '%-20s %10.1f us/doc %10.1f docs/s' % ('sign %d threads'
+            % options.threads, duration * 1e6, 1.0 / duration)
+        duration = bench_processes(key_file, cert_file, xmlstring,
+            options.number, options.processes)
+        print '%-20s %10.1f us/doc %10.1f docs/s' % ('ParallelSigner',
+            duration * 1e6, 1.0 / duration)
+        if options.memory:
+            sizes = [int(float(mb) * 1024 * 1024)
+                for mb in options.memory.split(',')]
+            for size, mode, rss in bench_memory(key_file, cert_file, tempdir,
+                                                sizes):
+                print 'peak RSS %-6s %8.1f MB doc %10.1f MB' % (mode,
+                    size / 1048576.0, rss / 1024.0)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == "__main__":
+    main()
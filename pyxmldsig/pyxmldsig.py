@@ -1,577 +1,5672 @@
-"""
-pyxmldsig.py:
-
-A Python module to create and verify XML Digital Signatures (XML-DSig)
-
-This is a simple interface to the PyXMLSec library, aiming to provide a more
-pythonic API suitable for Python applications.
-See http://www.decalage.info/python/pyxmldsig to download the latest version.
-
-May be used as a command-line tool or as a Python module.
-This code is inspired from PyXMLSec samples, with a more pythonic interface:
-http://pyxmlsec.labs.libre-entreprise.org/index.php?section=examples
-
-AUTHOR: Philippe Lagadec (decalage at laposte dot net)
-
-PROJECT WEBSITE: http://www.decalage.info/python/pyxmldsig
-
-LICENSE:
-
-Copyright (c) 2009-2010, Philippe Lagadec (decalage at laposte dot net)
-
-Permission to use, copy, modify, and/or distribute this software for any
-purpose with or without fee is hereby granted, provided that the above copyright
-notice and this permission notice appear in all copies.
-
-THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
-REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
-FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
-INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
-LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
-OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
-PERFORMANCE OF THIS SOFTWARE.
-
-
-USAGE AS A TOOL:
-pyxmldsig.py <data.xml> -k <key-file.pem> [-c cert-file.pem] [-p password]
-
-USAGE IN A PYTHON APPLICATION:
-
-import pyxmldsig
-
-# simple function interface:
-signed_xml = pyxmldsig.sign_file(template_file='myfile.xml',
-    key_file='mykey.pem', cert_file='myx509cert.pem', password='mypassword')
-print signed_xml
-
-# sign with class interface:
-xdsig = pyxmldsig.Xmldsig(key_file='mykey.pem', cert_file='myx509cert.pem',
-    password='mypassword')
-signed_xml1 = xdsig.sign_file('myfile.xml')
-signed_xml2 = xdsig.sign_file(pyxmldsig.TEMPLATE_WITH_CERT)
-
-# verify with class interface:
-xdsig2 = pyxmldsig.Xmldsig()
-xdsig2.load_certs(['cacert.pem', 'myx509cert.pem'])
-assert xdsig2.verify_xmlstring(signed_xml1) == True
-assert xdsig2.verify_xmlstring(signed_xml2) == True
-
-REQUIREMENTS:
-- pyxmlsec: http://pyxmlsec.labs.libre-entreprise.org/
-- xmlsec: http://www.aleksey.com/xmlsec/
-- libxml2: http://xmlsoft.org
-- On Windows see also this site for convenient compiled binaries:
-  http://returnbooleantrue.blogspot.com/2009/04/pyxmlsec-windows-binary.html
-
-REFERENCES:
-- http://www.w3.org/TR/xmldsig-core/
-"""
-
-__version__ = '0.05'
-
-#=== CHANGELOG ================================================================
-
-# 2009-09-10 v0.01 PL: - first version, inspired from pyxmlsec samples
-# 2009-09-14 v0.02 PL: - small improvements, license
-# 2010-05-11 v0.03 PL: - renamed to pyxmldsig
-#                      - X509 cert is now optional
-#                      - a key password may be provided
-# 2010-06-29 v0.04 PL: - added Xmldsig class to load a key once for several
-#                        signatures
-#                      - added signature verification
-#                      - added simple XML-DSIG templates
-# 2010-07-06 v0.05 PL: - added load_cert to load several certificates at once
-
-#=== TODO =====================================================================
-
-# - add option to generate XML-DSig template automatically, appended to a chosen
-#   node.
-# - add option to improve detached signature with http URI: fix URI after
-#   signature.
-# - check if all temporary xmlsec objects are destroyed after each operation
-# - find a solution to load a certificate with a key name to allow signature
-#   verification without embedded X509 cert
-# - add option to use keys manager or single key?
-
-#=== IMPORTS ==================================================================
-
-import sys
-
-try:
-    import libxml2
-except ImportError:
-    raise ImportError, "libxml2 is required: see http://xmlsoft.org"
-
-try:
-    import xmlsec
-except ImportError:
-    raise ImportError, "pyxmlsec is required: see http://pyxmlsec.labs.libre-entreprise.org"
-
-
-#=== CONSTANTS ================================================================
-
-# XML Signature template with X509 certificate:
-# - the X.509 cert tag must be empty, else another one will be appended
-# - KeyName is optional
-TEMPLATE_WITH_CERT = \
-"""<Signature xmlns="http://www.w3.org/2000/09/xmldsig#">
-<SignedInfo>
-  <CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>
-  <SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>
-  <Reference URI="">
-    <Transforms>
-      <Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>
-    </Transforms>
-    <DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/>
-    <DigestValue>TEMPLATE</DigestValue>
-  </Reference>
-</SignedInfo>
-<SignatureValue>TEMPLATE</SignatureValue>
-<KeyInfo>
-  <KeyName/>
-  <X509Data>
-    <X509Certificate></X509Certificate>
-  </X509Data>
-</KeyInfo>
-</Signature>
-"""
-
-# XML Signature template without X509 certificate:
-# - KeyInfo / KeyName is optional
-TEMPLATE_WITHOUT_CERT = \
-"""<Signature xmlns="http://www.w3.org/2000/09/xmldsig#">
-<SignedInfo>
-  <CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>
-  <SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>
-  <Reference URI="">
-    <Transforms>
-      <Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>
-    </Transforms>
-    <DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/>
-    <DigestValue>TEMPLATE</DigestValue>
-  </Reference>
-</SignedInfo>
-<SignatureValue>TEMPLATE</SignatureValue>
-<KeyInfo>
-  <KeyName/>
-</KeyInfo>
-</Signature>
-"""
-
-#=== CLASSES ==================================================================
-
-class Xmldsig (object):
-    """
-    class to sign and verify XML signatures (XML DSig)
-    """
-
-    def __init__(self, key_file=None, cert_file=None, password='', key_name=None):
-        """
-        - key_file: str, filename of PEM file containing the private key.
-                    (the file should NOT be password-protected)
-        - cert_file: str, filename of PEM file containing the X509 certificate.
-                     (optional: can be None)
-        - password: str, password to open key file, or None if no password.
-        - key_name: str, name for the key in the signature, or None if omitted.
-        """
-        self.dsig_ctx = None
-        # TEST: single key
-        self.key = None
-        # Create and initialize keys manager
-        self.keysmngr = xmlsec.KeysMngr()
-        if self.keysmngr is None:
-            raise RuntimeError, "Error: failed to create keys manager."
-        if xmlsec.cryptoAppDefaultKeysMngrInit(self.keysmngr) < 0:
-            self.keysmngr.destroy()
-            raise RuntimeError, "Error: failed to initialize keys manager."
-        # load key
-        self.load(key_file, cert_file, password, key_name)
-
-
-    def load(self, key_file=None, cert_file=None, password='', key_name=None):
-        """
-        load a private key and/or a public certificate for signature and verification
-
-        - key_file: str, filename of PEM file containing the private key.
-                    (the file should NOT be password-protected)
-        - cert_file: str, filename of PEM file containing the X509 certificate.
-                     (optional: can be None)
-        - password: str, password to open key file, or None if no password.
-        """
-        #TODO: try except block to destroy key if error
-        if key_file is not None:
-            # Load private key, with optional password
-            #print 'PASSWORD: %s' % password
-            key = xmlsec.cryptoAppKeyLoad(filename = key_file,
-                format = xmlsec.KeyDataFormatPem, pwd = password,
-                pwdCallback = None, pwdCallbackCtx = None)
-            # API references:
-            # http://pyxmlsec.labs.libre-entreprise.org/docs/html/xmlsec-module.html#cryptoAppKeyLoad
-            # http://www.aleksey.com/xmlsec/api/xmlsec-app.html#XMLSECCRYPTOAPPKEYLOAD
-            # http://www.aleksey.com/xmlsec/api/xmlsec-keysdata.html#XMLSECKEYDATAFORMAT
-            if key is None:
-                raise RuntimeError, "Error: failed to load private PEM key from \"%s\"" % key_file
-            if key_name is not None:
-                # Set key name
-                if key.setName(key_name) < 0:
-                    raise RuntimeError, "Error: failed to set key name to \"%s\"" % key_name
-            if cert_file is not None:
-                # Load certificate and add to the key
-                if xmlsec.cryptoAppKeyCertLoad(key, cert_file, xmlsec.KeyDataFormatPem) < 0:
-                    raise RuntimeError, "Error: failed to load PEM certificate \"%s\"" % cert_file
-            # load key into manager:
-            if xmlsec.cryptoAppDefaultKeysMngrAdoptKey(self.keysmngr, key) < 0:
-                raise RuntimeError, "Error: failed to load key into keys manager"
-
-        elif cert_file is not None:
-            # case when we only want to load a cert without private key
-            if self.keysmngr.certLoad(cert_file, xmlsec.KeyDataFormatPem,
-                             xmlsec.KeyDataTypeTrusted) < 0:
-                # is it better to keep the keys manager if an error occurs?
-                #self.keysmngr.destroy()
-                raise RuntimeError, "Error: failed to load PEM certificate from \"%s\"" % cert_file
-            # THIS DOES NOT WORK: it seems a certificate cannot be loaded like a key with a name...
-##            key = xmlsec.cryptoAppKeyLoad(filename = cert_file,
-##                format = xmlsec.KeyDataFormatPem, pwd = password,
-##                pwdCallback = None, pwdCallbackCtx = None)
-##            if key is None:
-##                raise RuntimeError, "Error: failed to load PEM certificate from \"%s\"", cert_file
-##            if key_name is not None:
-##                # Set key name
-##                if key.setName(key_name) < 0:
-##                    raise RuntimeError, "Error: failed to set key name to \"%s\"" % key_name
-##            # load key into manager:
-##            if xmlsec.cryptoAppDefaultKeysMngrAdoptKey(self.keysmngr, key) < 0:
-##                raise RuntimeError, "Error: failed to load certificate into keys manager"
-
-    def load_certs(self, certificates):
-        """
-        load one or several certificates into the keys manager for signature
-        verification. For example, load the CA cert, any number of intermediate
-        certs, and the cert corresponding to the key used for the signature.
-
-        certificates: list or tuple containing certificate file names
-        """
-        for cert in certificates:
-            self.load(cert_file=cert)
-
-
-    def sign_file (self, template_file):
-        """
-        Sign a XML file using the signature template in the XML file.
-        The certificate from cert_file is placed in the <dsig:X509Data/> node.
-
-        - template_file: str, filename of XML file containing an XML-DSig template.
-
-        Returns a string containing the signed XML data.
-        Raises an exception if an error occurs.
-        """
-        xmlstring = open(template_file).read()
-        return self.sign_xmlstring(xmlstring)
-
-
-    def sign_xmlstring (self, xmlstring):
-        """
-        Sign xmlstring using the signature template in xmlstring.
-        The certificate from cert_file is placed in the <dsig:X509Data/> node.
-
-        - xmlstring: str, XML data containing an XML-DSig template.
-
-        Returns a string containing the signed XML data.
-        Raises an exception if an error occurs.
-        """
-        # try block to ensure cleanup is called even if an exception is raised:
-        try:
-            # Create signature context
-            self._create_context()
-            # Load template
-            doc = self._parse_xmlstring(xmlstring)
-            # find the XML-DSig start node
-            node = xmlsec.findNode(doc.getRootElement(), xmlsec.NodeSignature,
-                                   xmlsec.DSigNs)
-            if node is None:
-        	    raise RuntimeError, "Error: XML-DSIG node not found"
-            # Sign the template
-            if self.dsig_ctx.sign(node) < 0:
-                raise RuntimeError, "Error: signature failed"
-            output = str(doc)
-        finally:
-            # cleanup, even if an exception has been raised:
-            self._cleanup_context()
-            if doc is not None:
-                doc.freeDoc()
-        # return output if no exception was raised:
-        return output
-
-
-    def verify_file (self, xmlfile):
-        """
-        Verify signature in XML file using the loaded certificate.
-
-        - xmlfile: str, filename of XML file containing an XML-DSig signature.
-
-        Returns True if the signature is valid, False otherwise.
-        Raises an exception if an error occurs.
-        """
-        xmlstring = open(xmlfile).read()
-        return self.verify_xmlstring(xmlstring)
-
-
-    def verify_xmlstring (self, xmlstring):
-        """
-        Verify signature in xmlstring using the loaded certificate.
-
-        - xmlstring: str, XML data containing an XML-DSig signature.
-
-        Returns True if the signature is valid, False otherwise.
-        Raises an exception if an error occurs.
-        """
-        doc = None
-        # try block to ensure cleanup is called even if an exception is raised:
-        try:
-            # Create signature context
-            self._create_context()
-            # Load XML data
-            doc = self._parse_xmlstring(xmlstring)
-            # find the XML-DSig start node
-            node = xmlsec.findNode(doc.getRootElement(), xmlsec.NodeSignature,
-                                   xmlsec.DSigNs)
-            if node is None:
-        	    raise RuntimeError, "Error: XML-DSIG node not found"
-            # Verify signature
-            if self.dsig_ctx.verify(node) < 0:
-                # An error occured, the signature could not be verified
-                raise RuntimeError, "Error: An error occured, the signature could not be verified"
-            if self.dsig_ctx.status == xmlsec.DSigStatusSucceeded:
-                # Signature is OK
-                return True
-            else:
-                # Signature is INVALID
-                return False
-        finally:
-            # cleanup, even if an exception has been raised:
-            self._cleanup_context()
-            if doc is not None:
-                doc.freeDoc()
-        # return output if no exception was raised:
-        return output
-
-
-    def _parse_xmlstring(self, xmlstring):
-        """
-        parse XML string containing XML-DSIG nodes for signature (template) or
-        verification (signed data)
-        """
-        #doc = libxml2.parseFile(tmpl_file)
-        doc = libxml2.parseDoc(xmlstring)
-        if doc is None or doc.getRootElement() is None:
-            raise RuntimeError, "Error: unable to parse XML data"
-        return doc
-
-
-    def _create_context(self):
-        """
-        create the xmlsec context for signature or verification
-        """
-        self.dsig_ctx = xmlsec.DSigCtx(self.keysmngr)
-        if self.dsig_ctx is None:
-            raise RuntimeError, "Error: failed to create signature context"
-
-
-    def _cleanup_context (self):
-        """
-        cleanup the xmlsec context in case of error
-        """
-        if self.dsig_ctx is not None:
-            self.dsig_ctx.destroy()
-        self.dsig_ctx = None
-
-
-
-
-#=== FUNCTIONS ================================================================
-
-def sign_file(template_file, key_file, cert_file=None, password='', key_name=None):
-    """
-    Sign a XML file using private key from key_file and the signature template
-    in the XML file.
-    The certificate from cert_file is placed in the <dsig:X509Data/> node.
-
-    - template_file: str, filename of XML file containing an XML-DSig template.
-    - key_file: str, filename of PEM file containing the private key.
-                (the file should NOT be password-protected)
-    - cert_file: str, filename of PEM file containing the X509 certificate.
-                 (optional: can be None)
-    - password: str, password to open key file, or None if no password.
-
-    Returns a string containing the signed XML data.
-    Raises an exception if an error occurs.
-    """
-    xmldsig = Xmldsig(key_file, cert_file, password, key_name)
-    return xmldsig.sign_file(template_file)
-##    xmlstring = open(template_file).read()
-##    return sign_xmlstring(xmlstring, key_file, cert_file, password)
-
-
-def sign_xmlstring(xmlstring, key_file, cert_file=None, password='', key_name=None):
-    """
-    Sign xmlstring using private key from key_file and the signature template
-    in xmlstring.
-    The certificate from cert_file is placed in the <dsig:X509Data/> node.
-
-    - xmlstring: str, XML data containing an XML-DSig template.
-    - key_file: str, filename of PEM file containing the private key.
-                (the file should NOT be password-protected)
-    - cert_file: str, filename of PEM file containing the X509 certificate.
-                 (optional: can be None)
-    - password: str, password to open key file, or "" if no password.
-                (never use None because libxmlsec will ask on the console)
-
-    Returns a string containing the signed XML data.
-    Raises an exception if an error occurs.
-    """
-    xmldsig = Xmldsig(key_file, cert_file, password, key_name)
-    return xmldsig.sign_xmlstring(xmlstring)
-##    # Load template
-##    #doc = libxml2.parseFile(tmpl_file)
-##    doc = libxml2.parseDoc(xmlstring)
-##    if doc is None or doc.getRootElement() is None:
-##        raise RuntimeError, "Error: unable to parse XML data"
-##
-##    # try block to ensure cleanup is called even if an exception is raised:
-##    try:
-##        dsig_ctx = None
-##
-##        # Find XML-DSig start node
-##        node = xmlsec.findNode(doc.getRootElement(), xmlsec.NodeSignature,
-##                               xmlsec.DSigNs)
-##        if node is None:
-##    	    raise RuntimeError, "Error: start node not found"
-##
-##        # Create signature context, we don't need keys manager in this example
-##        dsig_ctx = xmlsec.DSigCtx()
-##        if dsig_ctx is None:
-##            raise RuntimeError, "Error: failed to create signature context"
-##
-##        # Load private key, assuming that there is not password
-##        #print 'PASSWORD: %s' % password
-##        key = xmlsec.cryptoAppKeyLoad(filename = key_file,
-##            format = xmlsec.KeyDataFormatPem, pwd = password,
-##            pwdCallback = None, pwdCallbackCtx = None)
-##        # API references:
-##        # http://pyxmlsec.labs.libre-entreprise.org/docs/html/xmlsec-module.html#cryptoAppKeyLoad
-##        # http://www.aleksey.com/xmlsec/api/xmlsec-app.html#XMLSECCRYPTOAPPKEYLOAD
-##        # http://www.aleksey.com/xmlsec/api/xmlsec-keysdata.html#XMLSECKEYDATAFORMAT
-##        if key is None:
-##            raise RuntimeError, "Error: failed to load private PEM key from \"%s\"" % key_file
-##        dsig_ctx.signKey = key
-##
-##        if cert_file is not None:
-##            # Load certificate and add to the key
-##            ##    if not check_filename(cert_file):
-##            ##        return cleanup(doc, dsig_ctx)
-##            if xmlsec.cryptoAppKeyCertLoad(key, cert_file, xmlsec.KeyDataFormatPem) < 0:
-##                raise RuntimeError, "Error: failed to load PEM certificate \"%s\"" % cert_file
-##
-##        # Set key name to the file name, this is just an example!
-##        if key.setName(key_file) < 0:
-##            raise RuntimeError, "Error: failed to set key name for key from \"%s\"" % key_file
-##
-##        # Sign the template
-##        if dsig_ctx.sign(node) < 0:
-##            raise RuntimeError, "Error: signature failed"
-##
-##        ##    # Print signed document to stdout
-##        ##    doc.dump("-")
-##        ##    doc.saveFile("test.xml")
-##        output = str(doc)
-##    finally:
-##        # cleanup, even if an exception has been raised:
-##        cleanup(doc, dsig_ctx)
-##    # return output if no exception was raised:
-##    return output
-
-
-##def cleanup(doc=None, dsig_ctx=None, res=-1):
-##    """
-##    Cleans libxml2 context after usage.
-##    """
-##    if dsig_ctx is not None:
-##        dsig_ctx.destroy()
-##    if doc is not None:
-##        doc.freeDoc()
-##    return res
-
-
-def _init():
-    """
-    Initialize necessary libraries (libxml2 and xmlsec).
-    Should be called once only: this is automatic when this module is imported.
-    Raises an exception if an error occurs.
-    """
-    # Init libxml library
-    libxml2.initParser()
-    libxml2.substituteEntitiesDefault(1)
-    # Init xmlsec library
-    assert xmlsec.init() >= 0, "Error: xmlsec initialization failed."
-    # Check loaded library version
-    assert xmlsec.checkVersion() == 1, "Error: loaded xmlsec library version is not compatible."
-    # Init crypto library
-    assert xmlsec.cryptoAppInit(None) >= 0, "Error: crypto initialization failed."
-    # Init xmlsec-crypto library
-    assert xmlsec.cryptoInit() >= 0, "Error: xmlsec-crypto initialization failed."
-
-
-def shutdown():
-    """
-    Shutdown all libraries cleanly.
-    Should only be called at the end of all xmlsec actions.
-    """
-    # Shutdown xmlsec-crypto library
-    xmlsec.cryptoShutdown()
-    # Shutdown crypto library
-    xmlsec.cryptoAppShutdown()
-    # Shutdown xmlsec library
-    xmlsec.shutdown()
-    # Shutdown LibXML2
-    libxml2.cleanupParser()
-
-
-#=== MAIN =====================================================================
-
-# always initialize the xmlsec and libxml2 libraries:
-_init()
-
-def main():
-    """
-    To use this module as a command-line tool.
-    """
-    from optparse import OptionParser
-    usage = "usage: %prog [options] file.xml"
-    parser = OptionParser(usage=usage, version='%prog '+__version__)
-    parser.add_option("-k", "--keyfile",
-        metavar="KEYFILE", help="PEM file containing private key",
-        action="store", type="string", dest="keyfile")
-    parser.add_option("-c", "--certfile",
-        metavar="CERTFILE", help="PEM file containing the X.509 certificate",
-        action="store", type="string", dest="certfile")
-    parser.add_option("-p", "--password", default='', # not None!
-        metavar="PASSWORD", help="Password of the private key file",
-        action="store", type="string", dest="password")
-    (options, args) = parser.parse_args()
-
-    if len(args) != 1 and not options.keyfile:
-        print __doc__
-        parser.print_help()
-        sys.exit()
-
-    signed_xml = sign_file(template_file=args[0], key_file=options.keyfile,
-        cert_file=options.certfile, password=options.password)
-    print signed_xml
-    shutdown()
-
-
-if __name__ == "__main__":
-    main()
-
-# This code was developed while listening to Fleet Foxes
+"""
+pyxmldsig.py:
+
+A Python module to create and verify XML Digital Signatures (XML-DSig)
+
+This is a simple interface to the PyXMLSec library, aiming to provide a more
+pythonic API suitable for Python applications.
+See http://www.decalage.info/python/pyxmldsig to download the latest version.
+
+May be used as a command-line tool or as a Python module.
+This code is inspired from PyXMLSec samples, with a more pythonic interface:
+http://pyxmlsec.labs.libre-entreprise.org/index.php?section=examples
+
+AUTHOR: Philippe Lagadec (decalage at laposte dot net)
+
+PROJECT WEBSITE: http://www.decalage.info/python/pyxmldsig
+
+LICENSE:
+
+Copyright (c) 2009-2010, Philippe Lagadec (decalage at laposte dot net)
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above copyright
+notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND
+FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+PERFORMANCE OF THIS SOFTWARE.
+
+
+USAGE AS A TOOL:
+pyxmldsig.py <data.xml> -k <key-file.pem> [-c cert-file.pem] [-p password]
+
+To sign or verify many files, directories or a list of files read from stdin
+("-"), with the key loaded once in each worker process:
+pyxmldsig.py sign -k <key-file.pem> [-c cert-file.pem] [-o output-dir] <files, dirs or ->
+pyxmldsig.py verify -c <cert-file.pem> [-c cacert.pem] <files, dirs or ->
+Signed files are written next to the input files with the suffix "_signed"
+(data.xml -> data_signed.xml), or into the output directory. Files of a
+directory with a name ending with the suffix are skipped (signed files of a
+previous run).
+Use "pyxmldsig.py sign -h" for all options.
+An input file named sign, verify or serve is taken as a subcommand: put it
+after "--" (pyxmldsig.py -k <key-file.pem> -- sign).
+
+To run a signing server holding several named keys, used by local processes
+through a Unix domain socket with pyxmldsig_client (without loading the
+libraries and keys in each process):
+pyxmldsig.py serve -s <socket> -k <name>=<key-file.pem>[,<cert-file.pem>] [-k ...]
+
+USAGE IN A PYTHON APPLICATION:
+
+import pyxmldsig
+
+# simple function interface:
+signed_xml = pyxmldsig.sign_file(template_file='myfile.xml',
+    key_file='mykey.pem', cert_file='myx509cert.pem', password='mypassword')
+print signed_xml
+
+# sign with class interface:
+xdsig = pyxmldsig.Xmldsig(key_file='mykey.pem', cert_file='myx509cert.pem',
+    password='mypassword')
+signed_xml1 = xdsig.sign_file('myfile.xml')
+signed_xml2 = xdsig.sign_file(pyxmldsig.TEMPLATE_WITH_CERT)
+
+# insert a signature template built from a choice of algorithms:
+template = pyxmldsig.SignatureTemplate(signature_method=pyxmldsig.RSA_SHA256,
+    digest_method=pyxmldsig.SHA256, c14n_method=pyxmldsig.EXC_C14N)
+signed_xml3 = xdsig.sign_xmlstring('<doc>data</doc>', template)
+
+# sign with ECDSA instead of the RSA-SHA1 algorithms of the templates
+# (see ALGORITHM_SUITES, the key must be an EC key):
+xdsig_ec = pyxmldsig.Xmldsig(key_file='myeckey.pem', cert_file='myeccert.pem',
+    algorithms='ecdsa-sha256')
+signed_xml4 = xdsig_ec.sign_file('myfile.xml')
+
+# sign a document already parsed with libxml2, in place:
+doc = libxml2.parseDoc('<doc>data</doc>')
+signature_node = xdsig.sign_doc(doc, template)
+doc.freeDoc()
+
+# sign a large document by sections, then sign it again after a change,
+# digesting only the changed sections (given by the caller: without changed
+# or versions, all the sections are digested again):
+incremental = pyxmldsig.IncrementalSigner(xdsig, sections='/catalogue/chapter')
+signed_catalogue = incremental.sign_xmlstring(catalogue)
+updated_catalogue = signed_catalogue.replace('old text', 'new text')
+signed_catalogue = incremental.sign_xmlstring(updated_catalogue,
+    changed=['section-3'])
+assert incremental.verify_xmlstring(signed_catalogue) == True
+# or with a version of each section (e.g. from a database), by which the
+# digests are kept in cache:
+signed_catalogue = incremental.sign_xmlstring(catalogue,
+    versions={'chapter-1': 12, 'chapter-2': 7})
+
+# verify with class interface:
+xdsig2 = pyxmldsig.Xmldsig()
+xdsig2.load_certs(['cacert.pem', 'myx509cert.pem'])
+assert xdsig2.verify_xmlstring(signed_xml1) == True
+assert xdsig2.verify_xmlstring(signed_xml2) == True
+
+# verify compact signatures without X509 certificate (TEMPLATE_WITHOUT_CERT),
+# with public keys found by the KeyName of the signature:
+xdsig2.load_public_key('mykey', 'myx509cert.pem')
+
+# verify with many trusted certificates, which may be changed while in use:
+store = pyxmldsig.TrustStore()
+store.add_directory('trusted_certs')
+xdsig3 = pyxmldsig.Xmldsig(trust_store=store)
+assert xdsig3.verify_xmlstring(signed_xml1) == True
+store.remove(store.find_by_subject('CN=Revoked'))
+
+# sign or verify many documents at once (results are in the same order):
+for signed_xml, error in xdsig.sign_many([xmlstring1, xmlstring2]):
+    print signed_xml
+
+# verify all the signatures of a document parsed once (e.g. a bundle of
+# countersigned entries), with ParallelSigner.verify_all to use all cores:
+for path, valid, error in xdsig2.verify_all(bundle_xml):
+    print path, valid
+
+# digest static data referenced by many detached signatures only once:
+xdsig2.digest_cache = pyxmldsig.DigestCache(static_uris=['policy.xml'])
+signature_xml = xdsig2.sign_detached([('policy.xml', open_policy, None),
+                                      ('data.bin', data, None)])
+
+# verify untrusted documents without DTD or entities, with size and depth
+# limits ('huge' lifts the limits of libxml2 for large trusted documents):
+xdsig2.set_parser_profile('strict')
+
+# cache verification results of documents received several times:
+xdsig4 = pyxmldsig.Xmldsig(verify_cache_size=10000, verify_cache_ttl=3600)
+xdsig4.load_certs(['cacert.pem', 'myx509cert.pem'])
+
+# reject malformed signatures cheaply, before parsing and verification:
+xdsig4.prescreen = pyxmldsig.SignaturePrescreen(max_references=1)
+try:
+    xdsig4.verify_xmlstring(xmlstring1)
+except pyxmldsig.SignatureRejected, exc:
+    print exc.reason
+
+# sign many documents with all CPU cores:
+# (a password-protected key is decrypted once for all the workers)
+pyxmldsig.preload_key(key_file='mykey.pem', cert_file='myx509cert.pem', password='mypassword')
+signer = pyxmldsig.ParallelSigner(key_file='mykey.pem', cert_file='myx509cert.pem',
+    password='mypassword')
+for index, signed_xml, error in signer.sign_many(xmlstrings):
+    print index, signed_xml
+signer.shutdown()
+
+# measure the duration of each phase (parse, sign, serialize...):
+xdsig.stats = pyxmldsig.XmldsigStats()
+xdsig.sign_xmlstring(xmlstring1)
+print xdsig.stats.as_dict()
+
+# check for leaks in a long-running signer, and free its objects:
+print pyxmldsig.live_objects()
+xdsig.destroy()
+
+REQUIREMENTS:
+- pyxmlsec: http://pyxmlsec.labs.libre-entreprise.org/
+- xmlsec: http://www.aleksey.com/xmlsec/
+- libxml2: http://xmlsoft.org
+- On Windows see also this site for convenient compiled binaries:
+  http://returnbooleantrue.blogspot.com/2009/04/pyxmlsec-windows-binary.html
+
+REFERENCES:
+- http://www.w3.org/TR/xmldsig-core/
+"""
+
+__version__ = '0.06'
+
+#=== CHANGELOG ================================================================
+
+# 2009-09-10 v0.01 PL: - first version, inspired from pyxmlsec samples
+# 2009-09-14 v0.02 PL: - small improvements, license
+# 2010-05-11 v0.03 PL: - renamed to pyxmldsig
+#                      - X509 cert is now optional
+#                      - a key password may be provided
+# 2010-06-29 v0.04 PL: - added Xmldsig class to load a key once for several
+#                        signatures
+#                      - added signature verification
+#                      - added simple XML-DSIG templates
+# 2010-07-06 v0.05 PL: - added load_cert to load several certificates at once
+# 2026-10-17 v0.06 PL: - added sign_many and verify_many to sign or verify
+#                        many documents with the same signature context
+#                      - Xmldsig objects may be shared by several threads,
+#                        using a pool of signature contexts
+#                      - added ParallelSigner to sign with worker processes
+#                      - loaded keys are kept in a process-wide cache, and
+#                        sign_file/sign_xmlstring reuse Xmldsig objects
+#                      - sign_file and verify_file parse files directly and
+#                        sign_file may write to an output file
+#                      - added AsyncXmldsig for non-blocking operations
+#                      - added SignatureTemplate to insert a signature
+#                        template built from a choice of algorithms
+#                      - added sign_detached and verify_detached for detached
+#                        signatures of several data objects with a Manifest
+#                      - added TrustStore to manage many trusted certificates
+#                      - added load_public_key to verify signatures with a
+#                        KeyName, without embedded X509 certificate
+#                      - added XmldsigStats to measure each phase of signature
+#                        and verification
+#                      - added sign and verify subcommands to process many
+#                        files in parallel from the command line
+#                      - libraries are initialized on first use instead of
+#                        import, added init, shutdown releases the
+#                        references taken by init
+#                      - added optional cache of verification results
+#                      - added sign_doc and verify_doc for parsed documents
+#                      - added SignaturePrescreen to reject invalid signatures
+#                        before parsing and verification
+#                      - keys and certificates may be loaded from memory,
+#                        added preload_key
+#                      - added live_objects and Xmldsig.destroy, fixed a
+#                        leak of documents without root element
+#                      - added ECDSA and Ed25519 algorithms, ALGORITHM_SUITES,
+#                        Xmldsig.set_algorithms and suite_template
+#                      - added SigningServer and the serve subcommand, to sign
+#                        through a Unix socket (see pyxmldsig_client)
+#                      - added IncrementalSigner to sign documents by sections
+#                        and sign them again digesting only changed sections
+#                      - added verify_all to verify all the signatures of a
+#                        document parsed once
+#                      - added DigestCache for the digests of references
+#                        computed by sign_detached and verify_detached
+#                      - added parser profiles (Xmldsig.set_parser_profile),
+#                        removed the global substitution of entities
+
+#=== TODO =====================================================================
+
+# - add option to use keys manager or single key?
+
+#=== IMPORTS ==================================================================
+
+import sys, os, re, time, threading, collections, Queue, hashlib, base64
+import socket, struct, stat, SocketServer, tempfile
+from xml.sax.saxutils import quoteattr
+
+try:
+    import multiprocessing
+except ImportError:
+    # Python < 2.6: ParallelSigner is not available
+    multiprocessing = None
+
+try:
+    import libxml2
+except ImportError:
+    raise ImportError, "libxml2 is required: see http://xmlsoft.org"
+
+try:
+    import xmlsec
+except ImportError:
+    raise ImportError, "pyxmlsec is required: see http://pyxmlsec.labs.libre-entreprise.org"
+
+
+#=== CONSTANTS ================================================================
+
+# XML-DSig namespace:
+DSIG_NS = "http://www.w3.org/2000/09/xmldsig#"
+
+# Algorithm identifiers, to build signature templates (see SignatureTemplate):
+# - canonicalization methods:
+C14N = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+C14N_WITH_COMMENTS = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315#WithComments"
+EXC_C14N = "http://www.w3.org/2001/10/xml-exc-c14n#"
+EXC_C14N_WITH_COMMENTS = "http://www.w3.org/2001/10/xml-exc-c14n#WithComments"
+# - signature methods:
+RSA_SHA1 = "http://www.w3.org/2000/09/xmldsig#rsa-sha1"
+RSA_SHA256 = "http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"
+RSA_SHA384 = "http://www.w3.org/2001/04/xmldsig-more#rsa-sha384"
+RSA_SHA512 = "http://www.w3.org/2001/04/xmldsig-more#rsa-sha512"
+DSA_SHA1 = "http://www.w3.org/2000/09/xmldsig#dsa-sha1"
+ECDSA_SHA256 = "http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256"
+ECDSA_SHA384 = "http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha384"
+ECDSA_SHA512 = "http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha512"
+ED25519 = "http://www.w3.org/2021/04/xmldsig-more#eddsa-ed25519"
+# - digest methods:
+SHA1 = "http://www.w3.org/2000/09/xmldsig#sha1"
+SHA256 = "http://www.w3.org/2001/04/xmlenc#sha256"
+SHA384 = "http://www.w3.org/2001/04/xmldsig-more#sha384"
+SHA512 = "http://www.w3.org/2001/04/xmlenc#sha512"
+# - transforms:
+ENVELOPED_SIGNATURE = "http://www.w3.org/2000/09/xmldsig#enveloped-signature"
+BASE64 = "http://www.w3.org/2000/09/xmldsig#base64"
+# - type of a reference to a Manifest element:
+MANIFEST_TYPE = "http://www.w3.org/2000/09/xmldsig#Manifest"
+
+# algorithms allowed by default by SignaturePrescreen:
+PRESCREEN_C14N_METHODS = (C14N, C14N_WITH_COMMENTS, EXC_C14N,
+    EXC_C14N_WITH_COMMENTS)
+PRESCREEN_SIGNATURE_METHODS = (RSA_SHA1, RSA_SHA256, RSA_SHA384, RSA_SHA512,
+    DSA_SHA1, ECDSA_SHA256, ECDSA_SHA384, ECDSA_SHA512, ED25519)
+PRESCREEN_DIGEST_METHODS = (SHA1, SHA256, SHA384, SHA512)
+PRESCREEN_TRANSFORMS = (ENVELOPED_SIGNATURE, BASE64) + PRESCREEN_C14N_METHODS
+
+# suites of algorithms, see Xmldsig.set_algorithms and suite_template:
+# name: (signature method, digest method, canonicalization method)
+# The signature method must match the type of the private key. ECDSA and
+# Ed25519 are much faster than RSA for signature, but require recent
+# versions of xmlsec and OpenSSL (see algorithm_supported).
+ALGORITHM_SUITES = {
+    'rsa-sha1': (RSA_SHA1, SHA1, C14N),
+    'rsa-sha256': (RSA_SHA256, SHA256, EXC_C14N),
+    'rsa-sha512': (RSA_SHA512, SHA512, EXC_C14N),
+    'ecdsa-sha256': (ECDSA_SHA256, SHA256, EXC_C14N),
+    'ed25519': (ED25519, SHA256, EXC_C14N),
+    }
+
+# names of the digest algorithms in hashlib, for digests computed in Python:
+_HASHLIB_NAMES = {
+    SHA1: 'sha1',
+    SHA256: 'sha256',
+    SHA384: 'sha384',
+    SHA512: 'sha512',
+    }
+
+# flag of xmlsec signature contexts to skip the references of Manifest
+# elements (XMLSEC_DSIG_FLAGS_IGNORE_MANIFESTS in xmlsec/xmldsig.h):
+_DSIG_FLAGS_IGNORE_MANIFESTS = 0x00000001
+
+# Size of the chunks read to compute digests of detached data:
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# Default maximum number of section digests kept in cache by an
+# IncrementalSigner:
+SECTION_CACHE_SIZE = 100000
+
+# Default maximum number of reference digests kept in cache by a
+# DigestCache:
+DIGEST_CACHE_SIZE = 1000
+
+# XML Signature template with X509 certificate:
+# - the X.509 cert tag must be empty, else another one will be appended
+# - KeyName is optional
+TEMPLATE_WITH_CERT = \
+"""<Signature xmlns="http://www.w3.org/2000/09/xmldsig#">
+<SignedInfo>
+  <CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>
+  <SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>
+  <Reference URI="">
+    <Transforms>
+      <Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>
+    </Transforms>
+    <DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/>
+    <DigestValue>TEMPLATE</DigestValue>
+  </Reference>
+</SignedInfo>
+<SignatureValue>TEMPLATE</SignatureValue>
+<KeyInfo>
+  <KeyName/>
+  <X509Data>
+    <X509Certificate></X509Certificate>
+  </X509Data>
+</KeyInfo>
+</Signature>
+"""
+
+# XML Signature template without X509 certificate:
+# - KeyInfo / KeyName is optional
+TEMPLATE_WITHOUT_CERT = \
+"""<Signature xmlns="http://www.w3.org/2000/09/xmldsig#">
+<SignedInfo>
+  <CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>
+  <SignatureMethod Algorithm="http://www.w3.org/2000/09/xmldsig#rsa-sha1"/>
+  <Reference URI="">
+    <Transforms>
+      <Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>
+    </Transforms>
+    <DigestMethod Algorithm="http://www.w3.org/2000/09/xmldsig#sha1"/>
+    <DigestValue>TEMPLATE</DigestValue>
+  </Reference>
+</SignedInfo>
+<SignatureValue>TEMPLATE</SignatureValue>
+<KeyInfo>
+  <KeyName/>
+</KeyInfo>
+</Signature>
+"""
+
+# libxml2 parser option lifting the limits of libxml2 on the size of text
+# nodes and on the depth of documents (missing in old Python bindings):
+XML_PARSE_HUGE = getattr(libxml2, 'XML_PARSE_HUGE', 1 << 19)
+
+# libxml2 parser options of the default parser profile: entities are
+# substituted, and nothing is loaded from the network:
+PARSE_OPTIONS = libxml2.XML_PARSE_NOENT | libxml2.XML_PARSE_NONET
+
+# libxml2 parser options used by SignaturePrescreen: entities are not
+# substituted, so that rejecting a document stays cheap:
+PRESCREEN_PARSE_OPTIONS = libxml2.XML_PARSE_NONET
+
+# Limits of the strict parser profile: size of the XML data in bytes, and
+# depth of the elements:
+STRICT_MAX_SIZE = 10 * 1024 * 1024
+STRICT_MAX_DEPTH = 100
+
+# parser profiles, see Xmldsig.set_parser_profile:
+# name: (libxml2 parser options, forbid DTD, maximum size, maximum depth)
+# - default: entities are substituted and DTDs allowed, within the default
+#   limits of libxml2 (size of text nodes, depth, entity amplification).
+# - strict: for untrusted documents: documents with a DTD (so with entities
+#   other than the predefined ones) are rejected before parsing, and the
+#   size and the depth of documents are bounded.
+# - huge: for large legitimate documents: the limits of libxml2 are lifted
+#   (including its limits on entity expansion, so DTDs are rejected).
+# Maximum size and depth may be None for no limit.
+PARSER_PROFILES = {
+    'default': (PARSE_OPTIONS, False, None, None),
+    'strict': (libxml2.XML_PARSE_NONET, True, STRICT_MAX_SIZE,
+               STRICT_MAX_DEPTH),
+    'huge': (libxml2.XML_PARSE_NONET | XML_PARSE_HUGE, True, None, None),
+    }
+
+# white space between the items of the prolog of XML data:
+_SPACES_RE = re.compile(r'[ \t\r\n]*')
+
+# Size of the beginning of XML files read to look for a DTD in their prolog:
+_PROLOG_SIZE = 64 * 1024
+
+# first bytes of XML data in the encodings which are not compatible with
+# ASCII, with a byte order mark or starting with '<' (see the appendix F of
+# the XML specification), and the codec to decode them:
+_PROLOG_ENCODINGS = [
+    ('\x00\x00\xfe\xff', 4, 'utf-32-be'),
+    ('\xff\xfe\x00\x00', 4, 'utf-32-le'),
+    ('\x00\x00\x00<', 0, 'utf-32-be'),
+    ('<\x00\x00\x00', 0, 'utf-32-le'),
+    ('\xfe\xff', 2, 'utf-16-be'),
+    ('\xff\xfe', 2, 'utf-16-le'),
+    ('\x00<', 0, 'utf-16-be'),
+    ('<\x00', 0, 'utf-16-le'),
+    ('\xef\xbb\xbf', 3, None),
+    ]
+
+# Default maximum number of signature contexts used at the same time by one
+# Xmldsig object, i.e. number of threads which may sign or verify in parallel:
+MAX_CONTEXTS = 8
+
+# Maximum number of loaded keys, and of Xmldsig objects used by the module
+# functions sign_file and sign_xmlstring, kept in cache by the process:
+KEY_CACHE_SIZE = 16
+
+# Protocol of SigningServer (pyxmldsig_client must use the same values):
+# each request is a header (length of the XML data, request id, operation,
+# length of the key name) followed by the key name and the XML data. Each
+# response is a header (length of the data, request id, status) followed by
+# the data: signed XML, "1" (valid) or "0" (invalid) for a verification, or
+# an error message.
+SERVER_REQUEST_HEADER = '!IIBH'
+SERVER_RESPONSE_HEADER = '!IIB'
+SERVER_SIGN = 1
+SERVER_VERIFY = 2
+SERVER_OK = 0
+SERVER_ERROR = 1
+
+# Maximum size of the XML data of a request to SigningServer, in bytes:
+SERVER_MAX_REQUEST_SIZE = 256 * 1024 * 1024
+
+# Maximum number of requests of a connection processed as one batch by
+# SigningServer:
+SERVER_MAX_BATCH = 64
+
+# Size of the reads on SigningServer connections:
+_SERVER_RECV_SIZE = 256 * 1024
+
+#=== CLASSES ==================================================================
+
+class OperationTimeout (RuntimeError):
+    """
+    raised when an asynchronous operation did not finish before its timeout.
+    """
+
+class OperationCancelled (RuntimeError):
+    """
+    raised when the result of a cancelled asynchronous operation is requested.
+    """
+
+class SignatureRejected (RuntimeError):
+    """
+    raised when a signature is rejected by a SignaturePrescreen, before it is
+    verified. The reason attribute describes why.
+    """
+
+    def __init__(self, reason):
+        RuntimeError.__init__(self, reason)
+        self.reason = reason
+
+    def __str__(self):
+        return "Error: signature rejected: %s" % self.reason
+
+
+class SignatureTemplate (object):
+    """
+    XML-DSig signature template built once from a choice of algorithms, and
+    inserted into each document to be signed, so that documents do not need
+    to contain a template.
+    The template is an enveloped signature of the whole document, appended
+    as last child of a target element.
+    """
+
+    def __init__(self, signature_method=RSA_SHA1, digest_method=SHA1,
+                 c14n_method=C14N, transforms=None, key_info=('KeyName', 'X509Data'),
+                 target='/*', namespaces=None):
+        """
+        - signature_method: str, URI of the signature algorithm (RSA_SHA1,
+                            RSA_SHA256, ...).
+        - digest_method: str, URI of the digest algorithm (SHA1, SHA256, ...).
+        - c14n_method: str, URI of the canonicalization algorithm for
+                       SignedInfo (C14N, EXC_C14N, ...).
+        - transforms: list of transform URIs for the reference, or None for
+                      the enveloped signature transform only.
+        - key_info: list of KeyInfo children to be filled at signature time:
+                    'KeyName', 'KeyValue' and/or 'X509Data'. If empty, there is
+                    no KeyInfo.
+        - target: str, XPath expression of the element where the signature is
+                  appended. (by default the root element)
+        - namespaces: dict of prefix:URI for the namespaces used in target.
+        """
+        if transforms is None:
+            transforms = [ENVELOPED_SIGNATURE]
+        self.signature_method = signature_method
+        self.digest_method = digest_method
+        self.c14n_method = c14n_method
+        self.transforms = list(transforms)
+        self.key_info = list(key_info)
+        self.target = target
+        self.namespaces = namespaces or {}
+        self.xml = _signature_xml(c14n_method, signature_method,
+            [_reference_xml('', self.transforms, digest_method)], self.key_info)
+        # the template is parsed once, then copied into each document:
+        _ensure_init()
+        self._doc = libxml2.parseDoc(self.xml)
+        _objects.add('xmlDoc')
+
+    def __str__(self):
+        return self.xml
+
+    def __getstate__(self):
+        # the parsed template cannot be pickled, it is parsed again instead:
+        state = self.__dict__.copy()
+        del state['_doc']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        _ensure_init()
+        self._doc = libxml2.parseDoc(self.xml)
+        _objects.add('xmlDoc')
+
+    def apply(self, doc):
+        """
+        insert a copy of the signature template into the parsed document doc,
+        as last child of the target element.
+        Returns the Signature node inserted.
+        """
+        context = doc.xpathNewContext()
+        try:
+            for prefix, uri in self.namespaces.items():
+                context.xpathRegisterNs(prefix, uri)
+            nodes = context.xpathEval(self.target)
+        finally:
+            context.xpathFreeContext()
+        if not nodes or nodes[0].type != 'element':
+            raise RuntimeError, "Error: target element \"%s\" not found" % self.target
+        node = self._doc.getRootElement().docCopyNode(doc, 1)
+        nodes[0].addChild(node)
+        return node
+
+    def destroy(self):
+        """
+        free the parsed template.
+        """
+        if self._doc is not None:
+            _free_doc(self._doc)
+            self._doc = None
+
+
+class _ReadWriteLock (object):
+    """
+    lock which may be held by several readers at the same time, or by a single
+    writer. Writers have priority over new readers, so that they are not
+    starved under heavy load.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        self._cond.acquire()
+        try:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        finally:
+            self._cond.release()
+
+    def release_read(self):
+        self._cond.acquire()
+        try:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def acquire_write(self):
+        self._cond.acquire()
+        try:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        finally:
+            self._cond.release()
+
+    def release_write(self):
+        self._cond.acquire()
+        try:
+            self._writer = False
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+
+class _LRUCache (object):
+    """
+    thread-safe dictionary with a maximum size: when it is full, the least
+    recently used item is removed to store a new one. Items may also expire
+    after a given time.
+    """
+
+    def __init__(self, max_size, on_evict=None, ttl=None):
+        """
+        - max_size: int, maximum number of items. 0 disables the cache.
+        - on_evict: function called as on_evict(value) for each value removed
+                    from the cache, or None.
+        - ttl: float, time in seconds after which an item expires, or None.
+        """
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self.ttl = ttl
+        self._items = collections.OrderedDict()
+        # expiration time of each item, if ttl is set:
+        self._expires = {}
+        # reentrant lock, which may also be held by users of the cache to
+        # use a value before it can be evicted by another thread:
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        """
+        return the value stored for key, or None if it is not in cache.
+        """
+        self.lock.acquire()
+        try:
+            value = self._items.pop(key, None)
+            if value is not None:
+                if self.ttl is not None and self._expires[key] < time.time():
+                    # expired: removed, as it has already been popped
+                    del self._expires[key]
+                    if self.on_evict is not None:
+                        self.on_evict(value)
+                    return None
+                # move it to the end, as the most recently used item:
+                self._items[key] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def put(self, key, value):
+        """
+        store value for key, removing the least recently used items if the
+        cache is full. Returns False if the cache is disabled.
+        """
+        self.lock.acquire()
+        try:
+            if self.max_size <= 0:
+                return False
+            self._remove(key)
+            while len(self._items) >= self.max_size:
+                self._remove(iter(self._items).next())
+            self._items[key] = value
+            if self.ttl is not None:
+                self._expires[key] = time.time() + self.ttl
+            return True
+        finally:
+            self.lock.release()
+
+    def remove_if(self, predicate):
+        """
+        remove all the items for which predicate(key) is true.
+        """
+        self.lock.acquire()
+        try:
+            for key in [key for key in self._items if predicate(key)]:
+                self._remove(key)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """
+        remove all the items of the cache.
+        """
+        self.remove_if(lambda key: True)
+
+    def resize(self, max_size):
+        """
+        change the maximum size of the cache, removing items if necessary.
+        """
+        self.lock.acquire()
+        try:
+            self.max_size = max_size
+            while len(self._items) > max(max_size, 0):
+                self._remove(iter(self._items).next())
+        finally:
+            self.lock.release()
+
+    def _remove(self, key):
+        value = self._items.pop(key, None)
+        self._expires.pop(key, None)
+        if value is not None and self.on_evict is not None:
+            self.on_evict(value)
+
+
+class _ObjectCounter (object):
+    """
+    thread-safe counters of the xmlsec and libxml2 objects owned by this
+    module, by kind, see live_objects.
+    """
+
+    def __init__(self):
+        self._live = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, count=1):
+        """
+        count objects of a kind which have been created.
+        """
+        self._lock.acquire()
+        try:
+            self._live[kind] = self._live.get(kind, 0) + count
+        finally:
+            self._lock.release()
+
+    def remove(self, kind, count=1):
+        """
+        count objects of a kind which have been destroyed (or given to
+        another object which owns them).
+        """
+        self.add(kind, -count)
+
+    def live(self):
+        """
+        return a dictionary with the number of live objects of each kind.
+        """
+        self._lock.acquire()
+        try:
+            return dict(self._live)
+        finally:
+            self._lock.release()
+
+
+class _PoolRetired (Exception):
+    """
+    raised by _ContextPool.acquire when the pool is retired.
+    """
+
+
+class _SharedKeysMngr (object):
+    """
+    xmlsec keys manager shared by a TrustStore and context pools, with a
+    reference count: it is destroyed when the last reference is released.
+    """
+
+    def __init__(self, keysmngr):
+        self.keysmngr = keysmngr
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        add a reference to the keys manager.
+        """
+        self._lock.acquire()
+        try:
+            self._refs += 1
+        finally:
+            self._lock.release()
+        return self
+
+    def release(self):
+        """
+        remove a reference, and destroy the keys manager after the last one.
+        """
+        self._lock.acquire()
+        try:
+            self._refs -= 1
+            last = self._refs == 0
+        finally:
+            self._lock.release()
+        if last:
+            self.keysmngr.destroy()
+            _objects.remove('KeysMngr')
+
+
+class _SharedXmldsig (object):
+    """
+    Xmldsig object of the cache of the module functions, with a reference
+    count: it is destroyed when the last reference is released, so that an
+    object evicted from the cache is not destroyed while another thread is
+    still using it.
+    """
+
+    def __init__(self, xmldsig):
+        global _shared_xmldsig_count
+        self.xmldsig = xmldsig
+        self._refs = 1
+        self._lock = threading.Lock()
+        _shared_xmldsig_destroyed.acquire()
+        try:
+            _shared_xmldsig_count += 1
+        finally:
+            _shared_xmldsig_destroyed.release()
+
+    def acquire(self):
+        """
+        add a reference to the Xmldsig object.
+        """
+        self._lock.acquire()
+        try:
+            self._refs += 1
+        finally:
+            self._lock.release()
+        return self
+
+    def release(self):
+        """
+        remove a reference, and destroy the Xmldsig object after the last one.
+        """
+        global _shared_xmldsig_count
+        self._lock.acquire()
+        try:
+            self._refs -= 1
+            last = self._refs == 0
+        finally:
+            self._lock.release()
+        if last:
+            try:
+                self.xmldsig.destroy()
+            finally:
+                _shared_xmldsig_destroyed.acquire()
+                try:
+                    _shared_xmldsig_count -= 1
+                    _shared_xmldsig_destroyed.notifyAll()
+                finally:
+                    _shared_xmldsig_destroyed.release()
+
+
+class _ContextPool (object):
+    """
+    bounded pool of xmlsec signature contexts (DSigCtx) bound to one keys
+    manager. Each context is used by a single thread at a time, and is reset
+    and kept for reuse when it is released.
+    """
+
+    def __init__(self, keysmngr, max_contexts=MAX_CONTEXTS, shared_mngr=None):
+        """
+        - keysmngr: xmlsec.KeysMngr used by all the contexts of the pool.
+        - max_contexts: int, maximum number of contexts in use at the same
+          time. acquire() blocks when this limit is reached.
+        - shared_mngr: _SharedKeysMngr holding keysmngr, released when the
+          pool is retired and all its contexts are destroyed, or None.
+        """
+        self.keysmngr = keysmngr
+        self.max_contexts = max_contexts
+        self.shared_mngr = shared_mngr
+        self.retired = False
+        self._idle = []
+        # number of existing contexts, idle or in use:
+        self._count = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        """
+        return an idle context, or create a new one if the limit is not
+        reached. Otherwise wait until a context is released.
+        Raises _PoolRetired if the pool has been retired.
+        """
+        self._cond.acquire()
+        try:
+            while (not self.retired and not self._idle
+                   and self._count >= self.max_contexts):
+                self._cond.wait()
+            if self.retired:
+                raise _PoolRetired
+            if self._idle:
+                return self._idle.pop()
+            self._count += 1
+        finally:
+            self._cond.release()
+        # the new context is created outside of the lock:
+        try:
+            return self._create()
+        except:
+            self._forget()
+            raise
+
+    def reset(self, dsig_ctx):
+        """
+        reset a used context so that it can be used for another signature or
+        verification, without allocating a new one.
+        (a DSigCtx may only be used for one operation between initialize and
+        finalize)
+        Returns the context ready to be reused, or a new one if it could not
+        be reinitialized. If no context can be created, the old one is
+        destroyed anyway, its slot in the pool is freed and an exception is
+        raised: the caller must then neither use nor release it.
+        """
+        try:
+            dsig_ctx.finalize()
+            if dsig_ctx.initialize(self.keysmngr) >= 0:
+                return dsig_ctx
+        except Exception:
+            # the context is in an unknown state: it is replaced below
+            pass
+        try:
+            _destroy_context(dsig_ctx)
+            return self._create()
+        except:
+            self._forget()
+            raise
+
+    def release(self, dsig_ctx):
+        """
+        reset a context obtained from acquire() and put it back into the pool,
+        or destroy it if the pool has been retired.
+        """
+        if self.retired:
+            _destroy_context(dsig_ctx)
+            self._forget()
+            return
+        dsig_ctx = self.reset(dsig_ctx)
+        self._cond.acquire()
+        try:
+            # the pool may have been retired while the context was reset:
+            retired = self.retired
+            if not retired:
+                self._idle.append(dsig_ctx)
+                self._cond.notify()
+        finally:
+            self._cond.release()
+        if retired:
+            _destroy_context(dsig_ctx)
+            self._forget()
+
+    def destroy(self):
+        """
+        destroy all idle contexts. Contexts still in use are not affected.
+        """
+        self._cond.acquire()
+        try:
+            for dsig_ctx in self._idle:
+                _destroy_context(dsig_ctx)
+            self._count -= len(self._idle)
+            self._idle = []
+        finally:
+            self._cond.release()
+
+    def retire(self):
+        """
+        stop using the pool, when its keys manager is replaced: idle contexts
+        are destroyed, and contexts still in use will be destroyed when they
+        are released. The keys manager is then released.
+        """
+        self._cond.acquire()
+        try:
+            self.retired = True
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        self.destroy()
+        self._check_retired()
+
+    def _check_retired(self):
+        """
+        release the keys manager if the pool is retired and has no context.
+        """
+        self._cond.acquire()
+        try:
+            if not self.retired or self._count > 0 or self.shared_mngr is None:
+                return
+            shared_mngr, self.shared_mngr = self.shared_mngr, None
+        finally:
+            self._cond.release()
+        shared_mngr.release()
+
+    def _create(self):
+        """
+        create a new signature context for the keys manager of the pool.
+        """
+        dsig_ctx = xmlsec.DSigCtx(self.keysmngr)
+        if dsig_ctx is None:
+            raise RuntimeError, "Error: failed to create signature context"
+        _objects.add('DSigCtx')
+        return dsig_ctx
+
+    def _forget(self):
+        """
+        called when a context could not be created or reset, to free its slot.
+        """
+        self._cond.acquire()
+        try:
+            self._count -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+        self._check_retired()
+
+
+class Xmldsig (object):
+    """
+    class to sign and verify XML signatures (XML DSig)
+
+    An Xmldsig object may be shared by several threads: sign and verify
+    methods can be called concurrently, each call using its own signature
+    context taken from a bounded pool, while all of them share the same keys
+    manager and loaded keys. load() and load_certs() may also be called while
+    other threads are signing: they wait until running operations are
+    finished.
+
+    Note about performance: pyxmlsec and the libxml2 Python bindings do not
+    release the GIL while they run, so parsing, canonicalization, digests and
+    RSA operations of several threads are serialized. Sharing an Xmldsig
+    object saves loading keys for each thread or request, but does not use
+    more than one CPU core: use several processes for that.
+    Also, with OpenSSL versions older than 1.1.0, xmlsec-openssl is only
+    thread-safe if locking callbacks are installed, which is done by importing
+    the ssl module of Python before using threads.
+    """
+
+    def __init__(self, key_file=None, cert_file=None, password='', key_name=None,
+                 max_contexts=MAX_CONTEXTS, template=None, trust_store=None,
+                 stats=None, verify_cache_size=0, verify_cache_ttl=None,
+                 prescreen=None, key_data=None, cert_data=None,
+                 algorithms=None, digest_cache=None, parser_profile='default'):
+        """
+        - key_file: str, filename of PEM file containing the private key.
+                    (the file should NOT be password-protected)
+        - cert_file: str, filename of PEM file containing the X509 certificate.
+                     (optional: can be None)
+        - password: str, password to open key file, or None if no password.
+        - key_name: str, name for the key in the signature, or None if omitted.
+        - max_contexts: int, maximum number of threads which may sign or
+                        verify at the same time with this object.
+        - template: SignatureTemplate inserted into the documents to be
+                    signed which do not contain a Signature element, or None.
+        - trust_store: TrustStore containing the certificates used for
+                       verification, or None, see use_trust_store.
+        - stats: XmldsigStats object collecting the duration of each phase
+                 of signature and verification, or None to disable it.
+                 (it may also be set or removed later with the stats
+                 attribute)
+        - verify_cache_size: int, maximum number of results of
+                             verify_xmlstring kept in cache, see
+                             clear_verify_cache. 0 disables the cache.
+        - verify_cache_ttl: float, time in seconds after which a cached
+                            result is verified again, or None.
+        - prescreen: SignaturePrescreen checking the signatures before they
+                     are parsed and verified, or None. Rejected signatures
+                     raise SignatureRejected. (it may also be set or removed
+                     later with the prescreen attribute)
+        - key_data, cert_data: str, contents of PEM files for the private key
+                               and the certificate, instead of key_file and
+                               cert_file, see load.
+        - algorithms: str, name of a suite of ALGORITHM_SUITES used for the
+                      signatures instead of the algorithms of the templates,
+                      or None. See set_algorithms.
+        - digest_cache: DigestCache used by sign_detached and verify_detached
+                        for the digests of the references, or None. (it may
+                        be shared by several Xmldsig objects, and set or
+                        removed later with the digest_cache attribute)
+        - parser_profile: str, name of the profile of PARSER_PROFILES used
+                          to parse XML data, see set_parser_profile.
+        """
+        self.template = template
+        self.stats = stats
+        self.prescreen = prescreen
+        self.digest_cache = digest_cache
+        # algorithms replacing those of the templates, see set_algorithms:
+        self.algorithms = None
+        if algorithms is not None:
+            self.set_algorithms(algorithms)
+        self.set_parser_profile(parser_profile)
+        # cache of verification results, and generation number of the keys
+        # and certificates used for verification, which is part of the keys
+        # of the cache:
+        self._verify_cache = _LRUCache(verify_cache_size, ttl=verify_cache_ttl)
+        self._verify_generation = 0
+        # TEST: single key
+        self.key = None
+        # lock to protect the keys manager while keys are loaded:
+        self._lock = _ReadWriteLock()
+        # public keys registered by name for verification, see
+        # load_public_key:
+        self._public_keys = {}
+        # Create and initialize keys manager
+        self.keysmngr = _create_keys_mngr()
+        self._pool = _ContextPool(self.keysmngr, max_contexts)
+        # trust store used for verification, with the context pool for its
+        # current keys manager:
+        self._trust_store = None
+        self._trust_pool = None
+        self._trust_lock = threading.Lock()
+        try:
+            if trust_store is not None:
+                self.use_trust_store(trust_store)
+            # load key
+            self.load(key_file, cert_file, password, key_name, key_data,
+                cert_data)
+        except:
+            # the object is not returned to the caller, who could not
+            # destroy it:
+            self.destroy()
+            raise
+
+
+    def load(self, key_file=None, cert_file=None, password='', key_name=None,
+             key_data=None, cert_data=None):
+        """
+        load a private key and/or a public certificate for signature and verification
+
+        - key_file: str, filename of PEM file containing the private key.
+                    (the file should NOT be password-protected)
+        - cert_file: str, filename of PEM file containing the X509 certificate.
+                     (optional: can be None)
+        - password: str, password to open key file, or None if no password.
+        - key_data: str, contents of a PEM private key, instead of key_file.
+        - cert_data: str, contents of a PEM certificate, instead of
+                     cert_file.
+
+        Loaded keys are kept in a process-wide cache (see preload_key), so
+        that a password-protected key is decrypted only once.
+        """
+        # the keys manager must not be modified during signature/verification:
+        self._lock.acquire_write()
+        try:
+            self._load(key_file, cert_file, password, key_name, key_data,
+                cert_data)
+        finally:
+            self._lock.release_write()
+
+
+    def _load(self, key_file, cert_file, password, key_name, key_data=None,
+              cert_data=None):
+        """
+        load a key and/or a certificate into the keys manager: see load().
+        """
+        self._invalidate_verify_cache()
+        if key_file is not None or key_data is not None:
+            # Load private key with optional certificate, or get it from cache
+            key = _load_key(key_file, cert_file, password, key_name, key_data,
+                cert_data)
+            # load key into manager:
+            if xmlsec.cryptoAppDefaultKeysMngrAdoptKey(self.keysmngr, key) < 0:
+                _destroy_key(key)
+                raise RuntimeError, "Error: failed to load key into keys manager"
+            # the key now belongs to the keys manager:
+            _objects.remove('Key')
+
+        elif cert_data is not None:
+            # certificate from memory, without private key
+            if self.keysmngr.certLoadMemory(cert_data, len(cert_data),
+                    xmlsec.KeyDataFormatPem, xmlsec.KeyDataTypeTrusted) < 0:
+                raise RuntimeError, "Error: failed to load PEM certificate from memory"
+
+        elif cert_file is not None:
+            # case when we only want to load a cert without private key
+            if self.keysmngr.certLoad(cert_file, xmlsec.KeyDataFormatPem,
+                             xmlsec.KeyDataTypeTrusted) < 0:
+                # is it better to keep the keys manager if an error occurs?
+                #self.keysmngr.destroy()
+                raise RuntimeError, "Error: failed to load PEM certificate from \"%s\"" % cert_file
+            if key_name is not None:
+                # the public key of the certificate is also registered with
+                # its name, to verify signatures without embedded X509 cert
+                # (a certificate must be loaded with the CertPem format to
+                # get a key, not Pem)
+                self._add_public_key(key_name, _load_public_key(cert_file,
+                    key_name))
+
+
+    def load_public_key(self, key_name, filename):
+        """
+        Load a public key or a certificate from a PEM file, and register it
+        with a name for signature verification: signatures containing
+        <KeyName>key_name</KeyName> in KeyInfo are verified with this key,
+        without any embedded X509 certificate (see TEMPLATE_WITHOUT_CERT).
+        The key is found by a dictionary lookup, whatever the number of
+        registered keys.
+        A registered key is trusted as is: a certificate loaded this way is
+        not verified against the trusted certificates.
+
+        - key_name: str, name of the key in the signatures. A key previously
+                    registered with the same name is replaced.
+        - filename: str, PEM file containing a public key or a certificate.
+        """
+        key = _load_public_key(filename, key_name)
+        self._lock.acquire_write()
+        try:
+            self._add_public_key(key_name, key)
+        finally:
+            self._lock.release_write()
+
+
+    def load_public_keys(self, public_keys):
+        """
+        Load and register several public keys, see load_public_key.
+
+        - public_keys: dict {key_name: filename}
+        """
+        for key_name, filename in public_keys.items():
+            self.load_public_key(key_name, filename)
+
+
+    def remove_public_key(self, key_name):
+        """
+        Remove a public key registered with load_public_key.
+        Returns True if the key was registered, False otherwise.
+        """
+        self._lock.acquire_write()
+        try:
+            key = self._public_keys.pop(key_name, None)
+            self._invalidate_verify_cache()
+        finally:
+            self._lock.release_write()
+        if key is None:
+            return False
+        _destroy_key(key)
+        return True
+
+
+    def public_key_names(self):
+        """
+        Returns the list of the names of the registered public keys.
+        """
+        return self._public_keys.keys()
+
+
+    def _add_public_key(self, key_name, key):
+        """
+        register a loaded public key: the write lock must be held.
+        """
+        old_key = self._public_keys.get(key_name)
+        self._public_keys[key_name] = key
+        self._invalidate_verify_cache()
+        # keys are duplicated for each verification, so the old key is not
+        # used by any signature context:
+        if old_key is not None:
+            _destroy_key(old_key)
+
+
+    def use_trust_store(self, trust_store):
+        """
+        use the certificates of a TrustStore for signature verification,
+        instead of the certificates loaded with load and load_certs.
+        When the content of the trust store changes, the following
+        verifications use the new content, without interrupting the running
+        ones.
+
+        - trust_store: TrustStore object, or None to use the loaded
+                       certificates again.
+        """
+        self._trust_lock.acquire()
+        try:
+            self._trust_store = trust_store
+            old_pool, self._trust_pool = self._trust_pool, None
+            self._invalidate_verify_cache()
+        finally:
+            self._trust_lock.release()
+        if old_pool is not None:
+            old_pool.retire()
+
+
+    def set_algorithms(self, suite=None, signature_method=None,
+                       digest_method=None, c14n_method=None):
+        """
+        Choose the algorithms of the signatures made by this object: the
+        algorithms of the signature templates (in the documents, or inserted
+        from a SignatureTemplate) are replaced before signing, so that
+        existing documents built with TEMPLATE_WITH_CERT (RSA-SHA1) may be
+        signed with faster or stronger algorithms.
+
+        - suite: str, name of a suite of ALGORITHM_SUITES ('rsa-sha256',
+                 'ecdsa-sha256', 'ed25519', ...), or None.
+        - signature_method, digest_method, c14n_method: str, algorithm URIs
+                 replacing those of the suite. None keeps the algorithm of
+                 the suite, or of the template.
+
+        Without arguments, the algorithms of the templates are used again.
+        The signature method must match the private key (ECDSA_SHA256
+        requires an EC key, ED25519 an Ed25519 key). Raises RuntimeError if
+        an algorithm is not supported by xmlsec, see algorithm_supported.
+        """
+        algorithms = [signature_method, digest_method, c14n_method]
+        if suite is not None:
+            if suite not in ALGORITHM_SUITES:
+                raise RuntimeError, "Error: unknown algorithm suite \"%s\"" % suite
+            for index, uri in enumerate(ALGORITHM_SUITES[suite]):
+                if algorithms[index] is None:
+                    algorithms[index] = uri
+        for uri in algorithms:
+            if uri is not None and not algorithm_supported(uri):
+                raise RuntimeError, "Error: algorithm \"%s\" is not supported by xmlsec" % uri
+        if algorithms == [None, None, None]:
+            self.algorithms = None
+        else:
+            self.algorithms = tuple(algorithms)
+
+
+    def set_parser_profile(self, profile):
+        """
+        Choose the options and limits of the parser for the XML data signed
+        and verified by this object (strings and files):
+
+        - profile: str, name of a profile of PARSER_PROFILES:
+            - 'default': entities are substituted, within the default limits
+                         of libxml2.
+            - 'strict': for untrusted data: DTDs (and so entities) are
+                        rejected, as well as documents larger than
+                        STRICT_MAX_SIZE bytes or deeper than STRICT_MAX_DEPTH
+                        elements.
+            - 'huge': for large trusted data: the limits of libxml2 on the
+                      size and depth of documents are lifted, and DTDs are
+                      rejected.
+
+        Data exceeding the limits of the profile raise RuntimeError. Nothing
+        is ever loaded from the network while parsing. The cached
+        verification results are removed, as they may have been obtained
+        with another profile.
+        """
+        if profile not in PARSER_PROFILES:
+            raise RuntimeError, "Error: unknown parser profile \"%s\"" % profile
+        self.parser_profile = profile
+        self._parser_profile = PARSER_PROFILES[profile]
+        # (called by __init__ before the cache is created)
+        if hasattr(self, '_verify_cache'):
+            self._invalidate_verify_cache()
+
+
+    def destroy(self):
+        """
+        Free the xmlsec objects of this Xmldsig object: signature contexts,
+        registered public keys and keys manager (with its keys and
+        certificates). It must not be used after that, and all its
+        operations must be finished (including sign_many and verify_many
+        generators).
+        xmlsec objects are not freed by the garbage collector: an Xmldsig
+        object which is not used anymore should be destroyed, in long-running
+        processes which create many of them.
+        """
+        self._lock.acquire_write()
+        try:
+            if self.keysmngr is None:
+                return
+            self._pool.destroy()
+            self.use_trust_store(None)
+            for key in self._public_keys.values():
+                _destroy_key(key)
+            self._public_keys = {}
+            self._verify_cache.clear()
+            self.keysmngr.destroy()
+            _objects.remove('KeysMngr')
+            self.keysmngr = None
+        finally:
+            self._lock.release_write()
+
+
+    def load_certs(self, certificates):
+        """
+        load one or several certificates into the keys manager for signature
+        verification. For example, load the CA cert, any number of intermediate
+        certs, and the cert corresponding to the key used for the signature.
+
+        certificates: list or tuple containing certificate file names
+        """
+        for cert in certificates:
+            self.load(cert_file=cert)
+
+
+    def sign_file (self, template_file, output_file=None, template=None):
+        """
+        Sign a XML file using the signature template in the XML file.
+        The certificate from cert_file is placed in the <dsig:X509Data/> node.
+        A file given by its name is parsed directly by libxml2, without
+        reading it into a Python string first. A file object is read from its
+        current position.
+
+        - template_file: str, filename of XML file containing an XML-DSig
+                         template, or file object opened for reading.
+        - output_file: str, filename where the signed XML data is written, or
+                       file object opened for writing, or None.
+                       (the signed XML data is then written directly from
+                       the parsed document, without a copy in a string)
+        - template: SignatureTemplate to be inserted into the document before
+                    signature, or None if the document contains a template.
+
+        Returns a string containing the signed XML data, or None if
+        output_file is provided.
+        Raises an exception if an error occurs.
+        """
+        return self._with_context(self._sign_file_with_context, template_file,
+            output_file, template)
+
+
+    def sign_xmlstring (self, xmlstring, template=None):
+        """
+        Sign xmlstring using the signature template in xmlstring.
+        The certificate from cert_file is placed in the <dsig:X509Data/> node.
+
+        - xmlstring: str, XML data containing an XML-DSig template.
+        - template: SignatureTemplate to be inserted into the document before
+                    signature, or None if xmlstring contains a template.
+
+        Returns a string containing the signed XML data.
+        Raises an exception if an error occurs.
+        """
+        return self._with_context(self._sign_with_context, xmlstring, template)
+
+
+    def sign_many (self, xmlstrings, template=None):
+        """
+        Sign several XML strings, reusing the signature contexts of the pool
+        instead of creating and destroying one for each document.
+
+        - xmlstrings: iterable of str, XML data containing XML-DSig templates.
+        - template: SignatureTemplate to be inserted into each document, or
+                    None.
+
+        This is a generator: it yields one tuple (signed_xml, error) for each
+        input, in the same order as the inputs. If the signature succeeded,
+        error is None. If it failed, signed_xml is None and error is the
+        exception which was raised, so that one bad document does not stop
+        the whole batch.
+        A context is only held while a document is signed, not between
+        results: the caller may use this object while iterating (even with
+        max_contexts=1), and the results may be consumed at any pace.
+        """
+        for xmlstring in xmlstrings:
+            try:
+                output = self._with_context(self._sign_with_context,
+                    xmlstring, template)
+            except Exception, exc:
+                output, error = None, exc
+            else:
+                error = None
+            yield (output, error)
+
+
+    def verify_file (self, xmlfile):
+        """
+        Verify signature in XML file using the loaded certificate.
+        A regular file given by its name is parsed directly by libxml2,
+        without reading it into a Python string first. A file object (read
+        from its current position) or a pipe is read into memory, and checked
+        by the prescreen if any before it is parsed.
+
+        - xmlfile: str, filename of XML file containing an XML-DSig signature,
+                   or file object opened for reading.
+
+        Returns True if the signature is valid, False otherwise.
+        Raises an exception if an error occurs.
+        """
+        if self.prescreen is not None:
+            if isinstance(xmlfile, basestring) and os.path.isfile(xmlfile):
+                self._run_prescreen(self.prescreen.check_file, xmlfile)
+            else:
+                # a file object or a pipe cannot be read twice: its data is
+                # read once, checked and parsed from memory
+                xmlstring = _read_xml_file(xmlfile, self._parser_profile)
+                self._run_prescreen(self.prescreen.check, xmlstring)
+                return self._with_verify_context(self._verify_with_context,
+                    xmlstring)
+        return self._with_verify_context(self._verify_file_with_context, xmlfile)
+
+
+    def verify_xmlstring (self, xmlstring):
+        """
+        Verify signature in xmlstring using the loaded certificate.
+
+        - xmlstring: str, XML data containing an XML-DSig signature.
+
+        Returns True if the signature is valid, False otherwise.
+        Raises an exception if an error occurs.
+        """
+        cache_key = self._verify_cache_key(xmlstring)
+        if cache_key is not None:
+            valid = self._verify_cache.get(cache_key)
+            if valid is not None:
+                return valid
+        if self.prescreen is not None:
+            self._run_prescreen(self.prescreen.check, xmlstring)
+        valid = self._with_verify_context(self._verify_with_context, xmlstring)
+        if cache_key is not None:
+            self._verify_cache.put(cache_key, valid)
+        return valid
+
+
+    def verify_many (self, xmlstrings):
+        """
+        Verify signatures in several XML strings, reusing the signature
+        contexts of the pool.
+
+        - xmlstrings: iterable of str, XML data containing XML-DSig signatures.
+
+        This is a generator: it yields one tuple (valid, error) for each input,
+        in the same order as the inputs. valid is True if the signature is
+        valid, False if it is invalid. If an error occurred, valid is None and
+        error is the exception which was raised.
+        As for sign_many, no context is held between results.
+        """
+        for xmlstring in xmlstrings:
+            try:
+                valid = self.verify_xmlstring(xmlstring)
+            except Exception, exc:
+                valid, error = None, exc
+            else:
+                error = None
+            yield (valid, error)
+
+
+    def verify_all (self, xmlstring):
+        """
+        Verify all the signatures of xmlstring, for example the countersigned
+        entries of a bundle: the document is parsed once, and every Signature
+        element (in document order, including nested ones) is verified with
+        the same keys manager and signature context.
+        See ParallelSigner.verify_all to use several processes.
+
+        - xmlstring: str, XML data containing XML-DSig signatures.
+
+        Returns a list of tuples (path, valid, error), one for each Signature
+        element: path is the XPath of the Signature element (as given by
+        libxml2), valid is True if the signature is valid, False if it is
+        invalid. If an error occurred for a signature, valid is None and
+        error is the exception which was raised.
+        Raises an exception if the document cannot be parsed, or
+        SignatureRejected if the prescreen rejects one of the signatures.
+        """
+        return [(path, valid, error) for index, path, valid, error
+            in self._verify_all(xmlstring)]
+
+
+    def _verify_all (self, xmlstring, share=None):
+        """
+        verify the signatures of xmlstring, see verify_all.
+        - share: tuple (part, parts) to verify only the signatures whose index
+                 modulo parts is part, or None to verify all of them.
+        Returns a list of tuples (index, path, valid, error).
+        """
+        if self.prescreen is not None:
+            # every signature is checked, not only the first one:
+            self._run_prescreen(self.prescreen.check_all, xmlstring)
+        stats = self._get_stats()
+        results = []
+        self._lock.acquire_read()
+        try:
+            pool, dsig_ctx = self._acquire_verify_context()
+            doc = None
+            try:
+                stats.add_bytes(bytes_in=len(xmlstring))
+                doc = stats.call('parse', self._parse_xmlstring, xmlstring)
+                for index, node in enumerate(_signature_nodes(doc)):
+                    if share is not None and index % share[1] != share[0]:
+                        continue
+                    try:
+                        valid = self._verify_node(dsig_ctx, node)
+                    except Exception, exc:
+                        valid, error = None, exc
+                    else:
+                        error = None
+                    results.append((index, node.nodePath(), valid, error))
+                    # get the context ready for the next signature:
+                    try:
+                        dsig_ctx = pool.reset(dsig_ctx)
+                    except:
+                        dsig_ctx = None
+                        raise
+            finally:
+                if doc is not None:
+                    _free_doc(doc)
+                if dsig_ctx is not None:
+                    pool.release(dsig_ctx)
+        finally:
+            self._lock.release_read()
+        return results
+
+
+    def sign_doc (self, doc, template=None, return_string=False):
+        """
+        Sign a document already parsed with libxml2, in place, without
+        serializing and parsing it again.
+
+        - doc: libxml2.xmlDoc, or libxml2.xmlNode (an element of a document,
+               where the signature template is searched)
+        - template: SignatureTemplate to be inserted into the document before
+                    signing, see sign_xmlstring. (its target is relative to
+                    the whole document, even if doc is an element)
+        - return_string: bool, if True return the signed document serialized
+                         as a string, else return the Signature node.
+
+        The document still belongs to the caller, who must free it: it is
+        only modified to add the signature. It must not be used by other
+        threads during the call. The Signature node returned belongs to the
+        document, and is valid until the document is freed.
+        The document should be parsed with the options of the parser profile
+        (see PARSER_PROFILES, PARSE_OPTIONS by default), like the documents
+        parsed by this module.
+        Raises an exception if an error occurs.
+        """
+        node = self._with_context(self._sign_doc, doc, template)
+        if return_string:
+            return str(_document(doc))
+        return node
+
+
+    def verify_doc (self, doc):
+        """
+        Verify the signature in a document already parsed with libxml2,
+        without serializing and parsing it again.
+
+        - doc: libxml2.xmlDoc, or libxml2.xmlNode (an element of a document,
+               where the signature is searched)
+
+        The document still belongs to the caller, who must free it. It must
+        not be modified by other threads during the call (xmlsec may add
+        attributes used as IDs to it).
+        Returns True if the signature is valid, False otherwise.
+        Raises an exception if an error occurs.
+        """
+        return self._with_verify_context(self._verify_doc, doc)
+
+
+    def sign_detached (self, references, template=None, workers=4):
+        """
+        Create a detached signature for several data objects, such as files
+        or attachments referenced by URIs.
+        The digests of the data are computed in parallel by worker threads,
+        reading the data by chunks, and stored in a Manifest element. Only
+        the Manifest is referenced by SignedInfo, so that the signature is
+        computed once for all the references.
+        The URIs are only written in the signature, the data is always read
+        from the provided sources: for example a file can be signed before it
+        is published at a http URI.
+
+        - references: list of tuples (uri, source, transforms):
+            - uri: str, URI of the data, written in the Reference element.
+            - source: str containing the data, or file object opened for
+                      reading, or function returning a file object (which is
+                      then closed after reading).
+            - transforms: list of transform URIs applied to the data before
+                          the digest: BASE64, C14N, EXC_C14N (for XML data,
+                          parsed with the parser profile of this object, see
+                          set_parser_profile) or None.
+        - template: SignatureTemplate giving the algorithms and KeyInfo to be
+                    used, or None for the defaults of SignatureTemplate.
+        - workers: int, number of threads computing the digests.
+
+        Returns a string containing the signature (a Signature element).
+        Raises an exception if an error occurs.
+        """
+        if template is None:
+            # only its algorithms and KeyInfo are used:
+            template = SignatureTemplate()
+            template.destroy()
+        items = [(uri, source, transforms, template.digest_method)
+            for uri, source, transforms in references]
+        digests = self._get_stats().call('digest', _compute_digests, items,
+            workers, self.digest_cache, False, self.parser_profile)
+        manifest = ''.join([_reference_xml(uri, transforms, template.digest_method,
+            digest) for (uri, source, transforms), digest in zip(references, digests)])
+        xml = _signature_xml(template.c14n_method, template.signature_method,
+            [_reference_xml('#manifest', [template.c14n_method],
+            template.digest_method, reference_type=MANIFEST_TYPE)],
+            template.key_info,
+            objects=['<Manifest Id="manifest">\n%s</Manifest>' % manifest])
+        return self._with_context(self._sign_detached_with_context, xml)
+
+
+    def verify_detached (self, xmlstring, sources, workers=4):
+        """
+        Verify a detached signature created by sign_detached: the signature
+        of SignedInfo and of the Manifest it references, then the digests of
+        all the references of the Manifest, computed in parallel.
+
+        - xmlstring: str, XML data containing the signature.
+        - sources: dict of URI:source, with the data of each reference (see
+                   sign_detached for the types of sources).
+        - workers: int, number of threads computing the digests.
+
+        Returns True if the signature and all the references are valid, False
+        otherwise: when the Manifest is empty, or when sources does not
+        contain exactly the URIs of the references.
+        Raises an exception if an error occurs, or if a source is a unicode
+        string (the data must be encoded first).
+        """
+        references = self._with_verify_context(
+            self._verify_detached_with_context, xmlstring)
+        # nothing is signed by an empty Manifest, and all the sources must
+        # be signed:
+        if not references or set(sources) != set([reference[0]
+                                                   for reference in references]):
+            return False
+        items = [(uri, sources[uri], transforms, digest_method)
+            for uri, transforms, digest_method, digest in references]
+        # (the digests of the sources are never taken from the cache by URI)
+        digests = self._get_stats().call('digest', _compute_digests, items,
+            workers, self.digest_cache, True, self.parser_profile)
+        for (uri, transforms, digest_method, digest), computed in zip(references,
+                                                                      digests):
+            # (whitespace has been removed from digest)
+            if digest != computed:
+                return False
+        return True
+
+
+    def _sign_detached_with_context (self, dsig_ctx, xmlstring):
+        """
+        sign the detached signature template xmlstring with the signature
+        context dsig_ctx, without processing the Manifest references.
+        """
+        doc = None
+        try:
+            doc = self._parse_xmlstring(xmlstring)
+            self._sign_manifest_signature(dsig_ctx, doc.getRootElement())
+            return str(doc)
+        finally:
+            if doc is not None:
+                _free_doc(doc)
+
+
+    def _verify_detached_with_context (self, dsig_ctx, xmlstring):
+        """
+        verify the signature of SignedInfo in xmlstring, without processing
+        the Manifest references.
+        Returns the list of Manifest references signed, as tuples (uri,
+        transforms, digest_method, digest), or None if the signature is not
+        valid.
+        """
+        doc = None
+        try:
+            doc = self._parse_xmlstring(xmlstring)
+            node = xmlsec.findNode(doc.getRootElement(), xmlsec.NodeSignature,
+                                   xmlsec.DSigNs)
+            if node is None:
+                raise RuntimeError, "Error: XML-DSIG node not found"
+            return self._verify_manifest_signature(dsig_ctx, doc, node)
+        finally:
+            if doc is not None:
+                _free_doc(doc)
+
+
+    def _sign_manifest_signature (self, dsig_ctx, node):
+        """
+        sign the Signature template node with the signature context dsig_ctx,
+        without processing the references of its Manifest elements (their
+        digests must be in the template).
+        """
+        dsig_ctx.flags = _DSIG_FLAGS_IGNORE_MANIFESTS
+        if self._get_stats().call('sign', dsig_ctx.sign, node) < 0:
+            raise RuntimeError, "Error: signature failed"
+
+
+    def _verify_manifest_signature (self, dsig_ctx, doc, node):
+        """
+        verify the signature of SignedInfo of the Signature node in the parsed
+        document doc, without processing the Manifest references.
+        Returns the list of Manifest references signed, as tuples (uri,
+        transforms, digest_method, digest), or None if the signature is not
+        valid.
+        """
+        dsig_ctx.flags = _DSIG_FLAGS_IGNORE_MANIFESTS
+        self._set_public_key(dsig_ctx, node)
+        result = self._get_stats().call('verify', dsig_ctx.verify, node)
+        if result < 0:
+            raise RuntimeError, "Error: An error occured, the signature could not be verified"
+        if dsig_ctx.status != xmlsec.DSigStatusSucceeded:
+            return None
+        return _signed_manifest_references(doc, node)
+
+
+    def _with_context (self, function, *args):
+        """
+        call function(dsig_ctx, *args) with a signature context taken from the
+        pool, and return its result.
+        """
+        # try block to ensure cleanup is called even if an exception is raised:
+        self._lock.acquire_read()
+        try:
+            # get a signature context from the pool
+            dsig_ctx = self._pool.acquire()
+            try:
+                return function(dsig_ctx, *args)
+            finally:
+                # cleanup, even if an exception has been raised:
+                self._pool.release(dsig_ctx)
+        finally:
+            self._lock.release_read()
+
+
+    def clear_verify_cache (self):
+        """
+        Remove all the results kept in the verification cache.
+        Verification results are cached if verify_cache_size is set, keyed by
+        a SHA-256 digest of the exact XML string, so that verifying the same
+        string again does not parse nor verify it. The cache is cleared
+        automatically when keys or certificates are loaded (load, load_certs,
+        load_public_key, ...) or when another trust store or parser profile
+        is used, and the results obtained with a previous generation of the
+        trust store or with another prescreen are not used.
+        """
+        self._invalidate_verify_cache()
+
+
+    def _get_stats (self):
+        """
+        return the XmldsigStats object of this object, or a _NoStats object
+        which does not measure anything if stats is None.
+        """
+        stats = self.stats
+        if stats is None:
+            return _NO_STATS
+        return stats
+
+
+    def _run_prescreen (self, check, data):
+        """
+        call check(data), a method of the SignaturePrescreen.
+        """
+        self._get_stats().call('prescreen', check, data)
+
+
+    def _verify_cache_key (self, xmlstring):
+        """
+        return the key of xmlstring in the verification cache, or None if the
+        cache is disabled.
+        """
+        if self._verify_cache.max_size <= 0:
+            return None
+        trust_store = self._trust_store
+        if trust_store is None:
+            trust_generation = None
+        else:
+            trust_generation = trust_store.generation
+        # SHA-256 and not a faster hash: a collision would make an invalid
+        # document valid. The prescreen object itself is part of the key (and
+        # not its id, which could be reused by another object), so that a
+        # result is not used after another prescreen is set:
+        return (hashlib.sha256(xmlstring).digest(), self._verify_generation,
+                trust_generation, self.prescreen)
+
+
+    def _invalidate_verify_cache (self):
+        """
+        change the generation number of the verification cache and remove its
+        results, when keys or certificates change.
+        """
+        self._verify_cache.lock.acquire()
+        try:
+            # results of verifications still running are stored with the
+            # previous generation, and are never used:
+            self._verify_generation += 1
+            self._verify_cache.clear()
+        finally:
+            self._verify_cache.lock.release()
+
+
+    def _with_verify_context (self, function, *args):
+        """
+        call function(dsig_ctx, *args) with a signature context for
+        verification, using the trust store if any, and return its result.
+        """
+        self._lock.acquire_read()
+        try:
+            pool, dsig_ctx = self._acquire_verify_context()
+            try:
+                return function(dsig_ctx, *args)
+            finally:
+                pool.release(dsig_ctx)
+        finally:
+            self._lock.release_read()
+
+
+    def _acquire_verify_context (self):
+        """
+        return a tuple (pool, dsig_ctx) with a signature context for
+        verification, and the pool where it must be released.
+        """
+        while True:
+            pool = self._verify_pool()
+            try:
+                return pool, pool.acquire()
+            except _PoolRetired:
+                # the trust store has just been modified, try again with the
+                # new keys manager
+                continue
+
+
+    def _verify_pool (self):
+        """
+        return the context pool to be used for verification: the one of the
+        current keys manager of the trust store if any, or the default one.
+        """
+        self._trust_lock.acquire()
+        try:
+            trust_store = self._trust_store
+            if trust_store is None:
+                return self._pool
+            pool = self._trust_pool
+            if pool is not None and pool.generation == trust_store.generation:
+                return pool
+            shared_mngr, generation = trust_store.keys_manager()
+            new_pool = _ContextPool(shared_mngr.keysmngr,
+                self._pool.max_contexts, shared_mngr)
+            new_pool.generation = generation
+            self._trust_pool = new_pool
+        finally:
+            self._trust_lock.release()
+        if pool is not None:
+            pool.retire()
+        return new_pool
+
+
+    def _sign_with_context (self, dsig_ctx, xmlstring, template=None):
+        """
+        sign xmlstring using the signature context dsig_ctx, and return the
+        signed XML data as a string.
+        """
+        doc = None
+        stats = self._get_stats()
+        try:
+            # Load template
+            stats.add_bytes(bytes_in=len(xmlstring))
+            doc = stats.call('parse', self._parse_xmlstring, xmlstring)
+            self._sign_doc(dsig_ctx, doc, template)
+            signed_xml = stats.call('serialize', str, doc)
+            stats.add_bytes(bytes_out=len(signed_xml))
+            return signed_xml
+        finally:
+            if doc is not None:
+                _free_doc(doc)
+
+
+    def _sign_file_with_context (self, dsig_ctx, template_file, output_file,
+                                 template=None):
+        """
+        sign the XML file template_file using the signature context dsig_ctx,
+        and write the signed XML data to output_file, or return it as a string
+        if output_file is None.
+        """
+        doc = None
+        stats = self._get_stats()
+        try:
+            # Load template
+            doc = stats.call('parse', self._parse_file, template_file)
+            self._sign_doc(dsig_ctx, doc, template)
+            if output_file is None:
+                signed_xml = stats.call('serialize', str, doc)
+                stats.add_bytes(bytes_out=len(signed_xml))
+                return signed_xml
+            stats.add_bytes(bytes_out=stats.call('write', self._write_doc,
+                doc, output_file))
+        finally:
+            if doc is not None:
+                _free_doc(doc)
+
+
+    def _verify_with_context (self, dsig_ctx, xmlstring):
+        """
+        verify the signature in xmlstring using the signature context dsig_ctx.
+        Returns True if the signature is valid, False otherwise.
+        """
+        doc = None
+        stats = self._get_stats()
+        try:
+            # Load XML data
+            stats.add_bytes(bytes_in=len(xmlstring))
+            doc = stats.call('parse', self._parse_xmlstring, xmlstring)
+            return self._verify_doc(dsig_ctx, doc)
+        finally:
+            if doc is not None:
+                _free_doc(doc)
+
+
+    def _verify_file_with_context (self, dsig_ctx, xmlfile):
+        """
+        verify the signature in the XML file xmlfile using the signature
+        context dsig_ctx.
+        Returns True if the signature is valid, False otherwise.
+        """
+        doc = None
+        try:
+            # Load XML data
+            doc = self._get_stats().call('parse', self._parse_file, xmlfile)
+            return self._verify_doc(dsig_ctx, doc)
+        finally:
+            if doc is not None:
+                _free_doc(doc)
+
+
+    def _sign_doc (self, dsig_ctx, doc, template=None):
+        """
+        sign the XML-DSig template in the parsed document doc, in place.
+        doc may also be an element, where the template is searched.
+        If template is provided, it is inserted into the document first. Else
+        the default template of this object is inserted if the document does
+        not contain a Signature element.
+        Returns the Signature node.
+        """
+        stats = self._get_stats()
+        if template is not None:
+            node = stats.call('template', template.apply, _document(doc))
+        else:
+            # find the XML-DSig start node
+            node = stats.call('find_node', xmlsec.findNode,
+                _root_node(doc), xmlsec.NodeSignature, xmlsec.DSigNs)
+            if node is None and self.template is not None:
+                node = stats.call('template', self.template.apply,
+                    _document(doc))
+        if node is None:
+            raise RuntimeError, "Error: XML-DSIG node not found"
+        algorithms = self.algorithms
+        if algorithms is not None:
+            stats.call('template', _set_template_algorithms, node, algorithms)
+        # Sign the template
+        if stats.call('sign', dsig_ctx.sign, node) < 0:
+            raise RuntimeError, "Error: signature failed"
+        return node
+
+
+    def _verify_doc (self, dsig_ctx, doc):
+        """
+        verify the signature in the parsed document doc (or in an element).
+        Returns True if the signature is valid, False otherwise.
+        """
+        # find the XML-DSig start node
+        node = self._get_stats().call('find_node', xmlsec.findNode,
+            _root_node(doc), xmlsec.NodeSignature, xmlsec.DSigNs)
+        if node is None:
+            raise RuntimeError, "Error: XML-DSIG node not found"
+        return self._verify_node(dsig_ctx, node)
+
+
+    def _verify_node (self, dsig_ctx, node):
+        """
+        verify the Signature node with the signature context dsig_ctx.
+        Returns True if the signature is valid, False otherwise.
+        """
+        self._set_public_key(dsig_ctx, node)
+        # Verify signature
+        result = self._get_stats().call('verify', dsig_ctx.verify, node)
+        if result < 0:
+            # An error occured, the signature could not be verified
+            raise RuntimeError, "Error: An error occured, the signature could not be verified"
+        # True if signature is OK, False if it is INVALID
+        return dsig_ctx.status == xmlsec.DSigStatusSucceeded
+
+
+    def _set_public_key (self, dsig_ctx, node):
+        """
+        if the KeyName of the Signature node is the name of a registered
+        public key, set a copy of this key as the key of the signature context
+        (the key is then not looked up in the keys manager).
+        """
+        if not self._public_keys:
+            return
+        key = self._public_keys.get(_signature_key_name(node))
+        if key is None:
+            return
+        key = key.duplicate()
+        if key is None:
+            raise RuntimeError, "Error: failed to duplicate key"
+        # the key is destroyed with the context:
+        dsig_ctx.signKey = key
+
+
+    def _parse_xmlstring(self, xmlstring):
+        """
+        parse XML string containing XML-DSIG nodes for signature (template) or
+        verification (signed data), with the parser profile of this object.
+        """
+        return _parse_string(xmlstring, self._parser_profile)
+
+
+    def _parse_file(self, xmlfile):
+        """
+        parse XML file containing XML-DSIG nodes for signature (template) or
+        verification (signed data).
+        xmlfile may be a filename or a file object: in that case the data is
+        read from the current position, see _parse_xml_file.
+        """
+        return _parse_xml_file(xmlfile, self._parser_profile)
+
+
+    def _write_doc(self, doc, output_file):
+        """
+        write a parsed XML document to output_file, which may be a filename
+        or a file object.
+        Returns the number of bytes written.
+        """
+        if isinstance(output_file, basestring):
+            result = doc.saveFile(output_file)
+        elif isinstance(output_file, file):
+            # written through the same stdio buffer as Python:
+            result = doc.saveTo(output_file)
+        else:
+            # other file-like objects are not supported by libxml2 (the data
+            # would be written to stdout):
+            data = str(doc)
+            output_file.write(data)
+            result = len(data)
+        if result < 0:
+            raise RuntimeError, "Error: unable to write XML data"
+        return result
+
+
+
+class IncrementalSigner (object):
+    """
+    Enveloped signature of large documents divided into sections (for
+    example the chapters or items of a catalogue), each with its own
+    Reference, so that an updated document is signed again by digesting
+    only the sections which changed.
+
+    The references of the sections (by Id, with the EXC_C14N transform) are
+    stored in a Manifest element, the only reference of SignedInfo, like for
+    sign_detached. Only the information given by the caller avoids digesting
+    a section again (see sign_doc): the list of the sections which changed
+    since the previous signature of the document, whose other digests are
+    taken from that signature, or a version of each section, by which the
+    digests are kept in cache between signatures. Without them, all the
+    sections are digested: comparing their contents would cost as much.
+    Documents containing entity references (parsed without substituting
+    entities) are rejected.
+    Only the sections are signed: verify_doc checks that all the sections
+    are referenced, and that the document contains nothing else than the
+    sections, the elements containing them (the root element by default),
+    whitespace, comments and the Signature. The attributes of the elements
+    containing the sections are not signed.
+    """
+
+    def __init__(self, xmldsig, sections='/*/*', namespaces=None,
+                 template=None, id_attribute='Id', id_prefix='section-',
+                 cache_size=SECTION_CACHE_SIZE):
+        """
+        - xmldsig: Xmldsig object used to sign and verify.
+        - sections: str, XPath expression of the section elements. (by
+                    default all the children of the root element) Signature
+                    elements are never sections.
+        - namespaces: dict of prefix:URI for the namespaces used in sections.
+        - template: SignatureTemplate giving the algorithms and KeyInfo to be
+                    used, or None for the defaults of SignatureTemplate.
+        - id_attribute: str, name of the attribute identifying the sections.
+                        Sections without this attribute get a new Id when the
+                        document is signed.
+        - id_prefix: str, prefix of the Ids given to sections, and of the Id
+                     of the Manifest element.
+        - cache_size: int, maximum number of section digests kept in cache
+                      (by version, see sign_doc).
+        """
+        if template is None:
+            template = SignatureTemplate()
+        self.xmldsig = xmldsig
+        self.sections = sections
+        self.namespaces = namespaces or {}
+        self.template = template
+        self.id_attribute = id_attribute
+        self.id_prefix = id_prefix
+        self.manifest_id = id_prefix + 'manifest'
+        self._cache = _LRUCache(cache_size)
+
+
+    def sign_xmlstring (self, xmlstring, changed=None, versions=None):
+        """
+        Sign xmlstring, see sign_doc.
+        Returns a string containing the signed XML data.
+        """
+        doc = self.xmldsig._parse_xmlstring(xmlstring)
+        try:
+            self.sign_doc(doc, changed, versions)
+            return str(doc)
+        finally:
+            _free_doc(doc)
+
+
+    def sign_doc (self, doc, changed=None, versions=None):
+        """
+        Sign the document doc parsed with libxml2, in place: a previous
+        signature made by this object is replaced by a new Signature element,
+        appended to the root element.
+
+        - doc: libxml2 document.
+        - changed: list of the Ids of the sections which may have changed
+                   since the previous signature of the document, or None.
+                   If provided, the digests of the other sections are taken
+                   from the previous signature without reading the sections
+                   (the caller is responsible for the list).
+        - versions: dict {section Id: version} giving for some sections a
+                    value (revision number, modification time...) which
+                    changes whenever the section changes, or None. The
+                    digests of these sections are kept in cache by Id and
+                    version, and taken from the cache without reading the
+                    sections when they are signed again (the caller is
+                    responsible for the versions).
+        The other sections are digested.
+
+        Returns the Signature node.
+        Raises RuntimeError if the document contains entity references.
+        """
+        root = _root_node(doc)
+        if _has_entity_refs(_document(doc)):
+            raise RuntimeError, "Error: documents with entity references are not supported"
+        previous = self._remove_signature(root)
+        if changed is not None:
+            changed = set(changed)
+        if versions is None:
+            versions = {}
+        digest_method = self.template.digest_method
+        stats = self.xmldsig._get_stats()
+        references = []
+        contexts = {}
+        for section_id, node in self._sections(doc, assign_ids=True):
+            if (changed is not None and section_id not in changed
+                and previous.get(section_id, (None,))[0] == digest_method):
+                digest = previous[section_id][1]
+            else:
+                digest = stats.call('digest', self._digest, section_id, node,
+                    versions.get(section_id), digest_method, contexts)
+            references.append(_reference_xml('#' + section_id, [EXC_C14N],
+                digest_method, digest))
+        xml = _signature_xml(self.template.c14n_method,
+            self.template.signature_method,
+            [_reference_xml('#' + self.manifest_id, [self.template.c14n_method],
+            digest_method, reference_type=MANIFEST_TYPE)],
+            self.template.key_info,
+            objects=['<Manifest Id=%s>\n%s</Manifest>' % (
+            quoteattr(self.manifest_id), ''.join(references))])
+        template_doc = libxml2.parseDoc(xml)
+        _objects.add('xmlDoc')
+        try:
+            node = template_doc.getRootElement().docCopyNode(_document(doc), 1)
+        finally:
+            _free_doc(template_doc)
+        root.addChild(node)
+        self.xmldsig._with_context(self.xmldsig._sign_manifest_signature,
+            node)
+        return node
+
+
+    def verify_xmlstring (self, xmlstring):
+        """
+        Verify the signature of xmlstring, see verify_doc.
+        """
+        doc = self.xmldsig._parse_xmlstring(xmlstring)
+        try:
+            return self.verify_doc(doc)
+        finally:
+            _free_doc(doc)
+
+
+    def verify_doc (self, doc):
+        """
+        Verify the signature made by sign_doc in the document doc parsed
+        with libxml2: the signature of SignedInfo and of the Manifest, then
+        the digest of each section (always computed: the cache is only used
+        for signatures). All the sections of the document must be
+        referenced, and only them. The document must not contain other
+        elements or text outside the sections (see IncrementalSigner).
+
+        Returns True if the signature and all the sections are valid, False
+        otherwise (also if a section has no Id, or the same Id as another
+        one).
+        Raises an exception if an error occurs, or if the document contains
+        entity references.
+        """
+        root = _root_node(doc)
+        if _has_entity_refs(_document(doc)):
+            raise RuntimeError, "Error: documents with entity references are not supported"
+        node = self._find_signature(root)
+        if node is None:
+            raise RuntimeError, "Error: XML-DSIG node not found"
+        references = self.xmldsig._with_verify_context(
+            self.xmldsig._verify_manifest_signature, _document(doc), node)
+        if references is None:
+            return False
+        sections = self._sections(doc)
+        if sections is None or len(references) != len(sections):
+            return False
+        if not _only_sections(root, [section for section_id, section
+                                     in sections], node):
+            return False
+        sections = dict(sections)
+        stats = self.xmldsig._get_stats()
+        for uri, transforms, digest_method, digest in references:
+            if not uri or not uri.startswith('#'):
+                return False
+            section = sections.pop(uri[1:], None)
+            if (section is None or transforms != [EXC_C14N]
+                or digest_method not in _HASHLIB_NAMES):
+                return False
+            computed = stats.call('digest', _element_digest, section,
+                digest_method)
+            # (whitespace has been removed from digest)
+            if computed != digest:
+                return False
+        return True
+
+
+    def clear_cache (self):
+        """
+        Remove all the digests kept in cache.
+        """
+        self._cache.clear()
+
+
+    def _sections (self, doc, assign_ids=False):
+        """
+        return the list of sections of doc, as tuples (Id, node). If
+        assign_ids is True, sections without Id get a new one, and an
+        exception is raised if an Id is used by several sections. Else None
+        is returned if a section has no Id, or the same Id as another one.
+        """
+        context = _document(doc).xpathNewContext()
+        try:
+            for prefix, uri in self.namespaces.items():
+                context.xpathRegisterNs(prefix, uri)
+            nodes = context.xpathEval(self.sections)
+        finally:
+            context.xpathFreeContext()
+        sections = []
+        missing = []
+        ids = set()
+        for node in nodes:
+            if node.type != 'element' or (node.name == 'Signature'
+                and node.ns() is not None and node.ns().content == DSIG_NS):
+                continue
+            section_id = node.prop(self.id_attribute)
+            if section_id is None:
+                if not assign_ids:
+                    return None
+                missing.append(len(sections))
+            elif section_id in ids:
+                if not assign_ids:
+                    return None
+                raise RuntimeError, "Error: several sections with %s \"%s\"" % (
+                    self.id_attribute, section_id)
+            ids.add(section_id)
+            sections.append((section_id, node))
+        # new Ids are chosen after the existing ones are known, so that they
+        # are unique:
+        number = 0
+        for index in missing:
+            while self.id_prefix + str(number) in ids:
+                number += 1
+            section_id = self.id_prefix + str(number)
+            ids.add(section_id)
+            node = sections[index][1]
+            node.setProp(self.id_attribute, section_id)
+            sections[index] = (section_id, node)
+        return sections
+
+
+    def _find_signature (self, root):
+        """
+        return the Signature child of root made by this object, or None.
+        """
+        for node in _dsig_children(root, 'Signature'):
+            for obj in _dsig_children(node, 'Object'):
+                for manifest in _dsig_children(obj, 'Manifest'):
+                    if manifest.prop('Id') == self.manifest_id:
+                        return node
+        return None
+
+
+    def _remove_signature (self, root):
+        """
+        remove the previous signature made by this object from root, if any.
+        Returns a dictionary {section Id: (digest_method, digest)} of its
+        references.
+        """
+        node = self._find_signature(root)
+        if node is None:
+            return {}
+        previous = {}
+        for obj in _dsig_children(node, 'Object'):
+            for manifest in _dsig_children(obj, 'Manifest'):
+                for reference in _dsig_children(manifest, 'Reference'):
+                    uri, transforms, digest_method, digest = \
+                        _parse_reference(reference)
+                    if uri and uri.startswith('#') and transforms == [EXC_C14N]:
+                        previous[uri[1:]] = (digest_method, digest)
+        node.unlinkNode()
+        node.freeNode()
+        return previous
+
+
+    def _digest (self, section_id, node, version, digest_method, contexts):
+        """
+        return the digest of the section node, from the cache if its version
+        (given by the caller, or None to compute the digest) and the
+        namespaces in scope did not change.
+        contexts is a dictionary used to compute the namespaces in scope once
+        for each parent element.
+        """
+        if version is None:
+            return _element_digest(node, digest_method)
+        # (libxml2 node objects are hashed and compared by node)
+        parent = node.parent
+        context = contexts.get(parent)
+        if context is None:
+            context = hashlib.sha256(_namespace_context(parent)).digest()
+            contexts[parent] = context
+        cache_key = (section_id, version, context, digest_method)
+        digest = self._cache.get(cache_key)
+        if digest is None:
+            digest = _element_digest(node, digest_method)
+            self._cache.put(cache_key, digest)
+        return digest
+
+
+class DigestCache (object):
+    """
+    bounded and thread-safe cache of the digests of the references computed
+    by this module (sign_detached and verify_detached), so that static data
+    referenced by many signatures (standard headers, policy documents,
+    schemas...) is transformed and digested once per process.
+    Digests are keyed by the SHA-256 of the data, or by URI for static URIs
+    when signing, with the transforms and the digest algorithm.
+    Verification always keys the digests by data: the sources to be
+    verified are never trusted to match the static URIs, and the digests
+    of static URIs are only stored by signatures.
+    The references processed by xmlsec (sign_xmlstring, verify_xmlstring...)
+    do not use the cache.
+    """
+
+    def __init__(self, max_size=DIGEST_CACHE_SIZE, static_uris=()):
+        """
+        - max_size: int, maximum number of digests kept in cache.
+        - static_uris: list of URIs whose data never changes: their digests
+                       are cached by URI when signing, so their sources are
+                       not read again (the caller is responsible for the
+                       list).
+                       Other sources are cached by contents if they are
+                       strings and have transforms, never if they are files.
+        """
+        self.static_uris = set(static_uris)
+        # number of digests found in cache, and computed:
+        self.hits = 0
+        self.misses = 0
+        self._cache = _LRUCache(max_size)
+        self._lock = threading.Lock()
+
+
+    def digest (self, uri, source, transforms, digest_method, verify=False,
+                parser_profile='default'):
+        """
+        Return the base64-encoded digest of the data of a reference, from the
+        cache or computed, see Xmldsig.sign_detached for the parameters.
+        If verify is True, the digest is computed for a verification: the
+        static URIs are not used.
+        parser_profile is the name of the profile of PARSER_PROFILES used to
+        parse XML data for the C14N transforms (part of the key of the
+        digests, as a profile may reject data accepted by another one).
+        """
+        if uri in self.static_uris and not verify:
+            key = ('uri', uri)
+        elif isinstance(source, str) and transforms:
+            # (without transforms, hashing the data to find it in cache would
+            # cost as much as the digest)
+            key = ('data', hashlib.sha256(source).digest())
+        else:
+            return _compute_digest(source, transforms, digest_method,
+                parser_profile)
+        key += (tuple(transforms or ()), digest_method, parser_profile)
+        digest = self._cache.get(key)
+        self._lock.acquire()
+        try:
+            if digest is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        finally:
+            self._lock.release()
+        if digest is None:
+            digest = _compute_digest(source, transforms, digest_method,
+                parser_profile)
+            self._cache.put(key, digest)
+        return digest
+
+
+    def clear (self):
+        """
+        Remove all the digests kept in cache.
+        """
+        self._cache.clear()
+
+
+class SignaturePrescreen (object):
+    """
+    Fast check of the structure of a signature before it is verified, to
+    reject invalid inputs at a low cost: the XML data is read with the
+    libxml2 streaming reader, without building the whole document, until
+    the first Signature element is found. Only this element is expanded and
+    checked: required children in the right order, and algorithms allowed.
+    The data is rejected if it is not well-formed before the Signature
+    element, or if there is no Signature element (then the whole data is
+    read, but still without building a document).
+    A signature which passes the check may still be invalid.
+    """
+
+    def __init__(self, c14n_methods=PRESCREEN_C14N_METHODS,
+                 signature_methods=PRESCREEN_SIGNATURE_METHODS,
+                 digest_methods=PRESCREEN_DIGEST_METHODS,
+                 transforms=PRESCREEN_TRANSFORMS, max_references=None):
+        """
+        - c14n_methods, signature_methods, digest_methods, transforms: lists
+          of the URIs of the algorithms allowed in the signature.
+        - max_references: int, maximum number of references in SignedInfo,
+                          or None.
+        """
+        self.c14n_methods = frozenset(c14n_methods)
+        self.signature_methods = frozenset(signature_methods)
+        self.digest_methods = frozenset(digest_methods)
+        self.transforms = frozenset(transforms)
+        self.max_references = max_references
+
+    def check(self, xmlstring):
+        """
+        Check the signature in an XML string.
+        Raises SignatureRejected if it is rejected.
+        """
+        _ensure_init()
+        reader = libxml2.readerForMemory(xmlstring, len(xmlstring), None, None,
+            PRESCREEN_PARSE_OPTIONS)
+        if reader is None:
+            raise SignatureRejected("unable to read XML data")
+        self._check_reader(reader)
+
+    def check_all(self, xmlstring):
+        """
+        Check all the signatures in an XML string (including nested ones),
+        for Xmldsig.verify_all. The whole data is read.
+        Raises SignatureRejected if one of them is rejected.
+        """
+        _ensure_init()
+        reader = libxml2.readerForMemory(xmlstring, len(xmlstring), None, None,
+            PRESCREEN_PARSE_OPTIONS)
+        if reader is None:
+            raise SignatureRejected("unable to read XML data")
+        self._check_reader(reader, check_all=True)
+
+    def check_file(self, filename):
+        """
+        Check the signature in an XML file.
+        Raises SignatureRejected if it is rejected.
+        """
+        _ensure_init()
+        reader = libxml2.readerForFile(filename, None, PRESCREEN_PARSE_OPTIONS)
+        if reader is None:
+            raise SignatureRejected("unable to read XML file")
+        self._check_reader(reader)
+
+    def _check_reader(self, reader, check_all=False):
+        """
+        find the first Signature element with the reader, and check it. If
+        check_all is True, all the Signature elements are checked.
+        """
+        found = False
+        while True:
+            result = reader.Read()
+            if result < 0:
+                raise SignatureRejected("XML data is not well-formed")
+            if result == 0:
+                if found:
+                    return
+                raise SignatureRejected("no Signature element")
+            if (reader.NodeType() == 1 and reader.LocalName() == 'Signature'
+                and reader.NamespaceUri() == DSIG_NS):
+                # the node is only valid until the reader moves:
+                signature = reader.Expand()
+                if signature is None:
+                    raise SignatureRejected("Signature element is not well-formed")
+                self._check_signature(signature)
+                if not check_all:
+                    return
+                found = True
+
+    def _check_signature(self, signature):
+        children = _prescreen_children(signature, 'Signature')
+        names = [child.name for child in children]
+        if names[:2] != ['SignedInfo', 'SignatureValue']:
+            raise SignatureRejected("Signature must start with SignedInfo and SignatureValue")
+        for name in names[2:3]:
+            if name not in ('KeyInfo', 'Object'):
+                raise SignatureRejected("unexpected %s in Signature" % name)
+        for name in names[3:]:
+            if name != 'Object':
+                raise SignatureRejected("unexpected %s in Signature" % name)
+        if not children[1].content.strip():
+            raise SignatureRejected("empty SignatureValue")
+        self._check_signed_info(children[0])
+
+    def _check_signed_info(self, signed_info):
+        children = _prescreen_children(signed_info, 'SignedInfo')
+        names = [child.name for child in children]
+        if names[:2] != ['CanonicalizationMethod', 'SignatureMethod']:
+            raise SignatureRejected("SignedInfo must start with CanonicalizationMethod and SignatureMethod")
+        _prescreen_algorithm(children[0], self.c14n_methods)
+        _prescreen_algorithm(children[1], self.signature_methods)
+        references = children[2:]
+        if not references:
+            raise SignatureRejected("no Reference in SignedInfo")
+        if (self.max_references is not None
+            and len(references) > self.max_references):
+            raise SignatureRejected("too many references: %d" % len(references))
+        for reference in references:
+            if reference.name != 'Reference':
+                raise SignatureRejected("unexpected %s in SignedInfo" % reference.name)
+            self._check_reference(reference)
+
+    def _check_reference(self, reference):
+        children = _prescreen_children(reference, 'Reference')
+        names = [child.name for child in children]
+        if names and names[0] == 'Transforms':
+            for transform in _prescreen_children(children[0], 'Transforms'):
+                if transform.name != 'Transform':
+                    raise SignatureRejected("unexpected %s in Transforms" % transform.name)
+                _prescreen_algorithm(transform, self.transforms)
+            children, names = children[1:], names[1:]
+        if names != ['DigestMethod', 'DigestValue']:
+            raise SignatureRejected("Reference must contain DigestMethod and DigestValue")
+        _prescreen_algorithm(children[0], self.digest_methods)
+        if not children[1].content.strip():
+            raise SignatureRejected("empty DigestValue")
+
+
+class XmldsigStats (object):
+    """
+    Timers and counters of the phases of signature and verification, to find
+    where the time is spent. Set it as the stats attribute of an Xmldsig
+    object (it may be shared by several objects and threads).
+
+    Phases:
+    - prescreen: check of the signature by a SignaturePrescreen
+    - parse: parsing of the XML string or file
+    - template: insertion of a SignatureTemplate
+    - find_node: search of the Signature element
+    - sign, verify: xmlsec signature or verification, which includes
+      canonicalization, digests and the private/public key operation (they
+      cannot be measured separately)
+    - digest: digests of detached references computed in Python
+    - serialize: conversion of the signed document to a string
+    - write: writing of the signed document to a file
+
+    The numbers of bytes of the XML strings received and of the XML data
+    produced are counted as bytes_in and bytes_out.
+    """
+
+    PHASES = ('prescreen', 'parse', 'template', 'find_node', 'sign', 'verify',
+              'digest', 'serialize', 'write')
+
+    def __init__(self, callback=None):
+        """
+        - callback: function called as callback(name, value) for each measure,
+                    e.g. to send it to a metrics system: name is a phase and
+                    value its duration in seconds, or name is 'bytes_in' or
+                    'bytes_out' and value a number of bytes. (or None)
+        """
+        self.callback = callback
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        set all the timers and counters to zero.
+        """
+        self._lock.acquire()
+        try:
+            # number of calls, total and maximum durations for each phase:
+            self.counts = dict.fromkeys(self.PHASES, 0)
+            self.times = dict.fromkeys(self.PHASES, 0.0)
+            self.max_times = dict.fromkeys(self.PHASES, 0.0)
+            self.bytes_in = 0
+            self.bytes_out = 0
+        finally:
+            self._lock.release()
+
+    def call(self, phase, function, *args):
+        """
+        call function(*args) and record its duration for phase, even if it
+        raises an exception. Returns the result of the function.
+        """
+        start = time.time()
+        try:
+            return function(*args)
+        finally:
+            self.record(phase, time.time() - start)
+
+    def record(self, phase, duration):
+        """
+        record the duration of one phase in seconds.
+        """
+        self._lock.acquire()
+        try:
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+            self.times[phase] = self.times.get(phase, 0.0) + duration
+            if duration > self.max_times.get(phase, 0.0):
+                self.max_times[phase] = duration
+        finally:
+            self._lock.release()
+        if self.callback is not None:
+            self.callback(phase, duration)
+
+    def add_bytes(self, bytes_in=0, bytes_out=0):
+        """
+        count the bytes of XML data received and produced.
+        """
+        self._lock.acquire()
+        try:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+        finally:
+            self._lock.release()
+        if self.callback is not None:
+            if bytes_in:
+                self.callback('bytes_in', bytes_in)
+            if bytes_out:
+                self.callback('bytes_out', bytes_out)
+
+    def as_dict(self):
+        """
+        Returns a flat dictionary of all the counters, to be exported:
+        'parse.count', 'parse.time', 'parse.max_time', ..., 'bytes_in' and
+        'bytes_out'. Durations are in seconds.
+        """
+        self._lock.acquire()
+        try:
+            result = {'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out}
+            for phase, count in self.counts.items():
+                result[phase + '.count'] = count
+                result[phase + '.time'] = self.times[phase]
+                result[phase + '.max_time'] = self.max_times[phase]
+            return result
+        finally:
+            self._lock.release()
+
+
+class _NoStats (object):
+    """
+    Replacement of XmldsigStats when no stats are collected: the functions
+    are called without being measured.
+    """
+
+    def call(self, phase, function, *args):
+        """
+        call function(*args) and return its result.
+        """
+        return function(*args)
+
+    def record(self, phase, duration):
+        pass
+
+    def add_bytes(self, bytes_in=0, bytes_out=0):
+        pass
+
+# shared by all the Xmldsig objects without stats:
+_NO_STATS = _NoStats()
+
+
+class Certificate (object):
+    """
+    X509 certificate of a TrustStore, with the fields used to index it.
+    """
+
+    def __init__(self, pem):
+        """
+        - pem: str, certificate in PEM format.
+        """
+        self.pem = pem
+        self.der = _pem_to_der(pem)
+        # SHA-1 fingerprint of the DER certificate, in hexadecimal:
+        self.fingerprint = hashlib.sha1(self.der).hexdigest()
+        fields = _parse_certificate(self.der)
+        self.serial, self.issuer, self.subject, self.ski = fields
+
+    def __repr__(self):
+        return '<Certificate %s>' % self.subject
+
+
+class TrustStore (object):
+    """
+    set of trusted X509 certificates used for signature verification, which
+    may be loaded in bulk, modified while it is used, and searched by
+    subject, subject key identifier or issuer and serial number.
+
+    The certificates are kept in memory and loaded into an xmlsec keys
+    manager. Adding certificates loads them into the current keys manager.
+    Removing certificates builds a new keys manager from memory, which
+    replaces the current one atomically: running verifications end with the
+    previous one, which is then destroyed.
+    Each modification increments the generation number of the store.
+
+    Subjects and issuers are written as "C=FR, O=Example, CN=Name", with the
+    attributes in the order of the certificate.
+    """
+
+    def __init__(self, certificates=None):
+        """
+        - certificates: list of certificate file names (PEM, which may contain
+                        several certificates) to be loaded, or None.
+        """
+        self.generation = 0
+        self._certificates = {}
+        self._by_subject = {}
+        self._by_ski = {}
+        self._by_issuer_serial = {}
+        self._shared_mngr = None
+        self._lock = threading.RLock()
+        if certificates:
+            self.add_files(certificates)
+
+
+    def add_files(self, filenames):
+        """
+        Load certificates from PEM files, each of which may contain several
+        certificates (bundle).
+        Returns the list of Certificate objects added.
+        """
+        pems = []
+        for filename in filenames:
+            f = open(filename, 'rb')
+            try:
+                pems.extend(_split_pem(f.read()))
+            finally:
+                f.close()
+        return self.add(pems)
+
+
+    def add_directory(self, dirname, extensions=('.pem', '.crt', '.cer')):
+        """
+        Load all the PEM certificate files of a directory, with the given
+        file extensions.
+        Returns the list of Certificate objects added.
+        """
+        filenames = [os.path.join(dirname, name)
+            for name in sorted(os.listdir(dirname))
+            if os.path.splitext(name)[1].lower() in extensions]
+        return self.add_files(filenames)
+
+
+    def add(self, pems):
+        """
+        Add certificates to the store.
+
+        - pems: list of str, certificates in PEM format. (or a single str,
+                which may contain several certificates)
+
+        Returns the list of Certificate objects added. Certificates already
+        in the store are ignored.
+        """
+        if isinstance(pems, basestring):
+            pems = _split_pem(pems)
+        # certificates are parsed before taking the lock:
+        certificates = [Certificate(pem) for pem in pems]
+        self._lock.acquire()
+        try:
+            added = []
+            for cert in certificates:
+                if cert.fingerprint in self._certificates:
+                    continue
+                if self._shared_mngr is not None:
+                    # trusted certificates can be added to a keys manager in
+                    # use (the OpenSSL X509 store is locked)
+                    _keys_mngr_add_cert(self._shared_mngr.keysmngr, cert)
+                self._index(cert)
+                added.append(cert)
+            if added:
+                self.generation += 1
+            return added
+        finally:
+            self._lock.release()
+
+
+    def remove(self, certificates):
+        """
+        Remove certificates from the store.
+
+        - certificates: list of Certificate objects or fingerprints.
+
+        A new keys manager is built with the remaining certificates, and
+        replaces the current one for the following verifications.
+        """
+        self._lock.acquire()
+        try:
+            removed = False
+            for cert in certificates:
+                if isinstance(cert, Certificate):
+                    cert = cert.fingerprint
+                cert = self._certificates.pop(cert, None)
+                if cert is None:
+                    continue
+                _remove_from_index(self._by_subject, cert.subject, cert)
+                _remove_from_index(self._by_ski, cert.ski, cert)
+                _remove_from_index(self._by_issuer_serial,
+                    (cert.issuer, cert.serial), cert)
+                removed = True
+            if removed:
+                self._replace_keys_mngr()
+                self.generation += 1
+        finally:
+            self._lock.release()
+
+
+    def replace(self, pems):
+        """
+        Replace all the certificates of the store at once.
+
+        - pems: list of str, certificates in PEM format (or a single str).
+        """
+        if isinstance(pems, basestring):
+            pems = _split_pem(pems)
+        certificates = [Certificate(pem) for pem in pems]
+        self._lock.acquire()
+        try:
+            self._certificates = {}
+            self._by_subject = {}
+            self._by_ski = {}
+            self._by_issuer_serial = {}
+            for cert in certificates:
+                self._index(cert)
+            self._replace_keys_mngr()
+            self.generation += 1
+        finally:
+            self._lock.release()
+
+
+    def certificates(self):
+        """
+        Returns the list of all the Certificate objects of the store.
+        """
+        return self._certificates.values()
+
+
+    def find_by_fingerprint(self, fingerprint):
+        """
+        Returns the Certificate with the given SHA-1 fingerprint (hexadecimal),
+        or None.
+        """
+        return self._certificates.get(fingerprint.lower().replace(':', ''))
+
+
+    def find_by_subject(self, subject):
+        """
+        Returns the list of Certificates with the given subject.
+        """
+        return list(self._by_subject.get(subject, ()))
+
+
+    def find_by_ski(self, ski):
+        """
+        Returns the list of Certificates with the given subject key
+        identifier (hexadecimal).
+        """
+        return list(self._by_ski.get(ski.lower().replace(':', ''), ()))
+
+
+    def find_by_issuer_serial(self, issuer, serial):
+        """
+        Returns the list of Certificates with the given issuer and serial
+        number (int).
+        """
+        return list(self._by_issuer_serial.get((issuer, serial), ()))
+
+
+    def keys_manager(self):
+        """
+        Returns a tuple (shared_mngr, generation) with the current keys
+        manager, built at the first call. The caller owns a reference to
+        shared_mngr, and must call its release method when it is not used
+        anymore.
+        """
+        self._lock.acquire()
+        try:
+            if self._shared_mngr is None:
+                self._shared_mngr = _SharedKeysMngr(self._build_keys_mngr())
+            return self._shared_mngr.acquire(), self.generation
+        finally:
+            self._lock.release()
+
+
+    def destroy(self):
+        """
+        Release the keys manager of the store: it is destroyed as soon as no
+        Xmldsig object uses it anymore. (it is built again if the store is
+        used after that)
+        """
+        self._lock.acquire()
+        try:
+            shared_mngr, self._shared_mngr = self._shared_mngr, None
+            # Xmldsig objects switch to a new keys manager:
+            self.generation += 1
+        finally:
+            self._lock.release()
+        if shared_mngr is not None:
+            shared_mngr.release()
+
+
+    def _index(self, cert):
+        self._certificates[cert.fingerprint] = cert
+        self._by_subject.setdefault(cert.subject, []).append(cert)
+        if cert.ski is not None:
+            self._by_ski.setdefault(cert.ski, []).append(cert)
+        self._by_issuer_serial.setdefault((cert.issuer, cert.serial),
+            []).append(cert)
+
+
+    def _build_keys_mngr(self):
+        """
+        create a new keys manager with all the certificates of the store.
+        """
+        keysmngr = _create_keys_mngr()
+        try:
+            for cert in self._certificates.values():
+                _keys_mngr_add_cert(keysmngr, cert)
+        except:
+            keysmngr.destroy()
+            _objects.remove('KeysMngr')
+            raise
+        return keysmngr
+
+
+    def _replace_keys_mngr(self):
+        """
+        replace the current keys manager by a new one, if it was built.
+        """
+        if self._shared_mngr is None:
+            return
+        old_mngr = self._shared_mngr
+        self._shared_mngr = _SharedKeysMngr(self._build_keys_mngr())
+        # destroyed when the last context pool using it is retired:
+        old_mngr.release()
+
+
+class ParallelSigner (object):
+    """
+    class to sign and verify XML signatures with a pool of worker processes,
+    in order to use all the CPU cores of the system for bulk operations.
+
+    Each worker process loads the key and certificates once, in its own
+    Xmldsig object, then processes jobs sent by the ParallelSigner. The
+    xmlsec and libxml2 libraries are initialized in each worker when the
+    key is loaded (or inherited from the parent process when workers are
+    forked after the parent has used them).
+    """
+
+    def __init__(self, key_file=None, cert_file=None, password='', key_name=None,
+                 certificates=None, processes=None, max_pending=None,
+                 template=None, public_keys=None, key_data=None,
+                 cert_data=None, algorithms=None, parser_profile='default'):
+        """
+        - key_file, cert_file, password, key_name, template, key_data,
+          cert_data, algorithms, parser_profile: see Xmldsig. (with the fork start method, keys loaded
+          by preload_key before are inherited by the workers, so they are
+          not decrypted again)
+        - certificates: list of certificate file names to be loaded in each
+                        worker for signature verification, see load_certs.
+        - public_keys: dict {key_name: filename} of public keys to be
+                       registered in each worker, see load_public_key.
+        - processes: int, number of worker processes, or None to use the
+                     number of CPUs.
+        - max_pending: int, maximum number of jobs sent to the workers and
+                       not yet returned by sign_many/verify_many (to bound
+                       memory usage when the input is large). By default it
+                       is 4 times the number of processes.
+        """
+        if multiprocessing is None:
+            raise RuntimeError, "Error: ParallelSigner requires the multiprocessing module (Python 2.6+)"
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if max_pending is None:
+            max_pending = 4 * processes
+        self.processes = processes
+        self.max_pending = max_pending
+        self._pool = multiprocessing.Pool(processes, _parallel_worker_init,
+            (key_file, cert_file, password, key_name, certificates, template,
+            public_keys, key_data, cert_data, algorithms, parser_profile))
+        # raise now if a worker could not load the keys, rather than for
+        # each of its jobs:
+        error = self._check_workers()
+        if error is not None:
+            self.shutdown()
+            raise error
+
+
+    def sign_xmlstring (self, xmlstring):
+        """
+        Sign xmlstring in a worker process, see Xmldsig.sign_xmlstring.
+        """
+        return self._run_one('sign', xmlstring)
+
+
+    def verify_xmlstring (self, xmlstring):
+        """
+        Verify the signature in xmlstring in a worker process, see
+        Xmldsig.verify_xmlstring.
+        """
+        return self._run_one('verify', xmlstring)
+
+
+    def sign_many (self, xmlstrings, ordered=True):
+        """
+        Sign several XML strings in parallel.
+
+        - xmlstrings: iterable of str, XML data containing XML-DSig templates.
+                      It is consumed progressively, no more than max_pending
+                      documents are being processed at any time.
+        - ordered: bool, if True results are yielded in the same order as the
+                   inputs, else as soon as they are available.
+
+        This is a generator: it yields one tuple (index, signed_xml, error)
+        for each input, where index is the position of the input in
+        xmlstrings. If an error occurred, signed_xml is None and error is the
+        exception which was raised.
+        """
+        return self._run_many('sign', xmlstrings, ordered)
+
+
+    def verify_many (self, xmlstrings, ordered=True):
+        """
+        Verify the signatures of several XML strings in parallel.
+
+        This is a generator: it yields one tuple (index, valid, error) for
+        each input, see sign_many.
+        """
+        return self._run_many('verify', xmlstrings, ordered)
+
+
+    def verify_all (self, xmlstring, parts=None):
+        """
+        Verify all the signatures of xmlstring in parallel, see
+        Xmldsig.verify_all: the document is sent to parts workers (by
+        default the number of processes), each of them parses it once and
+        verifies a share of the signatures.
+        The whole document is sent to and parsed by every worker, as the
+        signatures may reference any part of it: this is only faster than
+        Xmldsig.verify_all when the verification of the signatures costs
+        much more than parsing the document (many signatures, or large
+        signed data). Use parts to limit the number of copies.
+
+        Returns a list of tuples (path, valid, error), one for each Signature
+        element in document order.
+        Raises an exception if the document cannot be parsed.
+        """
+        if parts is None:
+            parts = self.processes
+        jobs = [self._pool.apply_async(_parallel_worker_job,
+            ('verify_all', part, (xmlstring, parts))) for part in xrange(parts)]
+        results = []
+        for job in jobs:
+            part, result, error = job.get()
+            if error is not None:
+                raise error
+            results.extend(result)
+        results.sort()
+        return [(path, valid, error) for index, path, valid, error in results]
+
+
+    def sign_files (self, files, ordered=True):
+        """
+        Sign several XML files in parallel. Each worker reads and writes the
+        files directly, so that the data is not sent between processes.
+
+        - files: iterable of tuples (template_file, output_file), filenames.
+        - ordered: see sign_many.
+
+        This is a generator: it yields one tuple (index, output_file, error)
+        for each input, see sign_many.
+        """
+        return self._run_many('sign_file', files, ordered)
+
+
+    def verify_files (self, xmlfiles, ordered=True):
+        """
+        Verify the signatures of several XML files in parallel.
+
+        - xmlfiles: iterable of filenames.
+        - ordered: see sign_many.
+
+        This is a generator: it yields one tuple (index, valid, error) for
+        each input, see sign_many.
+        """
+        return self._run_many('verify_file', xmlfiles, ordered)
+
+
+    def shutdown (self):
+        """
+        Stop all the worker processes, after the end of pending jobs.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+    def _check_workers (self):
+        """
+        return the exception raised while a worker process was initialized,
+        or None. Checks are sent until every worker has answered: each one
+        waits a little so that the next checks are taken by the others.
+        """
+        checked = set()
+        delay = 0.01
+        while len(checked) < self.processes:
+            for pid, error in self._pool.map(_parallel_worker_check,
+                    [delay] * self.processes, chunksize=1):
+                if error is not None:
+                    return error
+                checked.add(pid)
+            delay = min(2 * delay, 1.0)
+        return None
+
+
+    def _run_one (self, operation, xmlstring):
+        """
+        run one job in a worker process, and return its result or raise the
+        exception it raised.
+        """
+        index, result, error = self._pool.apply(_parallel_worker_job,
+            (operation, 0, xmlstring))
+        if error is not None:
+            raise error
+        return result
+
+
+    def _run_many (self, operation, xmlstrings, ordered):
+        """
+        generator running one job for each xmlstring in the worker processes,
+        with at most max_pending jobs at the same time.
+        """
+        # results of pending jobs, in the order of submission:
+        pending = collections.deque()
+        # results of finished jobs, in the order of completion:
+        finished = Queue.Queue()
+        for index, xmlstring in enumerate(xmlstrings):
+            if len(pending) >= self.max_pending:
+                yield self._next_result(pending, finished, ordered)
+            args = (operation, index, xmlstring)
+            if ordered:
+                pending.append(self._pool.apply_async(_parallel_worker_job, args))
+            else:
+                self._pool.apply_async(_parallel_worker_job, args,
+                    callback=finished.put)
+                pending.append(None)
+        while pending:
+            yield self._next_result(pending, finished, ordered)
+
+
+    def _next_result (self, pending, finished, ordered):
+        """
+        wait for the next result of _run_many and return it.
+        """
+        async_result = pending.popleft()
+        if ordered:
+            return async_result.get()
+        return finished.get()
+
+
+
+class XmldsigFuture (object):
+    """
+    result of an asynchronous operation of AsyncXmldsig, which will be
+    available later.
+    """
+
+    def __init__(self, deadline=None):
+        """
+        - deadline: float, time (as returned by time.time) after which the
+                    operation is considered as failed, or None.
+        """
+        self.deadline = deadline
+        # pending, running, finished or cancelled:
+        self._state = 'pending'
+        self._result = None
+        self._error = None
+        self._callbacks = []
+        self._cond = threading.Condition(threading.Lock())
+
+    def cancel(self):
+        """
+        cancel the operation if it has not started yet.
+        Returns True if it was cancelled, False otherwise.
+        """
+        self._cond.acquire()
+        try:
+            if self._state != 'pending':
+                return self._state == 'cancelled'
+            self._state = 'cancelled'
+            self._error = OperationCancelled("Error: operation cancelled")
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        self._run_callbacks()
+        return True
+
+    def cancelled(self):
+        """
+        return True if the operation was cancelled.
+        """
+        return self._state == 'cancelled'
+
+    def done(self):
+        """
+        return True if the operation is finished or cancelled.
+        """
+        return self._state in ('finished', 'cancelled')
+
+    def result(self, timeout=None):
+        """
+        wait until the operation is finished, and return its result: signed XML
+        data for a signature, True or False for a verification.
+
+        - timeout: float, maximum time to wait in seconds, or None to wait
+                   until the deadline of the operation if any.
+
+        Raises OperationTimeout if the operation is not finished in time,
+        OperationCancelled if it was cancelled, or the exception raised by
+        the operation.
+        """
+        end = self.deadline
+        if timeout is not None:
+            end = min(end or sys.maxint, time.time() + timeout)
+        self._cond.acquire()
+        try:
+            while not self.done():
+                if end is None:
+                    self._cond.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+        if not self.done():
+            if self.deadline is not None and time.time() >= self.deadline:
+                # the operation will be reported as failed when it ends
+                raise OperationTimeout("Error: operation timed out")
+            raise OperationTimeout("Error: result not available yet")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def add_done_callback(self, callback):
+        """
+        call callback(future) when the operation is finished or cancelled, in
+        the thread which finishes it, or immediately if it is already done.
+        """
+        self._cond.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._cond.release()
+        callback(self)
+
+    def _start(self):
+        """
+        mark the operation as running. Returns False if it must not be run,
+        because it was cancelled or its deadline has passed.
+        """
+        self._cond.acquire()
+        try:
+            if self._state != 'pending':
+                return False
+            self._state = 'running'
+        finally:
+            self._cond.release()
+        if self.deadline is not None and time.time() >= self.deadline:
+            self._finish(None, OperationTimeout(
+                "Error: operation timed out before it was started"))
+            return False
+        return True
+
+    def _finish(self, result, error):
+        """
+        store the result or the error of the operation, and wake up waiters.
+        """
+        if (error is None and self.deadline is not None
+            and time.time() >= self.deadline):
+            result, error = None, OperationTimeout("Error: operation timed out")
+        self._cond.acquire()
+        try:
+            self._result, self._error = result, error
+            self._state = 'finished'
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        self._cond.acquire()
+        try:
+            callbacks, self._callbacks = self._callbacks, []
+        finally:
+            self._cond.release()
+        for callback in callbacks:
+            callback(self)
+
+
+class AsyncXmldsig (object):
+    """
+    class to sign and verify XML signatures without blocking the caller:
+    sign() and verify() return immediately an XmldsigFuture, and the
+    operations are run by a bounded number of worker threads sharing the same
+    keys, in the order they were requested.
+
+    With the default thread backend, an Xmldsig object does the work in the
+    worker threads. As pyxmlsec does not release the GIL, a long operation on
+    a large document still delays the other Python threads of the process.
+    With processes=True, the worker threads only send the operations to a
+    ParallelSigner and wait for the results without holding the GIL, so the
+    calling threads are never blocked by signature or verification work.
+    """
+
+    def __init__(self, key_file=None, cert_file=None, password='', key_name=None,
+                 certificates=None, xmldsig=None, max_workers=4, max_queued=None,
+                 timeout=None, processes=False):
+        """
+        - key_file, cert_file, password, key_name: see Xmldsig.
+        - certificates: list of certificate file names for verification.
+        - xmldsig: existing Xmldsig or ParallelSigner object to use, instead
+                   of loading keys again. (it is not shut down by shutdown,
+                   whereas an object created here is released after the
+                   last operation)
+        - max_workers: int, maximum number of operations running at the same
+                       time.
+        - max_queued: int, maximum number of operations waiting to be run, or
+                      None for no limit. When the limit is reached, sign and
+                      verify raise RuntimeError.
+        - timeout: float, default timeout in seconds for each operation, from
+                   the time it is requested, or None for no timeout.
+        - processes: bool, if True operations are run by a ParallelSigner
+                     with max_workers processes instead of threads.
+        """
+        self.timeout = timeout
+        self._own_backend = xmldsig is None
+        if xmldsig is not None:
+            self._backend = xmldsig
+        elif processes:
+            self._backend = ParallelSigner(key_file, cert_file, password,
+                key_name, certificates, processes=max_workers)
+        else:
+            self._backend = Xmldsig(key_file, cert_file, password, key_name,
+                max_contexts=max_workers)
+            if certificates:
+                self._backend.load_certs(certificates)
+        if max_queued is None:
+            max_queued = 0
+        self._queue = Queue.Queue(max_queued)
+        # number of worker threads not stopped yet, the last one releases
+        # the backend created by this object:
+        self._running = max_workers
+        self._running_lock = threading.Lock()
+        self._threads = []
+        for i in xrange(max_workers):
+            thread = threading.Thread(target=self._worker)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    def sign (self, xmlstring, timeout=None):
+        """
+        Sign xmlstring asynchronously, see Xmldsig.sign_xmlstring.
+
+        - timeout: float, timeout in seconds for this operation, or None to use
+                   the default timeout.
+
+        Returns an XmldsigFuture: its result is a string containing the signed
+        XML data.
+        """
+        return self._submit(self._backend.sign_xmlstring, xmlstring, timeout)
+
+
+    def verify (self, xmlstring, timeout=None):
+        """
+        Verify the signature in xmlstring asynchronously, see
+        Xmldsig.verify_xmlstring.
+
+        Returns an XmldsigFuture: its result is True if the signature is valid,
+        False otherwise.
+        """
+        return self._submit(self._backend.verify_xmlstring, xmlstring, timeout)
+
+
+    def shutdown (self, wait=True):
+        """
+        Stop the worker threads after the operations already requested.
+        The Xmldsig or ParallelSigner object created by this object (if no
+        xmldsig was given) is released by the last worker thread, after the
+        last operation: with wait=False, it may still be in use when this
+        method returns.
+
+        - wait: bool, if True wait until all the operations are finished and
+                the backend is released.
+        """
+        for thread in self._threads:
+            # may block if the queue is full, until workers take operations:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+
+    def _submit (self, method, xmlstring, timeout):
+        """
+        queue an operation for the worker threads, and return its future.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        future = XmldsigFuture(deadline)
+        try:
+            self._queue.put_nowait((future, method, xmlstring))
+        except Queue.Full:
+            raise RuntimeError, "Error: too many pending operations"
+        return future
+
+
+    def _worker (self):
+        """
+        main loop of a worker thread.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._stop_worker()
+                return
+            future, method, xmlstring = item
+            if not future._start():
+                continue
+            try:
+                result = method(xmlstring)
+            except Exception, exc:
+                future._finish(None, exc)
+            else:
+                future._finish(result, None)
+
+
+    def _stop_worker (self):
+        """
+        called by each worker thread when it stops: the last one releases the
+        backend if it was created by this object.
+        """
+        self._running_lock.acquire()
+        try:
+            self._running -= 1
+            last = self._running == 0
+        finally:
+            self._running_lock.release()
+        if not last or not self._own_backend:
+            return
+        if isinstance(self._backend, ParallelSigner):
+            self._backend.shutdown()
+        else:
+            self._backend.destroy()
+
+
+class SigningServer (object):
+    """
+    long-running signing service holding Xmldsig objects with preloaded
+    keys, so that short-lived processes may sign and verify through a Unix
+    domain socket, without initializing the libraries and loading keys
+    themselves. (see pyxmldsig_client for the client side, and the
+    SERVER_* constants for the protocol)
+
+    Each connection is served by a thread. A client may send several
+    requests without waiting for the responses (pipelining): consecutive
+    requests received together for the same key and operation are processed
+    as one batch (see sign_many), and the
+    responses are sent in the same order as the requests.
+    """
+
+    def __init__(self, path, keys, default_key=None,
+                 max_request_size=SERVER_MAX_REQUEST_SIZE,
+                 max_batch=SERVER_MAX_BATCH):
+        """
+        - path: str, filename of the Unix domain socket, created with access
+                for the current user only. A socket file left by a server
+                which is not running anymore is replaced.
+        - keys: dict {name: Xmldsig} of the objects used for the requests
+                with each key name. (they are not destroyed by close)
+        - default_key: str, name of the key used for requests without key
+                       name, or None if there is only one key.
+        - max_request_size: int, maximum size of the XML data of a request.
+                            The connection is closed if it is exceeded.
+        - max_batch: int, maximum number of requests processed as one batch.
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            raise RuntimeError, "Error: SigningServer requires Unix domain sockets"
+        if default_key is None and len(keys) == 1:
+            default_key = keys.keys()[0]
+        self.path = path
+        self.keys = dict(keys)
+        self.default_key = default_key
+        self.max_request_size = max_request_size
+        self.max_batch = max_batch
+        _remove_stale_socket(path)
+        self._server = _bind_private_socket(path, _SigningSocketServer,
+            _SigningRequestHandler)
+        self._server.signing_server = self
+
+
+    def serve_forever (self):
+        """
+        Serve the requests until shutdown is called by another thread.
+        """
+        self._server.serve_forever()
+
+
+    def shutdown (self):
+        """
+        Stop serve_forever. The connections being served are not closed.
+        """
+        self._server.shutdown()
+
+
+    def close (self):
+        """
+        Close the socket and remove its file.
+        """
+        self._server.server_close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+    def _handle (self, sock):
+        """
+        serve one connection: read the requests, process them by batches and
+        send the responses, until the client closes the connection.
+        """
+        data = ''
+        while True:
+            requests, data, needed = self._parse_requests(data)
+            if requests:
+                sock.sendall(''.join(self._process(requests)))
+                continue
+            # read at least the rest of the next request:
+            chunks = [data]
+            size = len(data)
+            while size < needed:
+                chunk = sock.recv(_SERVER_RECV_SIZE)
+                if not chunk:
+                    return
+                chunks.append(chunk)
+                size += len(chunk)
+            data = ''.join(chunks)
+
+
+    def _parse_requests (self, data):
+        """
+        parse the complete requests at the beginning of data, up to
+        max_batch requests.
+        Returns a tuple (requests, rest of data, size of data needed for the
+        next request), where requests is a list of tuples (request_id,
+        operation, key_name, xmlstring).
+        """
+        header_size = struct.calcsize(SERVER_REQUEST_HEADER)
+        requests = []
+        offset = 0
+        while len(requests) < self.max_batch:
+            if len(data) - offset < header_size:
+                return requests, data[offset:], header_size
+            length, request_id, operation, name_length = struct.unpack(
+                SERVER_REQUEST_HEADER, data[offset:offset + header_size])
+            if length > self.max_request_size:
+                raise RuntimeError, "Error: request of %d bytes is too large" % length
+            name_start = offset + header_size
+            start = name_start + name_length
+            end = start + length
+            if len(data) < end:
+                return requests, data[offset:], end - offset
+            requests.append((request_id, operation, data[name_start:start],
+                data[start:end]))
+            offset = end
+        return requests, data[offset:], 0
+
+
+    def _process (self, requests):
+        """
+        process a list of requests (see _parse_requests) and return the list
+        of responses, in the same order.
+        """
+        responses = []
+        index = 0
+        while index < len(requests):
+            operation, key_name = requests[index][1:3]
+            # consecutive requests for the same key and operation are
+            # processed as one batch:
+            end = index + 1
+            while end < len(requests) and requests[end][1:3] == (operation,
+                                                                 key_name):
+                end += 1
+            batch = requests[index:end]
+            results = self._process_batch(operation, key_name,
+                [request[3] for request in batch])
+            for request, (output, error) in zip(batch, results):
+                if error is None:
+                    status = SERVER_OK
+                else:
+                    status, output = SERVER_ERROR, str(error)
+                responses.append(struct.pack(SERVER_RESPONSE_HEADER,
+                    len(output), request[0], status))
+                responses.append(output)
+            index = end
+        return responses
+
+
+    def _process_batch (self, operation, key_name, xmlstrings):
+        """
+        sign or verify xmlstrings with the key named key_name.
+        Returns a list of tuples (output, error) for each XML string.
+        """
+        xdsig = self.keys.get(key_name or self.default_key)
+        if xdsig is None:
+            error = RuntimeError("Error: unknown key \"%s\"" % key_name)
+            return [(None, error)] * len(xmlstrings)
+        if operation == SERVER_SIGN:
+            return list(xdsig.sign_many(xmlstrings))
+        if operation == SERVER_VERIFY:
+            return [(valid and '1' or '0', error)
+                    for valid, error in xdsig.verify_many(xmlstrings)]
+        error = RuntimeError("Error: unsupported operation %d" % operation)
+        return [(None, error)] * len(xmlstrings)
+
+
+# Unix domain sockets are not available on Windows:
+if hasattr(socket, 'AF_UNIX'):
+
+    class _SigningSocketServer (SocketServer.ThreadingMixIn,
+                                SocketServer.UnixStreamServer):
+        """
+        socket server of SigningServer, with a thread for each connection.
+        """
+        daemon_threads = True
+
+
+class _SigningRequestHandler (SocketServer.BaseRequestHandler):
+    """
+    handler of a SigningServer connection.
+    """
+
+    def handle(self):
+        try:
+            self.server.signing_server._handle(self.request)
+        except (socket.error, RuntimeError):
+            # the client is gone or sent an invalid request: the connection
+            # is closed
+            pass
+
+
+
+#=== FUNCTIONS ================================================================
+
+def sign_file(template_file, key_file, cert_file=None, password='', key_name=None,
+              output_file=None):
+    """
+    Sign a XML file using private key from key_file and the signature template
+    in the XML file.
+    The certificate from cert_file is placed in the <dsig:X509Data/> node.
+
+    - template_file: str, filename of XML file containing an XML-DSig template,
+                     or file object opened for reading.
+    - key_file: str, filename of PEM file containing the private key.
+                (the file should NOT be password-protected)
+    - cert_file: str, filename of PEM file containing the X509 certificate.
+                 (optional: can be None)
+    - password: str, password to open key file, or None if no password.
+    - output_file: str, filename where the signed XML data is written, or file
+                   object opened for writing, or None.
+
+    The key is loaded once and kept in cache for the next calls with the same
+    files and password, as long as the files are not modified.
+
+    Returns a string containing the signed XML data, or None if output_file is
+    provided.
+    Raises an exception if an error occurs.
+    """
+    shared = _get_xmldsig(key_file, cert_file, password, key_name)
+    try:
+        return shared.xmldsig.sign_file(template_file, output_file)
+    finally:
+        shared.release()
+##    xmlstring = open(template_file).read()
+##    return sign_xmlstring(xmlstring, key_file, cert_file, password)
+
+
+def sign_xmlstring(xmlstring, key_file, cert_file=None, password='', key_name=None):
+    """
+    Sign xmlstring using private key from key_file and the signature template
+    in xmlstring.
+    The certificate from cert_file is placed in the <dsig:X509Data/> node.
+
+    - xmlstring: str, XML data containing an XML-DSig template.
+    - key_file: str, filename of PEM file containing the private key.
+                (the file should NOT be password-protected)
+    - cert_file: str, filename of PEM file containing the X509 certificate.
+                 (optional: can be None)
+    - password: str, password to open key file, or "" if no password.
+                (never use None because libxmlsec will ask on the console)
+
+    The key is loaded once and kept in cache for the next calls with the same
+    files and password, as long as the files are not modified.
+
+    Returns a string containing the signed XML data.
+    Raises an exception if an error occurs.
+    """
+    shared = _get_xmldsig(key_file, cert_file, password, key_name)
+    try:
+        return shared.xmldsig.sign_xmlstring(xmlstring)
+    finally:
+        shared.release()
+##    # Load template
+##    #doc = libxml2.parseFile(tmpl_file)
+##    doc = libxml2.parseDoc(xmlstring)
+##    if doc is None or doc.getRootElement() is None:
+##        raise RuntimeError, "Error: unable to parse XML data"
+##
+##    # try block to ensure cleanup is called even if an exception is raised:
+##    try:
+##        dsig_ctx = None
+##
+##        # Find XML-DSig start node
+##        node = xmlsec.findNode(doc.getRootElement(), xmlsec.NodeSignature,
+##                               xmlsec.DSigNs)
+##        if node is None:
+##    	    raise RuntimeError, "Error: start node not found"
+##
+##        # Create signature context, we don't need keys manager in this example
+##        dsig_ctx = xmlsec.DSigCtx()
+##        if dsig_ctx is None:
+##            raise RuntimeError, "Error: failed to create signature context"
+##
+##        # Load private key, assuming that there is not password
+##        #print 'PASSWORD: %s' % password
+##        key = xmlsec.cryptoAppKeyLoad(filename = key_file,
+##            format = xmlsec.KeyDataFormatPem, pwd = password,
+##            pwdCallback = None, pwdCallbackCtx = None)
+##        # API references:
+##        # http://pyxmlsec.labs.libre-entreprise.org/docs/html/xmlsec-module.html#cryptoAppKeyLoad
+##        # http://www.aleksey.com/xmlsec/api/xmlsec-app.html#XMLSECCRYPTOAPPKEYLOAD
+##        # http://www.aleksey.com/xmlsec/api/xmlsec-keysdata.html#XMLSECKEYDATAFORMAT
+##        if key is None:
+##            raise RuntimeError, "Error: failed to load private PEM key from \"%s\"" % key_file
+##        dsig_ctx.signKey = key
+##
+##        if cert_file is not None:
+##            # Load certificate and add to the key
+##            ##    if not check_filename(cert_file):
+##            ##        return cleanup(doc, dsig_ctx)
+##            if xmlsec.cryptoAppKeyCertLoad(key, cert_file, xmlsec.KeyDataFormatPem) < 0:
+##                raise RuntimeError, "Error: failed to load PEM certificate \"%s\"" % cert_file
+##
+##        # Set key name to the file name, this is just an example!
+##        if key.setName(key_file) < 0:
+##            raise RuntimeError, "Error: failed to set key name for key from \"%s\"" % key_file
+##
+##        # Sign the template
+##        if dsig_ctx.sign(node) < 0:
+##            raise RuntimeError, "Error: signature failed"
+##
+##        ##    # Print signed document to stdout
+##        ##    doc.dump("-")
+##        ##    doc.saveFile("test.xml")
+##        output = str(doc)
+##    finally:
+##        # cleanup, even if an exception has been raised:
+##        cleanup(doc, dsig_ctx)
+##    # return output if no exception was raised:
+##    return output
+
+
+##def cleanup(doc=None, dsig_ctx=None, res=-1):
+##    """
+##    Cleans libxml2 context after usage.
+##    """
+##    if dsig_ctx is not None:
+##        dsig_ctx.destroy()
+##    if doc is not None:
+##        doc.freeDoc()
+##    return res
+
+
+def _signature_xml(c14n_method, signature_method, references, key_info,
+                   objects=()):
+    """
+    return the XML source of a Signature element template.
+
+    - c14n_method, signature_method: str, algorithm URIs.
+    - references: list of Reference elements, as returned by _reference_xml.
+    - key_info: list of KeyInfo children names (see SignatureTemplate).
+    - objects: list of XML strings to be included in Object elements.
+    """
+    key_info_xml = {
+        'KeyName': '  <KeyName/>\n',
+        'KeyValue': '  <KeyValue/>\n',
+        'X509Data': '  <X509Data>\n    <X509Certificate></X509Certificate>\n  </X509Data>\n',
+        }
+    xml = ['<Signature xmlns="%s">\n<SignedInfo>\n' % DSIG_NS,
+        '  <CanonicalizationMethod Algorithm=%s/>\n' % quoteattr(c14n_method),
+        '  <SignatureMethod Algorithm=%s/>\n' % quoteattr(signature_method)]
+    xml.extend(references)
+    xml.append('</SignedInfo>\n<SignatureValue></SignatureValue>\n')
+    if key_info:
+        xml.append('<KeyInfo>\n')
+        for name in key_info:
+            if name not in key_info_xml:
+                raise RuntimeError, "Error: unsupported KeyInfo element \"%s\"" % name
+            xml.append(key_info_xml[name])
+        xml.append('</KeyInfo>\n')
+    for obj in objects:
+        xml.append('<Object>%s</Object>\n' % obj)
+    xml.append('</Signature>\n')
+    return ''.join(xml)
+
+
+def _reference_xml(uri, transforms, digest_method, digest_value='',
+                   reference_type=None):
+    """
+    return the XML source of a Reference element for a signature template.
+    """
+    xml = ['  <Reference URI=%s' % quoteattr(uri)]
+    if reference_type is not None:
+        xml.append(' Type=%s' % quoteattr(reference_type))
+    xml.append('>\n')
+    if transforms:
+        xml.append('    <Transforms>\n')
+        for transform in transforms:
+            xml.append('      <Transform Algorithm=%s/>\n' % quoteattr(transform))
+        xml.append('    </Transforms>\n')
+    xml.append('    <DigestMethod Algorithm=%s/>\n' % quoteattr(digest_method))
+    xml.append('    <DigestValue>%s</DigestValue>\n  </Reference>\n' % digest_value)
+    return ''.join(xml)
+
+
+def _set_template_algorithms(signature, algorithms):
+    """
+    replace the algorithms of the Signature template node signature (and of
+    all its references) by algorithms, a tuple (signature_method,
+    digest_method, c14n_method) where None keeps the algorithm of the
+    template.
+    """
+    signature_method, digest_method, c14n_method = algorithms
+    for signed_info in _dsig_children(signature, 'SignedInfo'):
+        if c14n_method is not None:
+            for node in _dsig_children(signed_info, 'CanonicalizationMethod'):
+                node.setProp('Algorithm', c14n_method)
+        if signature_method is not None:
+            for node in _dsig_children(signed_info, 'SignatureMethod'):
+                node.setProp('Algorithm', signature_method)
+        if digest_method is not None:
+            for reference in _dsig_children(signed_info, 'Reference'):
+                for node in _dsig_children(reference, 'DigestMethod'):
+                    node.setProp('Algorithm', digest_method)
+
+
+def algorithm_supported(uri):
+    """
+    Returns True if the algorithm uri (signature, digest, canonicalization
+    method or transform) is supported by xmlsec and its crypto library,
+    False otherwise. For example ECDSA and Ed25519 are not available with
+    old versions of xmlsec or OpenSSL.
+    If the Python bindings do not provide the list of algorithms, True is
+    returned and unsupported algorithms fail at signature time.
+    """
+    _ensure_init()
+    find = getattr(xmlsec, 'transformIdListFindByHref', None)
+    if find is None or not hasattr(xmlsec, 'transformIdsGet'):
+        return True
+    return find(xmlsec.transformIdsGet(), uri,
+        xmlsec.TransformUsageAny) is not None
+
+
+def suite_template(suite, with_cert=True):
+    """
+    Returns the XML source of a signature template for a suite of
+    ALGORITHM_SUITES, to be included in documents to be signed like
+    TEMPLATE_WITH_CERT (with_cert=True) or TEMPLATE_WITHOUT_CERT.
+    (for documents without template, use
+    SignatureTemplate(*ALGORITHM_SUITES[suite]) instead)
+    """
+    if suite not in ALGORITHM_SUITES:
+        raise RuntimeError, "Error: unknown algorithm suite \"%s\"" % suite
+    signature_method, digest_method, c14n_method = ALGORITHM_SUITES[suite]
+    key_info = ['KeyName']
+    if with_cert:
+        key_info.append('X509Data')
+    return _signature_xml(c14n_method, signature_method,
+        [_reference_xml('', [ENVELOPED_SIGNATURE], digest_method)], key_info)
+
+
+def _remove_stale_socket(path):
+    """
+    remove the socket file path if no server is listening on it anymore, so
+    that a server may be restarted. Raises RuntimeError if a server is
+    running, or if path is not a socket.
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise RuntimeError, "Error: \"%s\" exists and is not a socket" % path
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error:
+            os.remove(path)
+            return
+    finally:
+        sock.close()
+    raise RuntimeError, "Error: a server is already listening on \"%s\"" % path
+
+
+def _bind_private_socket(path, server_class, handler_class):
+    """
+    create a socket server listening on the Unix domain socket path, with
+    access for the current user only. The socket is bound in a new private
+    directory, its mode is changed, and then it is linked to path: it is
+    never accessible to other users, without changing the umask of the
+    process (which would affect the other threads).
+    Returns the server object. Raises an exception if path already exists.
+    """
+    # (mkdtemp creates the directory with mode 0700)
+    private_dir = tempfile.mkdtemp(prefix='.pyxmldsig',
+        dir=os.path.dirname(os.path.abspath(path)))
+    private_path = os.path.join(private_dir, 's')
+    try:
+        server = server_class(private_path, handler_class)
+        try:
+            os.chmod(private_path, 0600)
+            # unlike rename, link does not replace an existing file:
+            os.link(private_path, path)
+        except:
+            server.server_close()
+            raise
+    finally:
+        if os.path.exists(private_path):
+            os.remove(private_path)
+        os.rmdir(private_dir)
+    return server
+
+
+def _create_keys_mngr():
+    """
+    create and initialize a new xmlsec keys manager.
+    """
+    _ensure_init()
+    keysmngr = xmlsec.KeysMngr()
+    if keysmngr is None:
+        raise RuntimeError, "Error: failed to create keys manager."
+    if xmlsec.cryptoAppDefaultKeysMngrInit(keysmngr) < 0:
+        keysmngr.destroy()
+        raise RuntimeError, "Error: failed to initialize keys manager."
+    _objects.add('KeysMngr')
+    return keysmngr
+
+
+def _keys_mngr_add_cert(keysmngr, cert):
+    """
+    load a trusted Certificate into a keys manager, from memory.
+    """
+    if keysmngr.certLoadMemory(cert.pem, len(cert.pem), xmlsec.KeyDataFormatPem,
+                               xmlsec.KeyDataTypeTrusted) < 0:
+        raise RuntimeError, "Error: failed to load PEM certificate \"%s\"" % cert.subject
+
+
+def _remove_from_index(index, key, cert):
+    certs = index.get(key)
+    if certs is None:
+        return
+    certs.remove(cert)
+    if not certs:
+        del index[key]
+
+
+def _split_pem(data):
+    """
+    return the list of PEM certificates contained in data.
+    """
+    begin, end = '-----BEGIN CERTIFICATE-----', '-----END CERTIFICATE-----'
+    pems = []
+    start = data.find(begin)
+    while start >= 0:
+        stop = data.find(end, start)
+        if stop < 0:
+            raise RuntimeError, "Error: truncated PEM certificate"
+        pems.append(data[start:stop + len(end)] + '\n')
+        start = data.find(begin, stop)
+    return pems
+
+
+def _pem_to_der(pem):
+    """
+    return the DER data of a PEM certificate.
+    """
+    lines = pem.strip().splitlines()
+    if not lines or not lines[0].startswith('-----BEGIN'):
+        raise RuntimeError, "Error: invalid PEM certificate"
+    return base64.b64decode(''.join([line.strip() for line in lines[1:-1]]))
+
+
+def _der_read(data, pos):
+    """
+    read the DER element at position pos of data.
+    Returns a tuple (tag, start, end) where start and end are the positions
+    of the content of the element.
+    """
+    try:
+        tag = ord(data[pos])
+        length = ord(data[pos + 1])
+        pos += 2
+        if length & 0x80:
+            count = length & 0x7f
+            length = 0
+            for i in xrange(count):
+                length = (length << 8) | ord(data[pos + i])
+            pos += count
+    except IndexError:
+        raise RuntimeError, "Error: invalid DER data"
+    if pos + length > len(data):
+        raise RuntimeError, "Error: invalid DER data"
+    return tag, pos, pos + length
+
+
+def _der_children(data, start, end):
+    """
+    return the list of DER elements (tag, start, end) between start and end.
+    """
+    children = []
+    while start < end:
+        child = _der_read(data, start)
+        children.append(child)
+        start = child[2]
+    return children
+
+
+# names of usual attributes of X509 distinguished names:
+_X509_NAME_ATTRIBUTES = {
+    '2.5.4.3': 'CN',
+    '2.5.4.5': 'serialNumber',
+    '2.5.4.6': 'C',
+    '2.5.4.7': 'L',
+    '2.5.4.8': 'ST',
+    '2.5.4.10': 'O',
+    '2.5.4.11': 'OU',
+    '0.9.2342.19200300.100.1.25': 'DC',
+    '1.2.840.113549.1.9.1': 'emailAddress',
+    }
+
+_OID_SUBJECT_KEY_IDENTIFIER = '2.5.29.14'
+
+
+def _der_oid(value):
+    """
+    decode a DER object identifier to its dotted form.
+    """
+    first = ord(value[0])
+    parts = [str(min(first / 40, 2)), str(first - 40 * min(first / 40, 2))]
+    number = 0
+    for char in value[1:]:
+        number = (number << 7) | (ord(char) & 0x7f)
+        if not ord(char) & 0x80:
+            parts.append(str(number))
+            number = 0
+    return '.'.join(parts)
+
+
+# DER string types of X509 name attributes, and their encodings:
+_DER_STRING_ENCODINGS = {
+    0x0c: 'utf-8',      # UTF8String
+    0x13: 'latin-1',    # PrintableString
+    0x14: 'latin-1',    # TeletexString
+    0x16: 'latin-1',    # IA5String
+    0x1c: 'utf-32-be',  # UniversalString
+    0x1e: 'utf-16-be',  # BMPString
+    }
+
+# characters escaped in the values of distinguished names (RFC 4514):
+_DN_SPECIAL_RE = re.compile(r'([,+"\\<>;])')
+
+
+def _der_name(data, start, end):
+    """
+    decode a DER X509 Name to a string such as "C=FR, O=Example, CN=Name":
+    the relative distinguished names are in the order of the certificate,
+    separated by ", ", with multi-valued ones joined by "+". Values are
+    escaped as in RFC 4514 so that different names never give the same
+    string, and values which are not strings are given as "#" followed by
+    their DER encoding in hexadecimal.
+    """
+    rdns = []
+    for rdn_tag, rdn_start, rdn_end in _der_children(data, start, end):
+        attributes = []
+        for atv_tag, atv_start, atv_end in _der_children(data, rdn_start, rdn_end):
+            (oid_tag, oid_start, oid_end), (value_tag, value_start, value_end) = \
+                _der_children(data, atv_start, atv_end)[:2]
+            oid = _der_oid(data[oid_start:oid_end])
+            encoding = _DER_STRING_ENCODINGS.get(value_tag)
+            value = None
+            if encoding is not None:
+                try:
+                    value = _escape_dn_value(data[value_start:value_end]
+                        .decode(encoding).encode('utf-8'))
+                except UnicodeError:
+                    pass
+            if value is None:
+                # DER encoding of the value, from its tag:
+                value = '#' + data[oid_end:value_end].encode('hex')
+            attributes.append('%s=%s' % (_X509_NAME_ATTRIBUTES.get(oid, oid),
+                value))
+        rdns.append('+'.join(attributes))
+    return ', '.join(rdns)
+
+
+def _escape_dn_value(value):
+    """
+    escape the special characters of a distinguished name value (UTF-8 str),
+    as in RFC 4514.
+    """
+    value = _DN_SPECIAL_RE.sub(r'\\\1', value).replace('\x00', '\\00')
+    if value.endswith(' '):
+        value = value[:-1] + '\\ '
+    if value.startswith('#') or value.startswith(' '):
+        value = '\\' + value
+    return value
+
+
+def _parse_certificate(der):
+    """
+    parse a DER X509 certificate.
+    Returns a tuple (serial, issuer, subject, ski): serial number (int),
+    issuer and subject names (str, see _der_name), subject key identifier
+    (hexadecimal str, or None).
+    """
+    tag, start, end = _der_read(der, 0)
+    tag, start, end = _der_read(der, start)
+    fields = _der_children(der, start, end)
+    # skip the optional version [0]:
+    if fields[0][0] == 0xa0:
+        fields = fields[1:]
+    if len(fields) < 6:
+        raise RuntimeError, "Error: invalid X509 certificate"
+    # INTEGER in two's complement (serial numbers may be negative in
+    # non-conforming certificates):
+    value = der[fields[0][1]:fields[0][2]]
+    serial = 0
+    for char in value:
+        serial = (serial << 8) | ord(char)
+    if value and ord(value[0]) & 0x80:
+        serial -= 1 << (8 * len(value))
+    issuer = _der_name(der, fields[2][1], fields[2][2])
+    subject = _der_name(der, fields[4][1], fields[4][2])
+    ski = None
+    for tag, start, end in fields[6:]:
+        if tag != 0xa3:
+            continue
+        # extensions [3] EXPLICIT SEQUENCE OF Extension:
+        seq_tag, seq_start, seq_end = _der_read(der, start)
+        for ext_tag, ext_start, ext_end in _der_children(der, seq_start, seq_end):
+            ext = _der_children(der, ext_start, ext_end)
+            if _der_oid(der[ext[0][1]:ext[0][2]]) != _OID_SUBJECT_KEY_IDENTIFIER:
+                continue
+            # extnValue OCTET STRING containing the key identifier OCTET STRING:
+            value_tag, value_start, value_end = _der_read(der, ext[-1][1])
+            ski = der[value_start:value_end].encode('hex')
+    return serial, issuer, subject, ski
+
+
+def _only_sections(root, sections, signature):
+    """
+    return True if the element root contains nothing else than the nodes of
+    the list sections, the elements containing them, whitespace, comments
+    and the signature node, False otherwise (contents which would not be
+    signed by an IncrementalSigner).
+    """
+    # (libxml2 node objects are hashed and compared by node)
+    sections = set(sections)
+    containers = set()
+    if root not in sections:
+        containers.add(root)
+    for node in sections:
+        parent = node.parent
+        while parent is not None and parent.type == 'element':
+            if parent in containers:
+                break
+            containers.add(parent)
+            parent = parent.parent
+    for container in containers:
+        child = container.children
+        while child is not None:
+            if child.type == 'element':
+                if (child not in sections and child not in containers
+                    and child != signature):
+                    return False
+            elif child.type in ('text', 'cdata'):
+                if child.content.strip():
+                    return False
+            elif child.type != 'comment':
+                return False
+            child = child.next
+    return True
+
+
+def _dsig_children(node, name):
+    """
+    return the list of child elements of node named name, in the XML-DSig
+    namespace.
+    """
+    children = []
+    child = node.children
+    while child is not None:
+        if (child.type == 'element' and child.name == name
+            and child.ns() is not None and child.ns().content == DSIG_NS):
+            children.append(child)
+        child = child.next
+    return children
+
+
+def _signature_nodes(doc):
+    """
+    return the list of all the Signature elements of the parsed document
+    doc, in document order.
+    """
+    context = doc.xpathNewContext()
+    try:
+        context.xpathRegisterNs('ds', DSIG_NS)
+        return context.xpathEval('//ds:Signature')
+    finally:
+        context.xpathFreeContext()
+
+
+def _document(doc):
+    """
+    return the libxml2 document of doc, which may be a document or a node.
+    """
+    if doc.type == 'document_xml':
+        return doc
+    return doc.doc
+
+
+def _root_node(doc):
+    """
+    return the node where a Signature is searched: the root element of a
+    libxml2 document, or the node itself.
+    """
+    if doc.type == 'document_xml':
+        return doc.getRootElement()
+    return doc
+
+
+def _prescreen_children(node, name):
+    """
+    return the list of child elements of a signature element named name, for
+    SignaturePrescreen: they must all be in the XML-DSig namespace.
+    """
+    children = []
+    child = node.children
+    while child is not None:
+        if child.type == 'element':
+            if child.ns() is None or child.ns().content != DSIG_NS:
+                raise SignatureRejected("unexpected element %s in %s"
+                    % (child.name, name))
+            children.append(child)
+        child = child.next
+    return children
+
+
+def _prescreen_algorithm(node, allowed):
+    """
+    check that the Algorithm attribute of node is in allowed, for
+    SignaturePrescreen.
+    """
+    algorithm = node.prop('Algorithm')
+    if algorithm is None:
+        raise SignatureRejected("no Algorithm in %s" % node.name)
+    if algorithm not in allowed:
+        raise SignatureRejected("%s not allowed: %s" % (node.name, algorithm))
+
+
+def _signature_key_name(signature):
+    """
+    return the content of KeyInfo/KeyName in a Signature element, or None.
+    """
+    for key_info in _dsig_children(signature, 'KeyInfo'):
+        for key_name in _dsig_children(key_info, 'KeyName'):
+            return key_name.content.strip()
+    return None
+
+
+def _load_public_key(filename, key_name):
+    """
+    load a public key from a PEM file containing a public key or a X509
+    certificate, and set its name.
+    """
+    _ensure_init()
+    f = open(filename, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    if '-----BEGIN CERTIFICATE-----' in data:
+        key_format = xmlsec.KeyDataFormatCertPem
+    else:
+        key_format = xmlsec.KeyDataFormatPem
+    key = xmlsec.cryptoAppKeyLoad(filename = filename, format = key_format,
+        pwd = None, pwdCallback = None, pwdCallbackCtx = None)
+    if key is None:
+        raise RuntimeError, "Error: failed to load public key from \"%s\"" % filename
+    _objects.add('Key')
+    if key.setName(key_name) < 0:
+        _destroy_key(key)
+        raise RuntimeError, "Error: failed to set key name to \"%s\"" % key_name
+    return key
+
+
+def _parse_reference(reference):
+    """
+    return a tuple (uri, transforms, digest_method, digest) describing a
+    parsed Reference element.
+    """
+    transforms = []
+    for transforms_node in _dsig_children(reference, 'Transforms'):
+        for transform in _dsig_children(transforms_node, 'Transform'):
+            transforms.append(transform.prop('Algorithm'))
+    digest_methods = _dsig_children(reference, 'DigestMethod')
+    digest_values = _dsig_children(reference, 'DigestValue')
+    if len(digest_methods) != 1 or len(digest_values) != 1:
+        raise RuntimeError, "Error: invalid Reference element"
+    digest = ''.join(digest_values[0].content.split())
+    return (reference.prop('URI'), transforms,
+        digest_methods[0].prop('Algorithm'), digest)
+
+
+def _signed_manifest_references(doc, signature):
+    """
+    return the references of the Manifest elements referenced by the
+    SignedInfo of a verified signature, as tuples (uri, transforms,
+    digest_method, digest).
+    Only Manifest elements whose digest has been checked by xmlsec are used.
+    """
+    references = []
+    context = doc.xpathNewContext()
+    try:
+        context.xpathRegisterNs('ds', DSIG_NS)
+        for signed_info in _dsig_children(signature, 'SignedInfo'):
+            for reference in _dsig_children(signed_info, 'Reference'):
+                uri = reference.prop('URI') or ''
+                if reference.prop('Type') != MANIFEST_TYPE or not uri.startswith('#'):
+                    continue
+                # the element digested by xmlsec is the one registered with
+                # this ID (by xmlsec for Id attributes, or by a DTD for other
+                # attributes), and its Id must be unique:
+                try:
+                    manifest = doc.ID(uri[1:]).parent
+                except libxml2.treeError:
+                    manifest = None
+                manifests = context.xpathEval('//*[@Id=%s]' % quoteattr(uri[1:]))
+                if (manifest is None or len(manifests) != 1
+                    or manifests[0].nodePath() != manifest.nodePath()
+                    or manifest.name != 'Manifest' or manifest.ns() is None
+                    or manifest.ns().content != DSIG_NS):
+                    raise RuntimeError, "Error: Manifest %s not found" % uri
+                for manifest_reference in _dsig_children(manifest, 'Reference'):
+                    references.append(_parse_reference(manifest_reference))
+    finally:
+        context.xpathFreeContext()
+    return references
+
+
+def _element_digest(node, digest_method):
+    """
+    compute the digest of the element node after the EXC_C14N transform, as
+    for a same-document reference to its Id, on a copy of the element.
+    Returns the base64-encoded digest.
+    """
+    if digest_method not in _HASHLIB_NAMES:
+        raise RuntimeError, "Error: unsupported digest method \"%s\"" % digest_method
+    doc = libxml2.newDoc('1.0')
+    _objects.add('xmlDoc')
+    try:
+        # the namespaces used by the element and declared by its ancestors
+        # are declared again on the copy:
+        doc.setRootElement(node.docCopyNode(doc, 1))
+        data = doc.c14nMemory(None, 1, None, 0)
+    finally:
+        _free_doc(doc)
+    digest = hashlib.new(_HASHLIB_NAMES[digest_method], data)
+    return base64.b64encode(digest.digest())
+
+
+def _has_entity_refs(doc):
+    """
+    return True if the document doc contains entity reference nodes, i.e.
+    entities which were not substituted when it was parsed. They are only
+    looked for if the document has a DTD (XPath does not find them).
+    """
+    node = doc.children
+    while node is not None and node.type != 'dtd':
+        node = node.next
+    if node is None:
+        return False
+    elements = [doc]
+    while elements:
+        child = elements.pop().children
+        while child is not None:
+            if child.type == 'entity_ref':
+                return True
+            if child.type == 'element':
+                elements.append(child)
+            child = child.next
+    return False
+
+
+def _namespace_context(node):
+    """
+    return a string describing the namespaces declared by the element node
+    and its ancestors.
+    """
+    declarations = []
+    while node is not None and node.type == 'element':
+        ns = node.nsDefs()
+        while ns is not None:
+            declarations.append('%s=%s\n' % (ns.name, ns.content))
+            ns = ns.next
+        node = node.parent
+    return ''.join(declarations)
+
+
+def _compute_digests(items, workers=1, cache=None, verify=False,
+                     parser_profile='default'):
+    """
+    compute the digests of several data sources, in parallel with worker
+    threads (hashlib and file reads release the GIL).
+
+    - items: list of tuples (uri, source, transforms, digest_method), see
+             Xmldsig.sign_detached.
+    - workers: int, maximum number of threads.
+    - cache: DigestCache, or None.
+    - verify: bool, True if the digests are computed for a verification
+              (see DigestCache.digest).
+    - parser_profile: str, name of the profile of PARSER_PROFILES used to
+                      parse XML data for the C14N transforms.
+
+    Returns the list of base64-encoded digests, in the same order as items.
+    If an error occurs for one of the items, it is raised.
+    """
+    results = [None] * len(items)
+    errors = []
+    indexes = Queue.Queue()
+    for index in xrange(len(items)):
+        indexes.put(index)
+    def worker():
+        while not errors:
+            try:
+                index = indexes.get_nowait()
+            except Queue.Empty:
+                return
+            uri, source, transforms, digest_method = items[index]
+            try:
+                if cache is None:
+                    results[index] = _compute_digest(source, transforms,
+                        digest_method, parser_profile)
+                else:
+                    results[index] = cache.digest(uri, source, transforms,
+                        digest_method, verify, parser_profile)
+            except Exception, exc:
+                errors.append(exc)
+    workers = min(workers, len(items))
+    if workers <= 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=worker) for i in xrange(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def _compute_digest(source, transforms, digest_method, parser_profile='default'):
+    """
+    compute the digest of a data source after transforms, reading the data by
+    chunks when the transforms allow it. XML data is parsed with the parser
+    profile named parser_profile.
+    Returns the base64-encoded digest.
+    """
+    if digest_method not in _HASHLIB_NAMES:
+        raise RuntimeError, "Error: unsupported digest method \"%s\"" % digest_method
+    digest = hashlib.new(_HASHLIB_NAMES[digest_method])
+    chunks = _source_chunks(source)
+    for transform in transforms or ():
+        chunks = _transform_chunks(chunks, transform, parser_profile)
+    for chunk in chunks:
+        digest.update(chunk)
+    return base64.b64encode(digest.digest())
+
+
+def _source_chunks(source):
+    """
+    generator yielding the data of a source by chunks of DIGEST_CHUNK_SIZE
+    bytes. source is a str, a file object or a function returning a file
+    object.
+    """
+    if isinstance(source, unicode):
+        raise RuntimeError, "Error: the data of a reference must be encoded, not unicode"
+    if isinstance(source, str):
+        for start in xrange(0, len(source), DIGEST_CHUNK_SIZE):
+            yield source[start:start + DIGEST_CHUNK_SIZE]
+        return
+    if callable(source):
+        f = source()
+        close = True
+    else:
+        f = source
+        close = False
+    try:
+        while True:
+            chunk = f.read(DIGEST_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if close:
+            f.close()
+
+
+def _transform_chunks(chunks, transform, parser_profile='default'):
+    """
+    apply a transform to data given by chunks, and return the transformed
+    data by chunks. XML data is parsed with the options and limits of the
+    parser profile named parser_profile.
+    """
+    if transform == BASE64:
+        return _base64_chunks(chunks)
+    if transform in (C14N, C14N_WITH_COMMENTS, EXC_C14N, EXC_C14N_WITH_COMMENTS):
+        # canonicalization needs the whole XML document:
+        data = ''.join(chunks)
+        doc = _parse_string(data, PARSER_PROFILES[parser_profile])
+        try:
+            return [doc.c14nMemory(None,
+                int(transform in (EXC_C14N, EXC_C14N_WITH_COMMENTS)), None,
+                int(transform in (C14N_WITH_COMMENTS, EXC_C14N_WITH_COMMENTS)))]
+        finally:
+            _free_doc(doc)
+    raise RuntimeError, "Error: unsupported transform \"%s\"" % transform
+
+
+def _base64_chunks(chunks):
+    """
+    generator decoding base64 data given by chunks.
+    """
+    rest = ''
+    for chunk in chunks:
+        data = rest + ''.join(chunk.split())
+        # only decode complete groups of 4 characters:
+        end = len(data) - len(data) % 4
+        rest = data[end:]
+        if end:
+            yield base64.b64decode(data[:end])
+    if rest:
+        raise RuntimeError, "Error: invalid base64 data"
+
+
+def live_objects():
+    """
+    Returns a dictionary with the number of xmlsec and libxml2 objects
+    currently owned by this module, by kind: 'DSigCtx' (signature contexts,
+    kept in the pools of Xmldsig objects), 'KeysMngr' (keys managers),
+    'Key' (keys kept in cache, registered by name or loaded and not yet
+    given to a keys manager), 'xmlDoc' (parsed documents and templates).
+    Documents given by the caller to sign_doc/verify_doc are not counted.
+    The numbers should come back to the same values after each operation:
+    a number which keeps growing shows a leak.
+    """
+    return _objects.live()
+
+
+def _free_doc(doc):
+    """
+    free a document parsed by this module.
+    """
+    doc.freeDoc()
+    _objects.remove('xmlDoc')
+
+
+def _check_doc(doc):
+    """
+    check a document just parsed by libxml2, and return it. Raises an
+    exception if parsing failed or if the document has no root element
+    (then it is freed).
+    """
+    if doc is None:
+        raise RuntimeError, "Error: unable to parse XML data"
+    _objects.add('xmlDoc')
+    if doc.getRootElement() is None:
+        _free_doc(doc)
+        raise RuntimeError, "Error: unable to parse XML data"
+    return doc
+
+
+def _parse_string(xmlstring, profile):
+    """
+    parse XML data with the options and limits of a parser profile (a tuple
+    of PARSER_PROFILES), and return the document.
+    Raises RuntimeError if the data exceeds the limits of the profile or
+    cannot be parsed.
+    """
+    options, forbid_dtd, max_size, max_depth = profile
+    if max_size is not None and len(xmlstring) > max_size:
+        raise RuntimeError, "Error: XML data larger than %d bytes" % max_size
+    # a DTD is rejected before parsing, so that its entities are never
+    # expanded:
+    if forbid_dtd and _has_doctype(xmlstring):
+        raise RuntimeError, "Error: XML data with a DTD is not allowed"
+    doc = libxml2.readMemory(xmlstring, len(xmlstring), None, None, options)
+    return _check_tree(_check_doc(doc), forbid_dtd, max_depth)
+
+
+def _parse_xml_file(xmlfile, profile):
+    """
+    parse an XML file (filename or file object) with the options and limits
+    of a parser profile, see _parse_string.
+    A file object, or a file which is not a regular file (pipe...), is read
+    through Python and parsed from memory: libxml2 would read the file
+    descriptor of a file object, ignoring the data already buffered by
+    Python, and the data of a pipe can only be read once, so it could not be
+    checked before parsing.
+    """
+    if (isinstance(xmlfile, basestring)
+        and stat.S_ISREG(os.stat(xmlfile).st_mode)):
+        return _parse_regular_file(xmlfile, profile)
+    return _parse_string(_read_xml_file(xmlfile, profile), profile)
+
+
+def _read_xml_file(xmlfile, profile):
+    """
+    read the data of an XML file (filename or file object, from its current
+    position) through Python, up to one byte more than the maximum size of
+    the parser profile, so that _parse_string detects larger data.
+    """
+    options, forbid_dtd, max_size, max_depth = profile
+    if isinstance(xmlfile, basestring):
+        f = open(xmlfile, 'rb')
+        try:
+            return _read_xml_file(f, profile)
+        finally:
+            f.close()
+    if max_size is None:
+        return xmlfile.read()
+    return xmlfile.read(max_size + 1)
+
+
+def _parse_regular_file(filename, profile):
+    """
+    parse a regular XML file with the options and limits of a parser
+    profile, see _parse_string. Its size and its prolog are checked before
+    libxml2 reads it.
+    """
+    options, forbid_dtd, max_size, max_depth = profile
+    size = os.path.getsize(filename)
+    if max_size is not None and size > max_size:
+        raise RuntimeError, "Error: XML data larger than %d bytes" % max_size
+    if forbid_dtd:
+        f = open(filename, 'rb')
+        try:
+            head = f.read(_PROLOG_SIZE)
+        finally:
+            f.close()
+        if _has_doctype(head):
+            raise RuntimeError, "Error: XML data with a DTD is not allowed"
+    doc = libxml2.readFile(filename, None, options)
+    return _check_tree(_check_doc(doc), forbid_dtd, max_depth)
+
+
+def _has_doctype(data):
+    """
+    return True if the prolog of XML data contains a document type
+    declaration, or if it does not end within data (so that a DTD may
+    follow), or if it cannot be read (unknown encoding, or not XML data).
+    Data in UTF-16 or UTF-32 is decoded first.
+    """
+    for start, bom_size, encoding in _PROLOG_ENCODINGS:
+        if data.startswith(start):
+            data = data[bom_size:]
+            if encoding is not None:
+                # the end of data may cut a character:
+                data = data.decode(encoding, 'replace')
+            break
+    position = 0
+    while True:
+        position = _SPACES_RE.match(data, position).end()
+        if data.startswith('<?', position):
+            end = data.find('?>', position + 2)
+            if end < 0:
+                return True
+            position = end + 2
+        elif data.startswith('<!--', position):
+            end = data.find('-->', position + 4)
+            if end < 0:
+                return True
+            position = end + 3
+        else:
+            # only the root element may follow: '<!' is a DTD (possibly cut
+            # by the end of data), and anything else may be a DTD in an
+            # encoding which is not recognized here (EBCDIC, UTF-7...):
+            return (not data.startswith('<', position)
+                or data.startswith('<!', position)
+                or position + 1 == len(data))
+
+
+def _check_tree(doc, forbid_dtd, max_depth):
+    """
+    check the limits of a parser profile on a parsed document, and return
+    it. Raises RuntimeError if they are exceeded (then it is freed).
+    """
+    error = None
+    if forbid_dtd:
+        # the DTD is a child of the document node (in case _has_doctype
+        # missed it):
+        node = doc.children
+        while node is not None:
+            if node.type == 'dtd':
+                error = "Error: XML data with a DTD is not allowed"
+                break
+            node = node.next
+    if error is None and max_depth is not None:
+        # evaluated by libxml2 without walking the tree in Python:
+        xpath = 'boolean(/%s)' % '/'.join(['*'] * (max_depth + 1))
+        if doc.xpathEval(xpath):
+            error = "Error: XML data deeper than %d elements" % max_depth
+    if error is not None:
+        _free_doc(doc)
+        raise RuntimeError, error
+    return doc
+
+
+def _destroy_context(dsig_ctx):
+    """
+    destroy a signature context created by a _ContextPool.
+    """
+    dsig_ctx.destroy()
+    _objects.remove('DSigCtx')
+
+
+def _destroy_key(key):
+    """
+    destroy a key owned by this module.
+    """
+    key.destroy()
+    _objects.remove('Key')
+
+
+def clear_key_cache():
+    """
+    Remove all the keys and Xmldsig objects kept in cache by the process,
+    including the keys loaded by preload_key.
+    Keys already loaded into Xmldsig objects are not affected.
+    """
+    _key_cache.clear()
+    _xmldsig_cache.clear()
+    _key_cache.lock.acquire()
+    try:
+        keys = _preloaded_keys.values()
+        _preloaded_keys.clear()
+    finally:
+        _key_cache.lock.release()
+    for key in keys:
+        _destroy_key(key)
+
+
+def preload_key(key_file=None, cert_file=None, password='', key_name=None,
+                key_data=None, cert_data=None):
+    """
+    Load a private key once (decrypting it if it is password-protected) and
+    keep it in the process memory, so that Xmldsig objects created later
+    with the same parameters get a copy of it without loading the file nor
+    decrypting the key again. Unlike the LRU key cache, preloaded keys are
+    never evicted, until clear_key_cache is called.
+    Worker processes forked after this call (e.g. ParallelSigner on Unix)
+    inherit the decrypted key: call it in the parent process before starting
+    the workers, so that the key is decrypted once instead of once per
+    worker. The key is only kept in memory, never written anywhere, and the
+    password is not kept (only its hash, to identify the key).
+
+    Parameters: see Xmldsig.load.
+    """
+    key = _load_key(key_file, cert_file, password, key_name, key_data,
+        cert_data)
+    cache_id = _key_cache_id(key_file, cert_file, password, key_name, key_data,
+        cert_data)
+    _key_cache.lock.acquire()
+    try:
+        old_key = _preloaded_keys.pop(cache_id, None)
+        _preloaded_keys[cache_id] = key
+    finally:
+        _key_cache.lock.release()
+    if old_key is not None:
+        _destroy_key(old_key)
+
+
+def set_key_cache_size(size):
+    """
+    Change the maximum number of keys and Xmldsig objects kept in cache by the
+    process (KEY_CACHE_SIZE by default). 0 disables the cache.
+    """
+    _key_cache.resize(size)
+    _xmldsig_cache.resize(size)
+
+
+def _file_stamp(filename):
+    """
+    return a tuple identifying the current version of a file: absolute path,
+    modification time and size. Returns None if filename is None.
+    """
+    if filename is None:
+        return None
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+
+
+def _data_stamp(data):
+    """
+    return a tuple identifying the contents of a file loaded from memory, or
+    None if data is None.
+    """
+    if data is None:
+        return None
+    return ('<memory>', hashlib.sha256(data).hexdigest())
+
+
+def _key_cache_id(key_file, cert_file, password, key_name, key_data=None,
+                  cert_data=None):
+    """
+    return the key used to store a loaded key in cache. The password itself
+    is not kept, only its hash.
+    """
+    if password is None:
+        password_hash = None
+    else:
+        password_hash = hashlib.sha256(password).hexdigest()
+    if key_data is not None:
+        key_stamp = _data_stamp(key_data)
+    else:
+        key_stamp = _file_stamp(key_file)
+    if cert_data is not None:
+        cert_stamp = _data_stamp(cert_data)
+    else:
+        cert_stamp = _file_stamp(cert_file)
+    return (key_stamp, cert_stamp, password_hash, key_name)
+
+
+def _is_stale(cache_id):
+    """
+    return True if the files of a key cache id have been modified since the
+    key was loaded.
+    """
+    try:
+        for stamp in cache_id[:2]:
+            # (data loaded from memory never changes)
+            if (stamp is not None and len(stamp) == 3
+                and _file_stamp(stamp[0]) != stamp):
+                return True
+    except OSError:
+        return True
+    return False
+
+
+def _load_key(key_file, cert_file, password, key_name, key_data=None,
+              cert_data=None):
+    """
+    load a private key from key_file (or key_data) with an optional
+    certificate from cert_file (or cert_data), or get a copy of the same key
+    from the preloaded keys or the cache if the files have not been modified
+    since it was loaded.
+    Returns a new xmlsec.Key object which belongs to the caller.
+    """
+    try:
+        cache_id = _key_cache_id(key_file, cert_file, password, key_name,
+            key_data, cert_data)
+    except OSError:
+        # missing file: let xmlsec report the error
+        return _load_key_file(key_file, cert_file, password, key_name,
+            key_data, cert_data)
+    _key_cache.lock.acquire()
+    try:
+        key = _preloaded_keys.get(cache_id)
+        if key is None:
+            key = _key_cache.get(cache_id)
+        if key is not None:
+            # the cache keeps its own copy of the key:
+            key = key.duplicate()
+            _objects.add('Key')
+            return key
+    finally:
+        _key_cache.lock.release()
+    key = _load_key_file(key_file, cert_file, password, key_name, key_data,
+        cert_data)
+    # remove keys loaded from older versions of the files:
+    _key_cache.remove_if(_is_stale)
+    _key_cache.lock.acquire()
+    try:
+        if _key_cache.max_size > 0:
+            _key_cache.put(cache_id, key.duplicate())
+            _objects.add('Key')
+    finally:
+        _key_cache.lock.release()
+    return key
+
+
+def _load_key_file(key_file, cert_file, password, key_name, key_data=None,
+                   cert_data=None):
+    """
+    load a private key from key_file (or key_data) with an optional
+    certificate from cert_file (or cert_data), without cache. Returns a new
+    xmlsec.Key object.
+    """
+    _ensure_init()
+    # Load private key, with optional password
+    #print 'PASSWORD: %s' % password
+    if key_data is not None:
+        key_file = '<memory>'
+        key = xmlsec.cryptoAppKeyLoadMemory(key_data, len(key_data),
+            xmlsec.KeyDataFormatPem, password, None, None)
+    else:
+        key = xmlsec.cryptoAppKeyLoad(filename = key_file,
+            format = xmlsec.KeyDataFormatPem, pwd = password,
+            pwdCallback = None, pwdCallbackCtx = None)
+    # API references:
+    # http://pyxmlsec.labs.libre-entreprise.org/docs/html/xmlsec-module.html#cryptoAppKeyLoad
+    # http://www.aleksey.com/xmlsec/api/xmlsec-app.html#XMLSECCRYPTOAPPKEYLOAD
+    # http://www.aleksey.com/xmlsec/api/xmlsec-keysdata.html#XMLSECKEYDATAFORMAT
+    if key is None:
+        raise RuntimeError, "Error: failed to load private PEM key from \"%s\"" % key_file
+    _objects.add('Key')
+    try:
+        if key_name is not None:
+            # Set key name
+            if key.setName(key_name) < 0:
+                raise RuntimeError, "Error: failed to set key name to \"%s\"" % key_name
+        if cert_data is not None:
+            # Load certificate from memory and add to the key
+            if xmlsec.cryptoAppKeyCertLoadMemory(key, cert_data, len(cert_data),
+                                                 xmlsec.KeyDataFormatPem) < 0:
+                raise RuntimeError, "Error: failed to load PEM certificate from memory"
+        elif cert_file is not None:
+            # Load certificate and add to the key
+            if xmlsec.cryptoAppKeyCertLoad(key, cert_file, xmlsec.KeyDataFormatPem) < 0:
+                raise RuntimeError, "Error: failed to load PEM certificate \"%s\"" % cert_file
+    except:
+        _destroy_key(key)
+        raise
+    return key
+
+
+def _get_xmldsig(key_file, cert_file, password, key_name):
+    """
+    return a _SharedXmldsig holding an Xmldsig object with the given key
+    loaded, from the cache if the same key was already used by the module
+    functions. The caller owns a reference to it, and must release it after
+    use.
+    """
+    try:
+        cache_id = _key_cache_id(key_file, cert_file, password, key_name)
+    except OSError:
+        # missing file: let xmlsec report the error
+        return _SharedXmldsig(Xmldsig(key_file, cert_file, password, key_name))
+    shared = _cached_xmldsig(cache_id)
+    if shared is not None:
+        return shared
+    # the object is built once, even if several threads need it at the same
+    # time:
+    _xmldsig_build_lock.acquire()
+    try:
+        shared = _cached_xmldsig(cache_id)
+        if shared is None:
+            shared = _SharedXmldsig(Xmldsig(key_file, cert_file, password,
+                key_name))
+            if _shutting_down:
+                # not cached, so that shutdown does not wait for the cache:
+                return shared
+            _xmldsig_cache.remove_if(_is_stale)
+            # the cache holds its own reference, released when the object is
+            # evicted:
+            if not _xmldsig_cache.put(cache_id, shared.acquire()):
+                shared.release()
+    finally:
+        _xmldsig_build_lock.release()
+    return shared
+
+
+def _cached_xmldsig(cache_id):
+    """
+    return the _SharedXmldsig of the cache for cache_id with a new reference,
+    or None.
+    """
+    # the lock prevents the object from being evicted and destroyed before
+    # the reference is added:
+    _xmldsig_cache.lock.acquire()
+    try:
+        shared = _xmldsig_cache.get(cache_id)
+        if shared is not None:
+            shared.acquire()
+        return shared
+    finally:
+        _xmldsig_cache.lock.release()
+
+
+def _wait_shared_xmldsig():
+    """
+    wait until all the _SharedXmldsig objects are destroyed, i.e. until the
+    threads using objects removed from the cache have released them.
+    """
+    _shared_xmldsig_destroyed.acquire()
+    try:
+        while _shared_xmldsig_count > 0:
+            _shared_xmldsig_destroyed.wait()
+    finally:
+        _shared_xmldsig_destroyed.release()
+
+
+# process-wide caches of loaded keys and of Xmldsig objects for the module
+# functions (Xmldsig objects may be shared by several threads):
+_key_cache = _LRUCache(KEY_CACHE_SIZE, on_evict=_destroy_key)
+_xmldsig_cache = _LRUCache(KEY_CACHE_SIZE, on_evict=_SharedXmldsig.release)
+# lock held while an Xmldsig object is built for _xmldsig_cache:
+_xmldsig_build_lock = threading.Lock()
+# number of calls of shutdown waiting for the cached objects, during which
+# no new object is added to _xmldsig_cache (protected by
+# _xmldsig_build_lock):
+_shutting_down = 0
+# number of _SharedXmldsig objects not destroyed yet, which may still be used
+# by other threads after they are removed from the cache, and condition
+# notified when one is destroyed (see _wait_shared_xmldsig):
+_shared_xmldsig_count = 0
+_shared_xmldsig_destroyed = threading.Condition()
+# keys loaded by preload_key, never evicted (protected by _key_cache.lock):
+_preloaded_keys = {}
+
+# counters of live xmlsec and libxml2 objects, see live_objects:
+_objects = _ObjectCounter()
+
+
+# Xmldsig object of a ParallelSigner worker process, and exception raised
+# while it was loaded, if any:
+_worker_xmldsig = None
+_worker_error = None
+
+def _parallel_worker_init(key_file, cert_file, password, key_name, certificates,
+                          template=None, public_keys=None, key_data=None,
+                          cert_data=None, algorithms=None,
+                          parser_profile='default'):
+    """
+    initialize a worker process of ParallelSigner: load the key and
+    certificates once for all the jobs of the process.
+    """
+    global _worker_xmldsig, _worker_error
+    try:
+        _worker_xmldsig = Xmldsig(key_file, cert_file, password, key_name,
+            max_contexts=1, template=template, key_data=key_data,
+            cert_data=cert_data, algorithms=algorithms,
+            parser_profile=parser_profile)
+        if certificates:
+            _worker_xmldsig.load_certs(certificates)
+        if public_keys:
+            _worker_xmldsig.load_public_keys(public_keys)
+    except Exception, exc:
+        # keep the error to report it to the parent process: if it was raised
+        # here the pool would restart workers forever
+        _worker_error = _picklable_error(exc)
+
+
+def _parallel_worker_check(delay=0):
+    """
+    return a tuple (process ID, exception raised by _parallel_worker_init or
+    None), after waiting delay seconds.
+    """
+    time.sleep(delay)
+    return os.getpid(), _worker_error
+
+
+def _parallel_worker_job(operation, index, data):
+    """
+    run one job of ParallelSigner in a worker process: data is an XML string
+    for 'sign' and 'verify', a tuple (template_file, output_file) for
+    'sign_file', a filename for 'verify_file', a tuple (xmlstring, parts)
+    for 'verify_all' (index is then the part of the signatures to verify).
+    Returns a tuple (index, result, error), exceptions are never raised.
+    """
+    if _worker_error is not None:
+        return (index, None, _worker_error)
+    try:
+        if operation == 'sign':
+            result = _worker_xmldsig.sign_xmlstring(data)
+        elif operation == 'verify':
+            result = _worker_xmldsig.verify_xmlstring(data)
+        elif operation == 'sign_file':
+            _worker_xmldsig.sign_file(data[0], data[1])
+            result = data[1]
+        elif operation == 'verify_all':
+            result = [(number, path, valid,
+                error is not None and _picklable_error(error) or None)
+                for number, path, valid, error
+                in _worker_xmldsig._verify_all(data[0], (index, data[1]))]
+        else:
+            result = _worker_xmldsig.verify_file(data)
+    except Exception, exc:
+        return (index, None, _picklable_error(exc))
+    return (index, result, None)
+
+
+def _picklable_error(exc):
+    """
+    convert an exception so that it can be sent back from a worker process.
+    """
+    if isinstance(exc, RuntimeError):
+        return exc
+    return RuntimeError("%s: %s" % (exc.__class__.__name__, exc))
+
+
+# State of the initialization of the libraries: process ID where they were
+# initialized (None if they are not), and number of references taken by init
+# (the automatic initialization does not take any, see init and shutdown):
+_init_pid = None
+_init_refs = 0
+_init_lock = threading.Lock()
+
+def init():
+    """
+    Initialize the libraries (libxml2 and xmlsec) if needed, and add a
+    reference to them, which must be released by calling shutdown.
+    This is optional: the libraries are initialized automatically the first
+    time they are used (Xmldsig objects, keys or templates), but this
+    automatic initialization does not hold any reference, so that the
+    libraries are only stopped by shutdown after a call to init. The result
+    is the same whether init is called before or after the first use.
+    """
+    global _init_refs
+    _ensure_init()
+    _init_lock.acquire()
+    try:
+        _init_refs += 1
+    finally:
+        _init_lock.release()
+
+
+def _ensure_init():
+    """
+    Initialize the libraries if they are not initialized in this process.
+    This is cheap after the first call, and safe to call from several
+    threads. A process created with fork inherits the initialized libraries
+    of its parent: they are not initialized again.
+    The initialization is not done when the module is imported, so that
+    processes using only the constants or templates of this module do not
+    pay for it (the startup of the crypto backend in particular, see the
+    _init measure of bench_pyxmldsig.py --suite).
+    """
+    global _init_pid, _init_lock
+    pid = os.getpid()
+    if _init_pid == pid:
+        return
+    if _init_pid is not None:
+        # forked process: the libraries are already initialized, but the
+        # lock may have been held by another thread of the parent process
+        _init_lock = threading.Lock()
+        _init_pid = pid
+        return
+    _init_lock.acquire()
+    try:
+        if _init_pid is None:
+            _init()
+            _init_pid = pid
+    finally:
+        _init_lock.release()
+
+
+def _init():
+    """
+    Initialize necessary libraries (libxml2 and xmlsec).
+    Should be called once only: use _ensure_init instead.
+    Raises an exception if an error occurs.
+    """
+    # Init libxml library
+    libxml2.initParser()
+    # Init xmlsec library
+    assert xmlsec.init() >= 0, "Error: xmlsec initialization failed."
+    # Check loaded library version
+    assert xmlsec.checkVersion() == 1, "Error: loaded xmlsec library version is not compatible."
+    # Init crypto library
+    assert xmlsec.cryptoAppInit(None) >= 0, "Error: crypto initialization failed."
+    # Init xmlsec-crypto library
+    assert xmlsec.cryptoInit() >= 0, "Error: xmlsec-crypto initialization failed."
+
+
+def shutdown():
+    """
+    Release a reference to the libraries obtained with init, and shutdown
+    all libraries cleanly when the last one is released, so that several
+    users of this module in the same process do not stop the libraries used
+    by the others. Does nothing without a matching call to init (the
+    automatic initialization does not hold a reference).
+    Should only be called at the end of all xmlsec actions: Xmldsig objects
+    created before cannot be used after the libraries are stopped. They are
+    initialized again when they are used after that.
+    The objects cached for the module functions are destroyed first: if
+    other threads are still using some of them, shutdown waits until they
+    are done (objects created meanwhile by the module functions are not
+    cached). The libraries are not stopped if init is called by another
+    thread while shutdown waits.
+    """
+    global _init_pid, _init_refs, _shutting_down
+    _init_lock.acquire()
+    try:
+        if _init_refs <= 0:
+            # no reference taken by init
+            return
+        _init_refs -= 1
+        if _init_refs > 0:
+            return
+    finally:
+        _init_lock.release()
+    _xmldsig_build_lock.acquire()
+    try:
+        _shutting_down += 1
+    finally:
+        _xmldsig_build_lock.release()
+    try:
+        # cached keys and objects belong to the libraries, and the threads
+        # using them must not hold _init_lock:
+        clear_key_cache()
+        _wait_shared_xmldsig()
+        _init_lock.acquire()
+        try:
+            if _init_refs <= 0 and _init_pid is not None:
+                _shutdown()
+                _init_pid = None
+        finally:
+            _init_lock.release()
+    finally:
+        _xmldsig_build_lock.acquire()
+        try:
+            _shutting_down -= 1
+        finally:
+            _xmldsig_build_lock.release()
+
+
+def _shutdown():
+    """
+    Shutdown all libraries.
+    """
+    # Shutdown xmlsec-crypto library
+    xmlsec.cryptoShutdown()
+    # Shutdown crypto library
+    xmlsec.cryptoAppShutdown()
+    # Shutdown xmlsec library
+    xmlsec.shutdown()
+    # Shutdown LibXML2
+    libxml2.cleanupParser()
+
+
+#=== MAIN =====================================================================
+
+def _batch_files(args, extensions):
+    """
+    generator yielding a tuple (path, relative path, found in a directory)
+    for each file given on the command line: files, directories (walked
+    recursively, keeping the files with one of the extensions) or "-" to
+    read a list of files from stdin, one per line.
+    """
+    for arg in args:
+        if arg == '-':
+            for line in sys.stdin:
+                path = line.rstrip('\r\n')
+                if path:
+                    yield path, os.path.basename(path), False
+        elif os.path.isdir(arg):
+            for dirpath, dirnames, filenames in os.walk(arg):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if os.path.splitext(filename)[1].lower() in extensions:
+                        path = os.path.join(dirpath, filename)
+                        yield path, os.path.relpath(path, arg), True
+        else:
+            yield arg, os.path.basename(arg), False
+
+
+def _batch_output(path, relpath, output_dir, suffix):
+    """
+    return the output filename for a signed file, and create its directory if
+    needed.
+    """
+    if output_dir is None:
+        root, ext = os.path.splitext(path)
+        return root + suffix + ext
+    root, ext = os.path.splitext(relpath)
+    output = os.path.join(output_dir, root + suffix + ext)
+    dirname = os.path.dirname(output)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    return output
+
+
+def _main_batch(command, argv):
+    """
+    sign or verify many files with a ParallelSigner, for the sign and verify
+    subcommands of the command-line tool.
+    Returns the exit status: 0 if all files were signed or are valid, 1
+    otherwise.
+    """
+    from optparse import OptionParser
+    usage = "usage: %%prog %s [options] <files, directories or ->" % command
+    parser = OptionParser(usage=usage, version='%prog '+__version__)
+    if command == 'sign':
+        parser.add_option("-k", "--keyfile",
+            metavar="KEYFILE", help="PEM file containing private key",
+            action="store", type="string", dest="keyfile")
+        parser.add_option("-c", "--certfile",
+            metavar="CERTFILE", help="PEM file containing the X.509 certificate",
+            action="store", type="string", dest="certfile")
+        parser.add_option("-p", "--password", default='',
+            metavar="PASSWORD", help="Password of the private key file",
+            action="store", type="string", dest="password")
+        parser.add_option("-n", "--keyname", default=None,
+            metavar="KEYNAME", help="Name of the key in the signatures",
+            action="store", type="string", dest="keyname")
+        parser.add_option("-o", "--outdir", default=None,
+            metavar="OUTDIR", help="Directory where signed files are written (default: next to input files)",
+            action="store", type="string", dest="outdir")
+        parser.add_option("-s", "--suffix", default='_signed',
+            metavar="SUFFIX", help="Suffix added to the names of signed files (default: _signed)",
+            action="store", type="string", dest="suffix")
+        parser.add_option("-a", "--algorithms", default=None,
+            metavar="SUITE", help="Algorithms replacing those of the templates: %s" % ', '.join(sorted(ALGORITHM_SUITES)),
+            action="store", type="choice", choices=sorted(ALGORITHM_SUITES), dest="algorithms")
+    else:
+        parser.add_option("-c", "--certfile", default=[],
+            metavar="CERTFILE", help="PEM file containing a trusted X.509 certificate (may be repeated)",
+            action="append", type="string", dest="certfiles")
+        parser.add_option("-K", "--publickey", default=[],
+            metavar="NAME=FILE", help="PEM public key or certificate for a KeyName (may be repeated)",
+            action="append", type="string", dest="publickeys")
+    parser.add_option("-P", "--parser", default='default',
+        metavar="PROFILE", help="Parser profile: %s (default: default)" % ', '.join(sorted(PARSER_PROFILES)),
+        action="store", type="choice", choices=sorted(PARSER_PROFILES), dest="parser")
+    parser.add_option("-j", "--jobs", default=None,
+        metavar="JOBS", help="Number of worker processes (default: number of CPUs)",
+        action="store", type="int", dest="jobs")
+    parser.add_option("-e", "--extensions", default='.xml',
+        metavar="EXTENSIONS", help="Extensions of the files processed in directories (default: .xml)",
+        action="store", type="string", dest="extensions")
+    parser.add_option("-v", "--verbose", default=False,
+        help="Print the result for each file",
+        action="store_true", dest="verbose")
+    (options, args) = parser.parse_args(argv)
+
+    if not args or (command == 'sign' and not options.keyfile):
+        parser.print_help()
+        return 2
+    extensions = [ext.strip().lower() for ext in options.extensions.split(',')]
+    files = []
+    # output filenames already used, with their input files:
+    outputs = {}
+    collisions = []
+    # signed files of a previous run found in directories:
+    skipped = []
+    def inputs():
+        # the list of files is built while they are processed, to start
+        # immediately with large directories or lists:
+        for path, relpath, walked in _batch_files(args, extensions):
+            if (command == 'sign' and walked and options.suffix
+                and os.path.splitext(path)[0].endswith(options.suffix)):
+                skipped.append(path)
+                continue
+            if command != 'sign':
+                files.append(path)
+                yield path
+                continue
+            output = _batch_output(path, relpath, options.outdir,
+                options.suffix)
+            key = os.path.normcase(os.path.abspath(output))
+            if key == os.path.normcase(os.path.abspath(path)):
+                collisions.append('%s: output would replace the input file'
+                    % path)
+                continue
+            if key in outputs:
+                # never overwrite the output of another input file:
+                collisions.append('%s: same output file %s as %s'
+                    % (path, output, outputs[key]))
+                continue
+            outputs[key] = path
+            files.append(path)
+            yield path, output
+    if command == 'sign':
+        signer = ParallelSigner(options.keyfile, options.certfile,
+            options.password, options.keyname, processes=options.jobs,
+            algorithms=options.algorithms, parser_profile=options.parser)
+        results = signer.sign_files(inputs())
+    else:
+        public_keys = {}
+        for value in options.publickeys:
+            if '=' not in value:
+                parser.error("invalid public key \"%s\", expected NAME=FILE" % value)
+            name, filename = value.split('=', 1)
+            public_keys[name] = filename
+        signer = ParallelSigner(certificates=options.certfiles,
+            public_keys=public_keys, processes=options.jobs,
+            parser_profile=options.parser)
+        results = signer.verify_files(inputs())
+    start = time.time()
+    count = failed = invalid = 0
+    try:
+        for index, result, error in results:
+            count += 1
+            path = files[index]
+            if error is not None:
+                failed += 1
+                print >>sys.stderr, 'ERROR   %s: %s' % (path, error)
+            elif command == 'verify' and not result:
+                invalid += 1
+                print 'INVALID %s' % path
+            elif options.verbose:
+                print 'OK      %s' % path
+    finally:
+        signer.shutdown()
+    for error in collisions:
+        failed += 1
+        print >>sys.stderr, 'ERROR   %s' % error
+    if options.verbose:
+        for path in skipped:
+            print 'SKIPPED %s' % path
+    duration = time.time() - start
+    print >>sys.stderr, '%s: %d files in %.2fs (%.1f files/s), %d errors%s%s' % (
+        command, count, duration, count / max(duration, 1e-6), failed,
+        command == 'verify' and ', %d invalid' % invalid or '',
+        skipped and ', %d skipped (name ending with %s)' % (len(skipped),
+            options.suffix) or '')
+    return int(bool(failed or invalid))
+
+
+def _main_serve(argv):
+    """
+    run a SigningServer, for the serve subcommand of the command-line tool.
+    Returns the exit status.
+    """
+    from optparse import OptionParser
+    usage = "usage: %prog serve -s SOCKET -k NAME=KEYFILE[,CERTFILE] [options]"
+    parser = OptionParser(usage=usage, version='%prog '+__version__)
+    parser.add_option("-s", "--socket",
+        metavar="SOCKET", help="Filename of the Unix domain socket",
+        action="store", type="string", dest="socket")
+    parser.add_option("-k", "--key", default=[],
+        metavar="NAME=KEYFILE[,CERTFILE]", help="Named PEM private key with optional certificate (may be repeated)",
+        action="append", type="string", dest="keys")
+    parser.add_option("-p", "--password", default='',
+        metavar="PASSWORD", help="Password of the private key files",
+        action="store", type="string", dest="password")
+    parser.add_option("-c", "--certfile", default=[],
+        metavar="CERTFILE", help="PEM file containing a trusted X.509 certificate for verification (may be repeated)",
+        action="append", type="string", dest="certfiles")
+    parser.add_option("-d", "--default", default=None,
+        metavar="NAME", help="Name of the key used for requests without key name",
+        action="store", type="string", dest="default")
+    parser.add_option("-a", "--algorithms", default=None,
+        metavar="SUITE", help="Algorithms replacing those of the templates: %s" % ', '.join(sorted(ALGORITHM_SUITES)),
+        action="store", type="choice", choices=sorted(ALGORITHM_SUITES), dest="algorithms")
+    parser.add_option("-P", "--parser", default='default',
+        metavar="PROFILE", help="Parser profile: %s (default: default)" % ', '.join(sorted(PARSER_PROFILES)),
+        action="store", type="choice", choices=sorted(PARSER_PROFILES), dest="parser")
+    (options, args) = parser.parse_args(argv)
+
+    if args or not options.socket or not options.keys:
+        parser.print_help()
+        return 2
+    keys = {}
+    for value in options.keys:
+        if '=' not in value:
+            parser.error("invalid key \"%s\", expected NAME=KEYFILE[,CERTFILE]" % value)
+        name, files = value.split('=', 1)
+        key_file, cert_file = (files.split(',', 1) + [None])[:2]
+        keys[name] = Xmldsig(key_file, cert_file, options.password,
+            algorithms=options.algorithms, parser_profile=options.parser)
+        if options.certfiles:
+            keys[name].load_certs(options.certfiles)
+    server = SigningServer(options.socket, keys, options.default)
+    print >>sys.stderr, 'serving %d keys on %s' % (len(keys), options.socket)
+    try:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    finally:
+        server.close()
+        for xdsig in keys.values():
+            xdsig.destroy()
+    return 0
+
+
+def main():
+    """
+    To use this module as a command-line tool.
+    """
+    if sys.argv[1:2] in (['sign'], ['verify']):
+        sys.exit(_main_batch(sys.argv[1], sys.argv[2:]))
+    if sys.argv[1:2] == ['serve']:
+        sys.exit(_main_serve(sys.argv[2:]))
+    from optparse import OptionParser
+    # (a file named like a subcommand must follow "--")
+    usage = "usage: %prog [options] [--] file.xml"
+    parser = OptionParser(usage=usage, version='%prog '+__version__)
+    parser.add_option("-k", "--keyfile",
+        metavar="KEYFILE", help="PEM file containing private key",
+        action="store", type="string", dest="keyfile")
+    parser.add_option("-c", "--certfile",
+        metavar="CERTFILE", help="PEM file containing the X.509 certificate",
+        action="store", type="string", dest="certfile")
+    parser.add_option("-p", "--password", default='', # not None!
+        metavar="PASSWORD", help="Password of the private key file",
+        action="store", type="string", dest="password")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1 and not options.keyfile:
+        print __doc__
+        parser.print_help()
+        sys.exit()
+
+    init()
+    signed_xml = sign_file(template_file=args[0], key_file=options.keyfile,
+        cert_file=options.certfile, password=options.password)
+    print signed_xml
+    shutdown()
+
+
+if __name__ == "__main__":
+    main()
+
+# This code was developed while listening to Fleet Foxes
@@ -0,0 +1,341 @@
+"""
+pyxmldsig_client.py:
+
+Thin client for the signing server of pyxmldsig (pyxmldsig.SigningServer,
+started with "pyxmldsig.py serve"), to sign and verify XML Digital Signatures
+through a Unix domain socket from any local process, without importing
+pyxmldsig, libxml2 and xmlsec, and without loading keys.
+
+AUTHOR: Philippe Lagadec (decalage at laposte dot net)
+
+PROJECT WEBSITE: http://www.decalage.info/python/pyxmldsig
+
+LICENSE: same as pyxmldsig.py, see pyxmldsig.py for details.
+
+
+USAGE:
+
+import pyxmldsig_client
+
+client = pyxmldsig_client.Client('/tmp/pyxmldsig.sock')
+signed_xml = client.sign(xmlstring, key='mykey')
+valid = client.verify(signed_xml, key='mykey')
+
+# sign many documents, sending the requests without waiting for each
+# response (results are in the same order as the inputs):
+for signed_xml, error in client.sign_many(xmlstrings, key='mykey'):
+    print signed_xml
+client.close()
+"""
+
+#=== IMPORTS ==================================================================
+
+import sys, socket, struct, select
+
+#=== CONSTANTS ================================================================
+
+# Protocol of the server, see pyxmldsig.SERVER_REQUEST_HEADER:
+REQUEST_HEADER = '!IIBH'
+RESPONSE_HEADER = '!IIB'
+SIGN = 1
+VERIFY = 2
+OK = 0
+ERROR = 1
+
+# Default maximum number of requests sent by sign_many and verify_many
+# without having received their responses:
+MAX_PENDING = 64
+
+# Size of the reads and writes on the socket:
+_IO_SIZE = 256 * 1024
+
+#=== CLASSES ==================================================================
+
+class Client (object):
+    """
+    connection to a pyxmldsig signing server. A Client object must not be
+    used by several threads at the same time: use one Client per thread.
+    If the connection fails (timeout, server stopped, invalid response), it
+    is closed and the Client object cannot be used anymore, because the
+    responses could not be matched with the requests.
+    """
+
+    def __init__(self, path, timeout=None):
+        """
+        - path: str, filename of the Unix domain socket of the server.
+        - timeout: float, timeout in seconds of the socket operations, or
+                   None for no timeout.
+        """
+        self.timeout = timeout
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+        # data received from the server and not yet read: from the offset
+        # in the buffer, followed by the chunks not yet added to the buffer
+        # (the buffer is only rebuilt when a read needs the chunks):
+        self._buffer = ''
+        self._offset = 0
+        self._chunks = []
+        self._received = 0
+        self._next_id = 0
+        # error which made the connection unusable, or None:
+        self._error = None
+
+
+    def sign (self, xmlstring, key=''):
+        """
+        Sign xmlstring with the key named key on the server (or its default
+        key), see pyxmldsig.Xmldsig.sign_xmlstring.
+        xmlstring must be encoded (str, not unicode). A unicode key name is
+        encoded to UTF-8.
+
+        Returns a string containing the signed XML data.
+        Raises RuntimeError if the signature failed, TypeError or ValueError
+        if the request is invalid (the connection can still be used).
+        """
+        return self._run_one(SIGN, xmlstring, key)
+
+
+    def verify (self, xmlstring, key=''):
+        """
+        Verify the signature in xmlstring with the key named key on the
+        server (or its default key), see pyxmldsig.Xmldsig.verify_xmlstring.
+
+        Returns True if the signature is valid, False otherwise.
+        Raises RuntimeError if an error occurred.
+        """
+        return self._run_one(VERIFY, xmlstring, key) == '1'
+
+
+    def sign_many (self, xmlstrings, key='', max_pending=MAX_PENDING):
+        """
+        Sign several XML strings, sending up to max_pending requests before
+        reading their responses, so that the server processes them by
+        batches.
+
+        This is a generator: it yields one tuple (signed_xml, error) for each
+        input, in the same order as the inputs. If the signature failed,
+        signed_xml is None and error is a RuntimeError.
+        If the generator is closed before the end (e.g. by break), the
+        responses of the requests already sent are read and ignored, so that
+        the Client can still be used.
+        """
+        return self._run_many(SIGN, xmlstrings, key, max_pending)
+
+
+    def verify_many (self, xmlstrings, key='', max_pending=MAX_PENDING):
+        """
+        Verify signatures in several XML strings, like sign_many.
+
+        This is a generator: it yields one tuple (valid, error) for each
+        input, in the same order as the inputs. If an error occurred, valid
+        is None and error is a RuntimeError.
+        """
+        results = self._run_many(VERIFY, xmlstrings, key, max_pending)
+        try:
+            for output, error in results:
+                if error is None:
+                    yield (output == '1', None)
+                else:
+                    yield (None, error)
+        finally:
+            # read the pending responses now if this generator is closed:
+            results.close()
+
+
+    def close (self):
+        """
+        Close the connection to the server.
+        """
+        self._sock.close()
+        if self._error is None:
+            self._error = RuntimeError("Error: the connection is closed")
+
+
+    def _run_one (self, operation, xmlstring, key):
+        """
+        send one request and return the output of its response.
+        """
+        self._check()
+        request_id = self._send([(operation, xmlstring, key)])[0]
+        output, error = self._receive(request_id)
+        if error is not None:
+            raise error
+        return output
+
+
+    def _run_many (self, operation, xmlstrings, key, max_pending):
+        """
+        send requests for all xmlstrings with at most max_pending requests
+        waiting for their responses, and yield a tuple (output, error) for
+        each of them.
+        """
+        self._check()
+        pending = []
+        batch = []
+        try:
+            for xmlstring in xmlstrings:
+                batch.append((operation, xmlstring, key))
+                if len(pending) + len(batch) < max_pending:
+                    continue
+                # requests are sent together, then the oldest responses are
+                # read to make room for the next batch:
+                pending.extend(self._send(batch))
+                batch = []
+                while len(pending) > max_pending / 2:
+                    result = self._receive(pending[0])
+                    del pending[0]
+                    yield result
+            if batch:
+                pending.extend(self._send(batch))
+            while pending:
+                result = self._receive(pending[0])
+                del pending[0]
+                yield result
+        finally:
+            # generator closed before the end, or error raised by
+            # xmlstrings: the responses of the requests already sent must be
+            # read before the next requests
+            while pending and self._error is None:
+                self._receive(pending[0])
+                del pending[0]
+
+
+    def _check (self):
+        """
+        raise the error which made the connection unusable, if any.
+        """
+        if self._error is not None:
+            raise RuntimeError, "Error: the connection cannot be used anymore (%s)" % self._error
+
+
+    def _fail (self):
+        """
+        close the connection after an error which leaves responses unread.
+        """
+        if self._error is None:
+            self._error = sys.exc_info()[1]
+        self._sock.close()
+
+
+    def _send (self, requests):
+        """
+        send a list of requests (operation, xmlstring, key) together.
+        Returns the list of their request ids.
+        Responses are received while sending, otherwise the server could
+        block writing responses while this client blocks writing requests.
+        Invalid requests raise TypeError or ValueError before anything is
+        sent.
+        """
+        requests = [_check_request(operation, xmlstring, key)
+            for operation, xmlstring, key in requests]
+        try:
+            return self._send_requests(requests)
+        except:
+            self._fail()
+            raise
+
+
+    def _send_requests (self, requests):
+        """
+        send a list of requests, see _send.
+        """
+        frames = []
+        request_ids = []
+        for operation, xmlstring, key in requests:
+            request_id = self._next_id
+            self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+            frames.append(struct.pack(REQUEST_HEADER, len(xmlstring),
+                request_id, operation, len(key)))
+            frames.append(key)
+            frames.append(xmlstring)
+            request_ids.append(request_id)
+        data = ''.join(frames)
+        offset = 0
+        while offset < len(data):
+            readable, writable = select.select([self._sock], [self._sock], [],
+                self.timeout)[:2]
+            if not readable and not writable:
+                raise socket.timeout("timed out")
+            if readable:
+                self._recv()
+            if writable:
+                offset += self._sock.send(buffer(data, offset, _IO_SIZE))
+        return request_ids
+
+
+    def _receive (self, request_id):
+        """
+        read the next response, which must be the response to request_id.
+        Returns a tuple (output, error).
+        """
+        try:
+            return self._receive_response(request_id)
+        except:
+            self._fail()
+            raise
+
+
+    def _receive_response (self, request_id):
+        """
+        read the next response, see _receive.
+        """
+        header = self._read(struct.calcsize(RESPONSE_HEADER))
+        length, response_id, status = struct.unpack(RESPONSE_HEADER, header)
+        output = self._read(length)
+        if response_id != request_id:
+            raise RuntimeError, "Error: unexpected response from the server"
+        if status != OK:
+            return None, RuntimeError(output)
+        return output, None
+
+
+    def _read (self, size):
+        """
+        read exactly size bytes from the server.
+        """
+        while self._received < size:
+            self._recv()
+        if len(self._buffer) - self._offset < size:
+            self._buffer = ''.join([self._buffer[self._offset:]] + self._chunks)
+            self._offset = 0
+            self._chunks = []
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += size
+        self._received -= size
+        # the data already read is dropped once it is half of the buffer, so
+        # that each byte is copied a bounded number of times:
+        if self._offset * 2 >= len(self._buffer):
+            self._buffer = self._buffer[self._offset:]
+            self._offset = 0
+        return data
+
+
+    def _recv (self):
+        """
+        receive available data from the server.
+        """
+        chunk = self._sock.recv(_IO_SIZE)
+        if not chunk:
+            raise RuntimeError, "Error: connection closed by the server"
+        self._chunks.append(chunk)
+        self._received += len(chunk)
+
+
+#=== FUNCTIONS ================================================================
+
+def _check_request(operation, xmlstring, key):
+    """
+    return a request (operation, xmlstring, key) with the sizes and types
+    expected by the protocol: the lengths sent in the header must be the
+    numbers of bytes sent.
+    """
+    if isinstance(xmlstring, unicode):
+        raise TypeError, "xmlstring must be encoded (str), not unicode"
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    if len(key) > 0xFFFF:
+        raise ValueError, "key name longer than 65535 bytes"
+    if len(xmlstring) > 0xFFFFFFFF:
+        raise ValueError, "XML data larger than 4 GB"
+    return operation, xmlstring, key
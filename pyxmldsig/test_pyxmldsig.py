@@ -0,0 +1,1829 @@
+"""
+test_pyxmldsig.py:
+
+Unit tests for pyxmldsig: signature and verification round trips, error
+paths, and rejection of tampered or hostile data.
+
+USAGE:
+python test_pyxmldsig.py [-v] [TestCase[.test_method]]
+
+The keys and certificates used by the tests are generated in a temporary
+directory with the openssl command line tool. The tests are skipped if
+pyxmlsec, libxml2 or openssl are not available.
+
+AUTHOR: Philippe Lagadec (decalage at laposte dot net)
+
+PROJECT WEBSITE: http://www.decalage.info/python/pyxmldsig
+
+LICENSE: see pyxmldsig.py
+"""
+
+#=== IMPORTS ==================================================================
+
+import sys, os, shutil, subprocess, tempfile, threading, time, unittest
+import socket
+import pickle
+from StringIO import StringIO
+
+try:
+    import pyxmldsig
+except ImportError:
+    # pyxmlsec or libxml2 are missing: all the tests are skipped
+    pyxmldsig = None
+
+
+#=== CONSTANTS ================================================================
+
+# document to be signed, with an enveloped signature template:
+DOCUMENT = '<doc>\n<a>hello</a>\n<b>world</b>\n%s</doc>\n'
+
+# temporary directory, keys and certificates created by setUpModule:
+TMPDIR = None
+KEY_FILE = CERT_FILE = None
+KEY2_FILE = CERT2_FILE = None
+
+
+#=== FUNCTIONS ================================================================
+
+def setUpModule():
+    global TMPDIR, KEY_FILE, CERT_FILE, KEY2_FILE, CERT2_FILE
+    if pyxmldsig is None:
+        raise unittest.SkipTest("pyxmlsec and libxml2 are required")
+    TMPDIR = tempfile.mkdtemp(prefix='test_pyxmldsig')
+    try:
+        KEY_FILE, CERT_FILE = make_key('test', '/CN=test')
+        KEY2_FILE, CERT2_FILE = make_key('other', '/CN=other')
+    except (OSError, subprocess.CalledProcessError):
+        shutil.rmtree(TMPDIR)
+        raise unittest.SkipTest("the openssl command is required")
+
+
+def tearDownModule():
+    if TMPDIR is not None:
+        shutil.rmtree(TMPDIR)
+
+
+def openssl(*args):
+    """
+    run the openssl command line tool, raise an exception if it fails.
+    """
+    devnull = open(os.devnull, 'w')
+    try:
+        subprocess.check_call(('openssl',) + args, stdout=devnull,
+            stderr=devnull)
+    finally:
+        devnull.close()
+
+
+def make_key(name, subject, key_type='rsa:2048'):
+    """
+    create an unencrypted private key and its self-signed certificate in
+    TMPDIR. Returns the tuple (key_file, cert_file).
+    """
+    key_file = temp_path(name + '_key.pem')
+    cert_file = temp_path(name + '_cert.pem')
+    openssl('req', '-x509', '-newkey', key_type, '-nodes', '-days', '30',
+        '-subj', subject, '-keyout', key_file, '-out', cert_file)
+    return key_file, cert_file
+
+
+def temp_path(filename):
+    """
+    return the path of filename in the temporary directory of the tests.
+    """
+    return os.path.join(TMPDIR, filename)
+
+
+def write_file(filename, data):
+    """
+    write data to filename in the temporary directory, and return its path.
+    """
+    path = temp_path(filename)
+    f = open(path, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return path
+
+
+def break_worker():
+    """
+    run in a worker process of ParallelSigner, to simulate a failure of its
+    initialization.
+    """
+    pyxmldsig._worker_error = RuntimeError("Error: broken worker")
+
+
+def run_tool(args, cwd=None):
+    """
+    run pyxmldsig.py as a command-line tool with the list of arguments args.
+    Returns the tuple (exit status, stdout, stderr).
+    """
+    script = os.path.splitext(os.path.abspath(pyxmldsig.__file__))[0] + '.py'
+    process = subprocess.Popen([sys.executable, script] + args, cwd=cwd,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    return process.returncode, stdout, stderr
+
+
+def document(content='hello'):
+    """
+    return a document to be signed, with a signature template.
+    """
+    return DOCUMENT.replace('hello', content) % pyxmldsig.TEMPLATE_WITH_CERT
+
+
+#=== TESTS ====================================================================
+
+class XmldsigTestCase (unittest.TestCase):
+    """
+    base class of the tests: creates a signer with KEY_FILE and a verifier
+    trusting CERT_FILE, and checks that they do not leak xmlsec objects.
+    """
+
+    def setUp(self):
+        self.live = pyxmldsig.live_objects()
+        self.signer = pyxmldsig.Xmldsig(KEY_FILE, CERT_FILE)
+        self.verifier = pyxmldsig.Xmldsig()
+        self.verifier.load_certs([CERT_FILE])
+
+    def tearDown(self):
+        self.signer.destroy()
+        self.verifier.destroy()
+        live = pyxmldsig.live_objects()
+        # keys may have been added to the process-wide key cache:
+        live.pop('Key', None)
+        expected = dict(self.live)
+        expected.pop('Key', None)
+        for kind in set(live) | set(expected):
+            self.assertEqual(live.get(kind, 0), expected.get(kind, 0),
+                'leak of %s objects' % kind)
+
+
+class SignManyTest (XmldsigTestCase):
+    """
+    sign_many and verify_many, reusing the signature contexts of the pool.
+    """
+
+    def test_round_trip(self):
+        signed = self.signer.sign_xmlstring(document())
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+
+    def test_tampered(self):
+        signed = self.signer.sign_xmlstring(document())
+        self.assertFalse(self.verifier.verify_xmlstring(
+            signed.replace('hello', 'hellO')))
+
+    def test_sign_many_order_and_errors(self):
+        inputs = [document('one'), '<not xml', document('three')]
+        results = list(self.signer.sign_many(inputs))
+        self.assertEqual(len(results), 3)
+        self.assertTrue('one' in results[0][0] and results[0][1] is None)
+        self.assertEqual(results[1][0], None)
+        self.assertTrue(isinstance(results[1][1], Exception))
+        self.assertTrue('three' in results[2][0] and results[2][1] is None)
+        signed = [results[0][0], results[2][0],
+            results[2][0].replace('three', 'thrEE')]
+        self.assertEqual(list(self.verifier.verify_many(signed)),
+            [(True, None), (True, None), (False, None)])
+
+    def test_reset_failure(self):
+        # the context cannot be reinitialized nor replaced after the first
+        # document: it must be destroyed once, and its slot freed
+        pool = self.signer._pool
+        self.signer.sign_xmlstring(document())
+        self.assertEqual(len(pool._idle), 1)
+        pool._idle[0].initialize = lambda keysmngr: -1
+        def create():
+            raise RuntimeError("Error: failed to create signature context")
+        pool._create = create
+        try:
+            results = list(self.signer.sign_many([document(), document()]))
+        finally:
+            del pool._create
+        self.assertEqual([error.__class__ for output, error in results],
+            [RuntimeError, RuntimeError])
+        self.assertEqual(pool._count, 0)
+        self.assertEqual(pool._idle, [])
+        # the pool is still usable:
+        self.assertTrue(self.verifier.verify_xmlstring(
+            self.signer.sign_xmlstring(document())))
+
+
+class SignFileTest (XmldsigTestCase):
+    """
+    sign_file and verify_file, with filenames and file objects.
+    """
+
+    def test_filenames(self):
+        template = write_file('template.xml', document())
+        output = temp_path('signed.xml')
+        self.assertEqual(self.signer.sign_file(template, output), None)
+        self.assertTrue(self.verifier.verify_file(output))
+        tampered = write_file('tampered.xml',
+            open(output, 'rb').read().replace('hello', 'hellO'))
+        self.assertFalse(self.verifier.verify_file(tampered))
+
+    def test_buffered_file_object(self):
+        # the first line is read by Python, which buffers the rest of the
+        # file: the document must be read from the position of the file
+        # object, not of its file descriptor
+        template = write_file('template.xml', 'header\n' + document())
+        f = open(template, 'rb')
+        try:
+            self.assertEqual(f.readline(), 'header\n')
+            signed = self.signer.sign_file(f)
+        finally:
+            f.close()
+        self.assertTrue(self.verifier.verify_file(StringIO(signed)))
+        output = StringIO()
+        self.signer.sign_file(StringIO(document()), output)
+        self.assertTrue(self.verifier.verify_xmlstring(output.getvalue()))
+        path = temp_path('output.xml')
+        f = open(path, 'wb')
+        try:
+            self.signer.sign_file(StringIO(document()), f)
+        finally:
+            f.close()
+        self.assertTrue(self.verifier.verify_file(path))
+
+    def test_missing_file(self):
+        self.assertRaises(Exception, self.signer.sign_file,
+            temp_path('missing.xml'))
+
+
+class SignatureTemplateTest (XmldsigTestCase):
+    """
+    signature templates built from a choice of algorithms and inserted into
+    the documents.
+    """
+
+    def test_algorithms(self):
+        template = pyxmldsig.SignatureTemplate(pyxmldsig.RSA_SHA256,
+            pyxmldsig.SHA256, pyxmldsig.EXC_C14N)
+        try:
+            signed = self.signer.sign_xmlstring('<doc><a>data</a></doc>',
+                template)
+        finally:
+            template.destroy()
+        self.assertTrue(pyxmldsig.RSA_SHA256 in signed)
+        self.assertTrue(pyxmldsig.SHA256 in signed)
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+        self.assertFalse(self.verifier.verify_xmlstring(
+            signed.replace('data', 'datA')))
+
+    def test_default_template_and_target(self):
+        template = pyxmldsig.SignatureTemplate(target='/doc/b')
+        signer = pyxmldsig.Xmldsig(KEY_FILE, CERT_FILE, template=template)
+        try:
+            signed = signer.sign_xmlstring('<doc><a>data</a><b/></doc>')
+            self.assertTrue('<b><Signature' in signed)
+            self.assertTrue(self.verifier.verify_xmlstring(signed))
+            # the template is not inserted into a document which has one:
+            signed = signer.sign_xmlstring(document())
+            self.assertEqual(signed.count('<Signature xmlns'), 1)
+            self.assertRaises(RuntimeError, signer.sign_xmlstring,
+                '<doc><a/></doc>')
+        finally:
+            signer.destroy()
+            template.destroy()
+
+    def test_pickle(self):
+        template = pyxmldsig.SignatureTemplate(key_info=['KeyName'])
+        copy = pickle.loads(pickle.dumps(template))
+        try:
+            self.assertEqual(str(copy), str(template))
+            signed = self.signer.sign_xmlstring('<doc/>', copy)
+            self.assertTrue('<X509Data' not in signed)
+        finally:
+            copy.destroy()
+            template.destroy()
+
+
+class DetachedSignatureTest (XmldsigTestCase):
+    """
+    detached signatures of several data objects with a Manifest.
+    """
+
+    def sources(self):
+        path = write_file('data.bin', 'file data\n' * 1000)
+        return {'inline': 'inline data', 'file': lambda: open(path, 'rb'),
+            'base64': 'aGVsbG8gd29ybGQ='}
+
+    def sign(self, sources):
+        transforms = {'base64': [pyxmldsig.BASE64]}
+        return self.signer.sign_detached([(uri, source, transforms.get(uri))
+            for uri, source in sorted(sources.items())])
+
+    def test_round_trip(self):
+        sources = self.sources()
+        signature = self.sign(sources)
+        self.assertTrue(self.verifier.verify_detached(signature, sources))
+        sources['inline'] = 'inline datA'
+        self.assertFalse(self.verifier.verify_detached(signature, sources))
+
+    def test_sources_must_match(self):
+        sources = self.sources()
+        signature = self.sign(sources)
+        extra = dict(sources, other='unsigned data')
+        self.assertFalse(self.verifier.verify_detached(signature, extra))
+        del sources['file']
+        self.assertFalse(self.verifier.verify_detached(signature, sources))
+
+    def test_empty_manifest(self):
+        signature = self.sign({})
+        self.assertFalse(self.verifier.verify_detached(signature, {}))
+
+    def test_unicode_source(self):
+        self.assertRaises(RuntimeError, self.sign, {'text': u'data'})
+        signature = self.sign({'text': 'data'})
+        self.assertRaises(RuntimeError, self.verifier.verify_detached,
+            signature, {'text': u'data'})
+
+    def test_parser_profile(self):
+        xml = ('<!DOCTYPE doc [\n<!ENTITY e "hello">\n]>\n'
+               '<doc>&e;</doc>\n')
+        signature = self.signer.sign_detached([('doc', xml,
+            [pyxmldsig.EXC_C14N])])
+        self.assertTrue(self.verifier.verify_detached(signature, {'doc': xml}))
+        # with a cache shared by both objects, the digest computed with the
+        # default profile is not used by the strict one:
+        self.verifier.digest_cache = pyxmldsig.DigestCache()
+        self.assertTrue(self.verifier.verify_detached(signature, {'doc': xml}))
+        self.verifier.set_parser_profile('strict')
+        self.assertRaises(RuntimeError, self.verifier.verify_detached,
+            signature, {'doc': xml})
+        self.signer.set_parser_profile('strict')
+        self.assertRaises(RuntimeError, self.signer.sign_detached,
+            [('doc', xml, [pyxmldsig.EXC_C14N])])
+
+    def test_tampered_signature(self):
+        sources = self.sources()
+        signature = self.sign(sources)
+        tampered = signature.replace('URI="inline"', 'URI="inlinE"')
+        sources['inlinE'] = sources.pop('inline')
+        self.assertFalse(self.verifier.verify_detached(tampered, sources))
+
+    def test_manifest_resolved_by_id(self):
+        # the Manifest read is the element registered with its ID, as for
+        # xmlsec, not the first element with an Id attribute:
+        signature = self.sign({'text': 'data'})
+        doc = pyxmldsig.libxml2.parseDoc(signature.replace('<Object>',
+            '<Object><other xml:id="manifest"/>'))
+        try:
+            node = doc.getRootElement()
+            self.assertRaises(RuntimeError,
+                pyxmldsig._signed_manifest_references, doc, node)
+        finally:
+            doc.freeDoc()
+
+
+class DigestCacheTest (XmldsigTestCase):
+    """
+    cache of the digests of detached references.
+    """
+
+    def test_static_uris(self):
+        cache = pyxmldsig.DigestCache(static_uris=['policy.xml'])
+        self.signer.digest_cache = cache
+        self.verifier.digest_cache = cache
+        policy = '<policy>signed policy</policy>'
+        references = [('policy.xml', policy, [pyxmldsig.C14N]),
+                      ('data', 'data', None)]
+        signature = self.signer.sign_detached(references)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        # the static URI is not read again:
+        self.signer.sign_detached([('policy.xml', 'not read',
+            [pyxmldsig.C14N])])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        sources = {'policy.xml': policy, 'data': 'data'}
+        self.assertTrue(self.verifier.verify_detached(signature, sources))
+        # the digest cached for the URI is not used for verification:
+        sources['policy.xml'] = '<policy>tampered policy</policy>'
+        self.assertFalse(self.verifier.verify_detached(signature, sources))
+        # and a verification does not store the digest of its source for
+        # the URI, which would then be used by the next signatures:
+        cache.clear()
+        self.assertFalse(self.verifier.verify_detached(signature, sources))
+        signature = self.signer.sign_detached([('policy.xml', policy,
+            [pyxmldsig.C14N])])
+        self.assertTrue(self.verifier.verify_detached(signature,
+            {'policy.xml': policy}))
+
+    def test_data(self):
+        cache = pyxmldsig.DigestCache()
+        self.signer.digest_cache = cache
+        references = [('a', '<a>same</a>', [pyxmldsig.C14N]),
+                      ('b', '<a>same</a>', [pyxmldsig.C14N]),
+                      ('c', 'no transforms', None)]
+        signature = self.signer.sign_detached(references, workers=1)
+        # cached by contents, only with transforms:
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertTrue(self.verifier.verify_detached(signature,
+            {'a': '<a>same</a>', 'b': '<a>same</a>', 'c': 'no transforms'}))
+
+
+class TrustStoreTest (XmldsigTestCase):
+    """
+    verification with the certificates of a TrustStore, and their indexes.
+    """
+
+    def test_verify_and_remove(self):
+        store = pyxmldsig.TrustStore()
+        store.add_files([CERT_FILE, CERT2_FILE])
+        verifier = pyxmldsig.Xmldsig(trust_store=store)
+        try:
+            signed = self.signer.sign_xmlstring(document())
+            self.assertTrue(verifier.verify_xmlstring(signed))
+            self.assertFalse(verifier.verify_xmlstring(
+                signed.replace('hello', 'hellO')))
+            store.remove(store.find_by_subject('CN=test'))
+            self.assertEqual(len(store.certificates()), 1)
+            # the certificate of the signature is not trusted anymore:
+            try:
+                valid = verifier.verify_xmlstring(signed)
+            except RuntimeError:
+                valid = False
+            self.assertFalse(valid)
+            store.replace(open(CERT_FILE).read())
+            self.assertTrue(verifier.verify_xmlstring(signed))
+        finally:
+            verifier.destroy()
+            store.destroy()
+
+    def test_indexes(self):
+        store = pyxmldsig.TrustStore()
+        store.add_directory(TMPDIR)
+        cert = store.find_by_subject('CN=other')[0]
+        self.assertEqual(store.find_by_fingerprint(cert.fingerprint.upper()),
+            cert)
+        self.assertEqual(store.find_by_issuer_serial('CN=other', cert.serial),
+            [cert])
+        if cert.ski is not None:
+            self.assertEqual(store.find_by_ski(cert.ski), [cert])
+        self.assertEqual(store.find_by_subject('CN=missing'), [])
+
+    def certificate(self, name, subject, *options):
+        key_file, cert_file = temp_path(name + '_key.pem'), temp_path(name + '.crt')
+        openssl('req', '-x509', '-newkey', 'rsa:1024', '-nodes', '-days',
+            '1', '-subj', subject, '-keyout', key_file, '-out', cert_file,
+            *options)
+        return pyxmldsig.Certificate(open(cert_file).read())
+
+    def test_names(self):
+        # special characters are escaped, so that different names are never
+        # mixed up:
+        comma = self.certificate('comma', '/CN=a, O=b')
+        separate = self.certificate('separate', '/CN=a/O=b')
+        multi = self.certificate('multi', '/CN=a+O=b', '-multivalue-rdn')
+        spaces = self.certificate('spaces', '/CN= #x\\ ')
+        self.assertEqual(comma.subject, 'CN=a\\, O=b')
+        self.assertEqual(separate.subject, 'CN=a, O=b')
+        self.assertEqual(multi.subject, 'CN=a+O=b')
+        self.assertEqual(spaces.subject, 'CN=\\ #x\\ ')
+        store = pyxmldsig.TrustStore()
+        store.add([comma.pem, separate.pem])
+        self.assertEqual([cert.fingerprint for cert
+            in store.find_by_subject('CN=a, O=b')], [separate.fingerprint])
+
+    def test_negative_serial(self):
+        cert = self.certificate('negative', '/CN=negative', '-set_serial',
+            '-1234')
+        self.assertEqual(cert.serial, -1234)
+        cert = self.certificate('positive', '/CN=positive', '-set_serial',
+            '255')
+        self.assertEqual(cert.serial, 255)
+
+
+class PublicKeyTest (XmldsigTestCase):
+    """
+    verification of signatures without certificate, with public keys found
+    by KeyName.
+    """
+
+    def setUp(self):
+        XmldsigTestCase.setUp(self)
+        self.named_signer = pyxmldsig.Xmldsig(KEY_FILE, key_name='mykey')
+
+    def tearDown(self):
+        self.named_signer.destroy()
+        XmldsigTestCase.tearDown(self)
+
+    def sign(self, content='hello'):
+        return self.named_signer.sign_xmlstring(DOCUMENT.replace('hello',
+            content) % pyxmldsig.TEMPLATE_WITHOUT_CERT)
+
+    def test_round_trip(self):
+        signed = self.sign()
+        self.assertTrue('<KeyName>mykey</KeyName>' in signed)
+        self.assertTrue('X509Certificate' not in signed)
+        verifier = pyxmldsig.Xmldsig()
+        try:
+            verifier.load_public_keys({'mykey': CERT_FILE,
+                'otherkey': CERT2_FILE})
+            self.assertEqual(sorted(verifier.public_key_names()),
+                ['mykey', 'otherkey'])
+            self.assertTrue(verifier.verify_xmlstring(signed))
+            self.assertFalse(verifier.verify_xmlstring(
+                signed.replace('hello', 'hellO')))
+            # another key registered with the same name:
+            verifier.load_public_key('mykey', CERT2_FILE)
+            self.assertFalse(verifier.verify_xmlstring(signed))
+            self.assertTrue(verifier.remove_public_key('mykey'))
+            self.assertFalse(verifier.remove_public_key('mykey'))
+            # no key for this name anymore:
+            try:
+                valid = verifier.verify_xmlstring(signed)
+            except RuntimeError:
+                valid = False
+            self.assertFalse(valid)
+        finally:
+            verifier.destroy()
+
+    def test_key_name_of_certificate(self):
+        # a certificate loaded with a key name also registers its key:
+        verifier = pyxmldsig.Xmldsig(cert_file=CERT_FILE, key_name='mykey')
+        try:
+            self.assertTrue(verifier.verify_xmlstring(self.sign()))
+        finally:
+            verifier.destroy()
+
+
+class StatsTest (XmldsigTestCase):
+    """
+    timers and counters of XmldsigStats.
+    """
+
+    def test_phases(self):
+        measures = []
+        stats = pyxmldsig.XmldsigStats(
+            callback=lambda name, value: measures.append(name))
+        self.signer.stats = stats
+        self.verifier.stats = stats
+        xml = document()
+        signed = self.signer.sign_xmlstring(xml)
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+        path = temp_path('stats.xml')
+        self.signer.sign_file(StringIO(xml), path)
+        counters = stats.as_dict()
+        for phase in ('parse', 'find_node', 'sign', 'verify', 'serialize',
+                      'write'):
+            self.assertTrue(counters[phase + '.count'] >= 1, phase)
+            self.assertTrue(counters[phase + '.time'] >= 0, phase)
+        self.assertEqual(counters['parse.count'], 3)
+        self.assertEqual(counters['prescreen.count'], 0)
+        self.assertEqual(counters['bytes_in'], len(xml) + len(signed))
+        self.assertEqual(counters['bytes_out'],
+            len(signed) + os.path.getsize(path))
+        self.assertTrue('sign' in measures and 'bytes_out' in measures)
+        stats.reset()
+        self.assertEqual(stats.as_dict()['sign.count'], 0)
+        # stats removed: nothing is measured anymore
+        self.signer.stats = None
+        self.signer.sign_xmlstring(xml)
+        self.assertEqual(stats.as_dict()['sign.count'], 0)
+
+    def test_failed_phase(self):
+        stats = pyxmldsig.XmldsigStats()
+        self.verifier.stats = stats
+        self.assertRaises(Exception, self.verifier.verify_xmlstring, '<doc')
+        # the duration of a phase is recorded even if it fails:
+        self.assertEqual(stats.as_dict()['parse.count'], 1)
+
+
+class VerifyCacheTest (XmldsigTestCase):
+    """
+    cache of verification results, and its invalidation.
+    """
+
+    def setUp(self):
+        XmldsigTestCase.setUp(self)
+        self.destroyed = []
+
+    def tearDown(self):
+        for obj in self.destroyed:
+            obj.destroy()
+        XmldsigTestCase.tearDown(self)
+
+    def verifications(self, verifier):
+        return verifier.stats.as_dict()['verify.count']
+
+    def cached_verifier(self, **options):
+        verifier = pyxmldsig.Xmldsig(stats=pyxmldsig.XmldsigStats(),
+                                     **options)
+        self.destroyed.append(verifier)
+        return verifier
+
+    def test_cache(self):
+        verifier = self.cached_verifier(verify_cache_size=1)
+        verifier.load_certs([CERT_FILE])
+        signed = self.signer.sign_xmlstring(document())
+        tampered = signed.replace('hello', 'hellO')
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        self.assertEqual(self.verifications(verifier), 1)
+        # a different string is verified, and evicts the first one:
+        self.assertFalse(verifier.verify_xmlstring(tampered))
+        self.assertFalse(verifier.verify_xmlstring(tampered))
+        self.assertEqual(self.verifications(verifier), 2)
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        self.assertEqual(self.verifications(verifier), 3)
+        verifier.clear_verify_cache()
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        self.assertEqual(self.verifications(verifier), 4)
+
+    def test_policy_changes(self):
+        verifier = self.cached_verifier(verify_cache_size=10)
+        verifier.load_certs([CERT_FILE])
+        signed = self.signer.sign_xmlstring('<!DOCTYPE doc [\n'
+            '<!ENTITY e "hello">\n]>\n' + document('&e;'))
+        self.assertTrue('<!DOCTYPE' in signed)
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        # the cached result is not used with a stricter parser profile:
+        verifier.set_parser_profile('strict')
+        self.assertRaises(RuntimeError, verifier.verify_xmlstring, signed)
+        # nor with another prescreen:
+        signed = self.signer.sign_xmlstring(document())
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        verifier.prescreen = pyxmldsig.SignaturePrescreen(
+            signature_methods=[])
+        self.assertRaises(pyxmldsig.SignatureRejected,
+            verifier.verify_xmlstring, signed)
+        verifier.prescreen = None
+        self.assertTrue(verifier.verify_xmlstring(signed))
+
+    def test_disabled(self):
+        verifier = self.cached_verifier()
+        verifier.load_certs([CERT_FILE])
+        signed = self.signer.sign_xmlstring(document())
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        self.assertEqual(self.verifications(verifier), 2)
+
+    def test_ttl(self):
+        verifier = self.cached_verifier(verify_cache_size=10,
+                                        verify_cache_ttl=0.05)
+        verifier.load_certs([CERT_FILE])
+        signed = self.signer.sign_xmlstring(document())
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        time.sleep(0.1)
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        self.assertEqual(self.verifications(verifier), 2)
+
+    def test_certificates_changed(self):
+        verifier = self.cached_verifier(verify_cache_size=10)
+        verifier.load_certs([CERT2_FILE])
+        signed = self.signer.sign_xmlstring(document())
+        try:
+            valid = verifier.verify_xmlstring(signed)
+        except RuntimeError:
+            valid = False
+        self.assertFalse(valid)
+        # the result obtained without the certificate is not used anymore:
+        verifier.load_certs([CERT_FILE])
+        self.assertTrue(verifier.verify_xmlstring(signed))
+
+    def test_trust_store_changed(self):
+        store = pyxmldsig.TrustStore()
+        store.add_files([CERT_FILE])
+        verifier = self.cached_verifier(verify_cache_size=10,
+                                        trust_store=store)
+        self.destroyed.append(store)
+        signed = self.signer.sign_xmlstring(document())
+        self.assertTrue(verifier.verify_xmlstring(signed))
+        # a valid result is not kept when the certificate is removed:
+        store.remove(store.find_by_subject('CN=test'))
+        try:
+            valid = verifier.verify_xmlstring(signed)
+        except RuntimeError:
+            valid = False
+        self.assertFalse(valid)
+
+
+class ParserProfileTest (XmldsigTestCase):
+    """
+    rejection of DTDs before parsing by the strict and huge parser profiles.
+    """
+
+    BOMB = ('<?xml version="1.0"?>\n<!DOCTYPE doc [\n'
+        '<!ENTITY a "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa">\n'
+        + ''.join(['<!ENTITY %s "%s">\n' % (name, ('&%s;' % previous) * 10)
+            for previous, name in zip('abcdefgh', 'bcdefghi')])
+        + ']>\n<doc a="&i;">&i;</doc>\n')
+
+    def setUp(self):
+        XmldsigTestCase.setUp(self)
+        self.signed = self.signer.sign_xmlstring(document())
+
+    def assertRejected(self, function, *args):
+        try:
+            function(*args)
+        except RuntimeError, exc:
+            self.assertTrue('DTD' in str(exc), str(exc))
+        else:
+            self.fail('XML data with a DTD accepted')
+
+    def write_fifo(self, filename, data):
+        """
+        create a named pipe filename in the temporary directory, and a thread writing
+        data to it. Returns the tuple (path, thread).
+        """
+        path = temp_path(filename)
+        os.mkfifo(path)
+        self.addCleanup(os.remove, path)
+        def write():
+            f = open(path, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+        thread = threading.Thread(target=write)
+        thread.start()
+        return path, thread
+
+    def test_entity_bomb(self):
+        bomb_file = write_file('bomb.xml', self.BOMB)
+        for profile in ('strict', 'huge'):
+            self.verifier.set_parser_profile(profile)
+            self.assertRejected(self.verifier.verify_xmlstring, self.BOMB)
+            self.assertRejected(self.verifier.verify_file, bomb_file)
+            self.assertTrue(self.verifier.verify_xmlstring(self.signed))
+
+    def test_pipe(self):
+        if not hasattr(os, 'mkfifo'):
+            self.skipTest('named pipes are not supported')
+        self.verifier.set_parser_profile('huge')
+        path, thread = self.write_fifo('bomb.pipe', self.BOMB)
+        try:
+            self.assertRejected(self.verifier.verify_file, path)
+        finally:
+            thread.join()
+        path, thread = self.write_fifo('signed.pipe', self.signed)
+        try:
+            self.assertTrue(self.verifier.verify_file(path))
+        finally:
+            thread.join()
+
+    def test_pipe_with_prescreen(self):
+        if not hasattr(os, 'mkfifo'):
+            self.skipTest('named pipes are not supported')
+        # the data of the pipe is read once for the prescreen and the parser:
+        self.verifier.prescreen = pyxmldsig.SignaturePrescreen()
+        path, thread = self.write_fifo('prescreen.pipe', self.signed)
+        try:
+            self.assertTrue(self.verifier.verify_file(path))
+        finally:
+            thread.join()
+        path, thread = self.write_fifo('rejected.pipe', '<doc>hello</doc>')
+        try:
+            self.assertRaises(pyxmldsig.SignatureRejected,
+                self.verifier.verify_file, path)
+        finally:
+            thread.join()
+        # file objects are checked too:
+        f = open(write_file('rejected.xml', '<doc>hello</doc>'), 'rb')
+        try:
+            self.assertRaises(pyxmldsig.SignatureRejected,
+                self.verifier.verify_file, f)
+        finally:
+            f.close()
+
+    def test_utf16(self):
+        self.verifier.set_parser_profile('strict')
+        bomb = self.BOMB.replace('<?xml version="1.0"?>',
+            '<?xml version="1.0" encoding="UTF-16"?>')
+        for encoding in ('utf-16', 'utf-16-le', 'utf-16-be', 'utf-32'):
+            data = bomb.decode('ascii').encode(encoding)
+            self.assertRejected(self.verifier.verify_xmlstring, data)
+            self.assertRejected(self.verifier.verify_file,
+                write_file('bomb.xml', data))
+        # a document in UTF-16 without DTD is accepted:
+        signed = self.signed.replace('<?xml version="1.0"?>',
+            '<?xml version="1.0" encoding="UTF-16"?>')
+        self.assertTrue(self.verifier.verify_xmlstring(
+            signed.decode('ascii').encode('utf-16')))
+
+    def test_unknown_encoding(self):
+        self.verifier.set_parser_profile('strict')
+        # EBCDIC, and a prolog cut by the end of the data read:
+        self.assertRejected(self.verifier.verify_xmlstring,
+            self.BOMB.decode('ascii').encode('cp500'))
+        self.assertRejected(self.verifier.verify_xmlstring, '<?xml version')
+        self.assertRejected(self.verifier.verify_xmlstring, '<!-- a -->\n<!')
+
+
+class ParsedDocumentTest (XmldsigTestCase):
+    """
+    signature and verification of documents parsed by the caller.
+    """
+
+    def parse(self, xml):
+        doc = pyxmldsig.libxml2.parseDoc(xml)
+        self.addCleanup(doc.freeDoc)
+        return doc
+
+    def test_round_trip(self):
+        doc = self.parse(document())
+        node = self.signer.sign_doc(doc)
+        self.assertEqual(node.name, 'Signature')
+        self.assertTrue(node.xpathEval('string(.//*[local-name()='
+            '"SignatureValue"])').strip())
+        self.assertTrue(self.verifier.verify_doc(doc))
+        # same result as a signed string:
+        self.assertTrue(self.verifier.verify_xmlstring(str(doc)))
+        doc.getRootElement().children.next.setContent('hellO')
+        self.assertFalse(self.verifier.verify_doc(doc))
+
+    def test_return_string(self):
+        doc = self.parse(DOCUMENT % '')
+        template = pyxmldsig.SignatureTemplate()
+        try:
+            signed = self.signer.sign_doc(doc, template=template,
+                return_string=True)
+        finally:
+            template.destroy()
+        self.assertEqual(signed, str(doc))
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+
+    def test_element(self):
+        doc = self.parse('<root><a>hello</a><b>%s</b></root>'
+            % pyxmldsig.TEMPLATE_WITH_CERT)
+        b = doc.xpathEval('/root/b')[0]
+        node = self.signer.sign_doc(b)
+        self.assertEqual(node.parent.name, 'b')
+        self.assertTrue(self.verifier.verify_doc(b))
+        self.assertTrue(self.verifier.verify_doc(doc))
+
+    def test_no_signature(self):
+        doc = self.parse('<doc>hello</doc>')
+        self.assertRaises(RuntimeError, self.verifier.verify_doc, doc)
+        self.assertRaises(RuntimeError, self.signer.sign_doc, doc)
+
+
+class PrescreenTest (XmldsigTestCase):
+    """
+    rejection of invalid signatures by a SignaturePrescreen.
+    """
+
+    def assertRejected(self, prescreen, xml, reason):
+        try:
+            prescreen.check(xml)
+        except pyxmldsig.SignatureRejected, exc:
+            self.assertTrue(reason in str(exc), str(exc))
+        else:
+            self.fail('signature not rejected: %s' % reason)
+
+    def test_valid(self):
+        prescreen = pyxmldsig.SignaturePrescreen()
+        signed = self.signer.sign_xmlstring(document())
+        prescreen.check(signed)
+        prescreen.check_file(write_file('prescreen.xml', signed))
+
+    def test_rejected(self):
+        prescreen = pyxmldsig.SignaturePrescreen()
+        signed = self.signer.sign_xmlstring(document())
+        self.assertRejected(prescreen, '<doc>hello</doc>',
+            'no Signature element')
+        self.assertRejected(prescreen, '<doc><a></doc>' + signed,
+            'not well-formed')
+        value = signed.index('<SignatureValue>') + len('<SignatureValue>')
+        empty = signed[:value] + signed[signed.index('</SignatureValue>'):]
+        self.assertRejected(prescreen, empty, 'empty SignatureValue')
+        self.assertRejected(prescreen,
+            signed.replace('<SignatureValue>', '<Object/><SignatureValue>'),
+            'must start with SignedInfo')
+        self.assertRejected(pyxmldsig.SignaturePrescreen(max_references=0),
+            signed, 'too many references')
+        self.assertRejected(pyxmldsig.SignaturePrescreen(
+            signature_methods=[pyxmldsig.RSA_SHA256]), signed, 'rsa-sha1')
+        self.assertRaises(pyxmldsig.SignatureRejected, prescreen.check_file,
+            write_file('prescreen.xml', '<doc>hello</doc>'))
+
+    def test_verify(self):
+        stats = pyxmldsig.XmldsigStats()
+        self.verifier.prescreen = pyxmldsig.SignaturePrescreen()
+        self.verifier.stats = stats
+        signed = self.signer.sign_xmlstring(document())
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+        self.assertRaises(pyxmldsig.SignatureRejected,
+            self.verifier.verify_xmlstring, '<doc>hello</doc>')
+        self.assertRaises(pyxmldsig.SignatureRejected,
+            self.verifier.verify_file,
+            write_file('prescreen.xml', '<doc>hello</doc>'))
+        # the rejected documents are not parsed:
+        counters = stats.as_dict()
+        self.assertEqual(counters['prescreen.count'], 3)
+        self.assertEqual(counters['parse.count'], 1)
+
+
+class AlgorithmsTest (XmldsigTestCase):
+    """
+    choice of the signature algorithms with ALGORITHM_SUITES.
+    """
+
+    def assertAlgorithms(self, signed, suite):
+        for uri in pyxmldsig.ALGORITHM_SUITES[suite]:
+            self.assertTrue('Algorithm="%s"' % uri in signed, uri)
+
+    def test_supported(self):
+        self.assertTrue(pyxmldsig.algorithm_supported(pyxmldsig.RSA_SHA256))
+        self.assertTrue(pyxmldsig.algorithm_supported(pyxmldsig.EXC_C14N))
+        self.assertFalse(pyxmldsig.algorithm_supported(
+            'http://example.com/unknown'))
+        self.assertRaises(RuntimeError, self.signer.set_algorithms, 'unknown')
+        self.assertRaises(RuntimeError, self.signer.set_algorithms,
+            signature_method='http://example.com/unknown')
+        self.assertRaises(RuntimeError, pyxmldsig.suite_template, 'unknown')
+
+    def test_set_algorithms(self):
+        self.signer.set_algorithms('rsa-sha256')
+        signed = self.signer.sign_xmlstring(document())
+        self.assertAlgorithms(signed, 'rsa-sha256')
+        self.assertTrue(pyxmldsig.RSA_SHA1 not in signed)
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+        self.assertFalse(self.verifier.verify_xmlstring(
+            signed.replace('hello', 'hellO')))
+        # the algorithms of the template are used again:
+        self.signer.set_algorithms()
+        self.assertAlgorithms(self.signer.sign_xmlstring(document()),
+            'rsa-sha1')
+
+    def test_suite_template(self):
+        signer = pyxmldsig.Xmldsig(KEY_FILE, CERT_FILE,
+            algorithms='rsa-sha512')
+        try:
+            signed = signer.sign_xmlstring(DOCUMENT
+                % pyxmldsig.suite_template('rsa-sha256'))
+        finally:
+            signer.destroy()
+        # the algorithms of the object replace those of the template:
+        self.assertAlgorithms(signed, 'rsa-sha512')
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+
+    def check_suite(self, suite, key_type, *options):
+        if not pyxmldsig.algorithm_supported(
+                pyxmldsig.ALGORITHM_SUITES[suite][0]):
+            self.skipTest('%s is not supported by xmlsec' % suite)
+        key_file = temp_path(suite + '_key.pem')
+        cert_file = temp_path(suite + '_cert.pem')
+        try:
+            openssl('req', '-x509', '-newkey', key_type, '-nodes', '-days',
+                '1', '-subj', '/CN=' + suite, '-keyout', key_file, '-out',
+                cert_file, *options)
+        except subprocess.CalledProcessError:
+            self.skipTest('%s is not supported by openssl' % suite)
+        signer = pyxmldsig.Xmldsig(key_file, cert_file, algorithms=suite)
+        verifier = pyxmldsig.Xmldsig()
+        try:
+            verifier.load_certs([cert_file])
+            signed = signer.sign_xmlstring(document())
+            self.assertAlgorithms(signed, suite)
+            self.assertTrue(verifier.verify_xmlstring(signed))
+            self.assertFalse(verifier.verify_xmlstring(
+                signed.replace('hello', 'hellO')))
+        finally:
+            signer.destroy()
+            verifier.destroy()
+
+    def test_ecdsa(self):
+        self.check_suite('ecdsa-sha256', 'ec', '-pkeyopt',
+            'ec_paramgen_curve:prime256v1')
+
+    def test_ed25519(self):
+        self.check_suite('ed25519', 'ed25519')
+
+
+class VerifyAllTest (XmldsigTestCase):
+    """
+    verification of all the signatures of a bundle of signed entries.
+    """
+
+    def bundle(self, count=4):
+        entries = []
+        for index in range(count):
+            template = pyxmldsig._signature_xml(pyxmldsig.C14N,
+                pyxmldsig.RSA_SHA1, [pyxmldsig._reference_xml('#e%d' % index,
+                [pyxmldsig.ENVELOPED_SIGNATURE], pyxmldsig.SHA1)],
+                ['X509Data'])
+            entries.append('<entry xml:id="e%d">entry %d%s</entry>\n'
+                % (index, index, template))
+        doc = pyxmldsig.libxml2.parseDoc('<bundle>\n%s</bundle>'
+            % ''.join(entries))
+        try:
+            for entry in doc.xpathEval('/bundle/entry'):
+                self.signer.sign_doc(entry)
+            return str(doc)
+        finally:
+            doc.freeDoc()
+
+    def test_verify_all(self):
+        bundle = self.bundle()
+        results = self.verifier.verify_all(bundle)
+        self.assertEqual([valid for path, valid, error in results],
+            [True] * 4)
+        self.assertTrue(results[1][0].startswith('/bundle/entry[2]/'))
+        results = self.verifier.verify_all(bundle.replace('entry 2', 'entry X'))
+        self.assertEqual([valid for path, valid, error in results],
+            [True, True, False, True])
+
+    def test_prescreen(self):
+        self.verifier.prescreen = pyxmldsig.SignaturePrescreen()
+        bundle = self.bundle()
+        self.assertEqual(len(self.verifier.verify_all(bundle)), 4)
+        # the last signature is malformed, not the first one:
+        value = bundle.rindex('<SignatureValue>') + len('<SignatureValue>')
+        malformed = bundle[:value] + bundle[bundle.index('</SignatureValue>',
+            value):]
+        self.assertRaises(pyxmldsig.SignatureRejected,
+            self.verifier.verify_all, malformed)
+        self.assertRaises(pyxmldsig.SignatureRejected,
+            self.verifier.verify_all, '<bundle/>')
+
+    def test_parallel(self):
+        bundle = self.bundle(5).replace('entry 3', 'entry X')
+        signer = pyxmldsig.ParallelSigner(certificates=[CERT_FILE],
+            processes=2)
+        try:
+            results = signer.verify_all(bundle)
+        finally:
+            signer.shutdown()
+        self.assertEqual(results, self.verifier.verify_all(bundle))
+        self.assertEqual([valid for path, valid, error in results],
+            [True, True, True, False, True])
+
+
+class ContextPoolTest (XmldsigTestCase):
+    """
+    Xmldsig objects shared by several threads, with a bounded pool of
+    signature contexts.
+    """
+
+    def test_threads(self):
+        signer = pyxmldsig.Xmldsig(KEY_FILE, CERT_FILE, max_contexts=2)
+        results = []
+        def run(index):
+            for i in xrange(5):
+                signed = signer.sign_xmlstring(document('t%d_%d' % (index, i)))
+                results.append(self.verifier.verify_xmlstring(signed))
+                # the pool never creates more contexts than allowed:
+                results.append(signer._pool._count <= 2)
+        threads = [threading.Thread(target=run, args=(index,))
+            for index in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        signer.destroy()
+        self.assertEqual(results, [True] * 40)
+
+    def test_reentrant(self):
+        # with a single context, the object is used again between the results
+        # of sign_many and verify_many (this would wait forever if the
+        # generators kept the context between documents):
+        signer = pyxmldsig.Xmldsig(KEY_FILE, CERT_FILE, max_contexts=1)
+        signer.load_certs([CERT_FILE])
+        results = []
+        def run():
+            for signed, error in signer.sign_many([document(), document()]):
+                results.append(signer.sign_xmlstring(document()) is not None)
+                for valid, error in signer.verify_many([signed]):
+                    results.append(signer.verify_xmlstring(signed) and valid)
+        thread = threading.Thread(target=run)
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.isAlive(), 'deadlock in sign_many')
+        signer.destroy()
+        self.assertEqual(results, [True] * 4)
+
+
+    def test_retired_while_released(self):
+        released = []
+        class SharedKeysMngr (object):
+            def release(self):
+                released.append(True)
+        pool = pyxmldsig._ContextPool(self.verifier.keysmngr,
+            shared_mngr=SharedKeysMngr())
+        dsig_ctx = pool.acquire()
+        reset = pool.reset
+        def reset_and_retire(dsig_ctx):
+            # another thread retires the pool during the reset:
+            dsig_ctx = reset(dsig_ctx)
+            pool.retire()
+            return dsig_ctx
+        pool.reset = reset_and_retire
+        pool.release(dsig_ctx)
+        self.assertEqual((pool._count, pool._idle), (0, []))
+        self.assertEqual(released, [True])
+
+
+class ParallelSignerTest (unittest.TestCase):
+    """
+    signature and verification with worker processes.
+    """
+
+    def test_round_trip(self):
+        signer = pyxmldsig.ParallelSigner(KEY_FILE, CERT_FILE, processes=2,
+            certificates=[CERT_FILE])
+        try:
+            inputs = [document('doc%d' % i) for i in xrange(6)] + ['<bad']
+            results = list(signer.sign_many(inputs))
+            self.assertEqual([index for index, signed, error in results],
+                range(7))
+            self.assertTrue(results[6][2] is not None)
+            signed = [signed for index, signed, error in results[:6]]
+            signed.append(signed[0].replace('doc0', 'docX'))
+            self.assertEqual([valid for index, valid, error
+                in signer.verify_many(signed)], [True] * 6 + [False])
+        finally:
+            signer.shutdown()
+
+    def test_bad_key(self):
+        self.assertRaises(RuntimeError, pyxmldsig.ParallelSigner,
+            temp_path('missing.pem'), processes=2)
+
+    def test_check_all_workers(self):
+        signer = pyxmldsig.ParallelSigner(KEY_FILE, CERT_FILE, processes=4)
+        try:
+            self.assertEqual(signer._check_workers(), None)
+            # whichever worker is broken, it is found:
+            signer._pool.apply(break_worker)
+            self.assertTrue(isinstance(signer._check_workers(), RuntimeError))
+        finally:
+            signer.shutdown()
+
+
+class KeyCacheTest (unittest.TestCase):
+    """
+    process-wide caches of keys and of the Xmldsig objects of the module
+    functions.
+    """
+
+    def setUp(self):
+        pyxmldsig.clear_key_cache()
+        self.live = pyxmldsig.live_objects()
+        self.verifier = pyxmldsig.Xmldsig()
+        self.verifier.load_certs([CERT_FILE, CERT2_FILE])
+
+    def tearDown(self):
+        self.verifier.destroy()
+        pyxmldsig.set_key_cache_size(pyxmldsig.KEY_CACHE_SIZE)
+        pyxmldsig.clear_key_cache()
+        self.assertEqual(self.live_objects(), self.live)
+
+    def live_objects(self):
+        live = pyxmldsig.live_objects()
+        for kind in set(live) | set(self.live):
+            live.setdefault(kind, 0)
+            self.live.setdefault(kind, 0)
+        return live
+
+    def encrypted_key(self):
+        path = temp_path('encrypted_key.pem')
+        if not os.path.exists(path):
+            openssl('pkey', '-in', KEY_FILE, '-aes256', '-passout',
+                'pass:secret', '-out', path)
+        return open(path, 'rb').read()
+
+    def test_key_data(self):
+        signer = pyxmldsig.Xmldsig(key_data=self.encrypted_key(),
+            cert_data=open(CERT_FILE, 'rb').read(), password='secret')
+        try:
+            self.assertTrue(self.verifier.verify_xmlstring(
+                signer.sign_xmlstring(document())))
+        finally:
+            signer.destroy()
+        self.assertRaises(RuntimeError, pyxmldsig.Xmldsig,
+            key_data=self.encrypted_key(), password='wrong')
+        self.assertRaises(RuntimeError, pyxmldsig.Xmldsig,
+            key_data='not a key')
+
+    def test_preload_key(self):
+        pyxmldsig.set_key_cache_size(0)
+        key_data = self.encrypted_key()
+        pyxmldsig.preload_key(key_data=key_data, cert_file=CERT_FILE,
+            password='secret')
+        self.assertEqual(len(pyxmldsig._preloaded_keys), 1)
+        # loading the same key again replaces the preloaded one:
+        pyxmldsig.preload_key(key_data=key_data, cert_file=CERT_FILE,
+            password='secret')
+        self.assertEqual(len(pyxmldsig._preloaded_keys), 1)
+        signer = pyxmldsig.Xmldsig(key_data=key_data, cert_file=CERT_FILE,
+            password='secret')
+        try:
+            self.assertTrue(self.verifier.verify_xmlstring(
+                signer.sign_xmlstring(document())))
+        finally:
+            signer.destroy()
+        # the preloaded key is not used with another password:
+        self.assertRaises(RuntimeError, pyxmldsig.Xmldsig, key_data=key_data,
+            cert_file=CERT_FILE, password='wrong')
+        pyxmldsig.clear_key_cache()
+        self.assertEqual(len(pyxmldsig._preloaded_keys), 0)
+
+    def test_rotated_key_file(self):
+        key_file = temp_path('rotated_key.pem')
+        cert_file = temp_path('rotated_cert.pem')
+        keys = [(KEY_FILE, CERT_FILE), (KEY2_FILE, CERT2_FILE)]
+        first = None
+        for index in range(20):
+            key, cert = keys[index % 2]
+            write_file(key_file, open(key, 'rb').read())
+            write_file(cert_file, open(cert, 'rb').read())
+            # a new modification time, even on filesystems with a coarse
+            # resolution:
+            os.utime(key_file, (index, index))
+            for i in range(3):
+                signed = pyxmldsig.sign_xmlstring(document(), key_file,
+                    cert_file)
+                self.assertTrue(self.verifier.verify_xmlstring(signed))
+            # the objects of the previous versions of the key are destroyed:
+            live = self.live_objects()
+            if first is None:
+                first = live
+            self.assertEqual(live, first)
+        # (tearDown checks that clear_key_cache destroys all of them)
+
+    def test_module_functions(self):
+        signed = pyxmldsig.sign_xmlstring(document(), KEY_FILE, CERT_FILE)
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+        path = write_file('template.xml', document('file'))
+        signed = pyxmldsig.sign_file(path, KEY_FILE, CERT_FILE)
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+        # the same Xmldsig object is used for both calls:
+        self.assertEqual(len(pyxmldsig._xmldsig_cache._items), 1)
+
+    def test_eviction(self):
+        pyxmldsig.set_key_cache_size(1)
+        pyxmldsig.sign_xmlstring(document(), KEY_FILE, CERT_FILE)
+        live = self.live_objects()
+        # the first object is evicted and destroyed:
+        signed = pyxmldsig.sign_xmlstring(document(), KEY2_FILE, CERT2_FILE)
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+        self.assertEqual(self.live_objects()['KeysMngr'], live['KeysMngr'])
+
+    def test_disabled(self):
+        pyxmldsig.set_key_cache_size(0)
+        live = self.live_objects()
+        pyxmldsig.sign_xmlstring(document(), KEY_FILE, CERT_FILE)
+        self.assertEqual(self.live_objects(), live)
+
+    def test_evicted_while_used(self):
+        shared = pyxmldsig._get_xmldsig(KEY_FILE, CERT_FILE, '', None)
+        live = self.live_objects()
+        pyxmldsig.clear_key_cache()
+        # still usable until it is released:
+        signed = shared.xmldsig.sign_xmlstring(document())
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+        shared.release()
+        self.assertEqual(self.live_objects()['KeysMngr'],
+            live['KeysMngr'] - 1)
+
+    def test_concurrent_misses(self):
+        live = self.live_objects()
+        errors = []
+        def run():
+            try:
+                pyxmldsig.sign_xmlstring(document(), KEY_FILE, CERT_FILE)
+            except Exception, exc:
+                errors.append(exc)
+        threads = [threading.Thread(target=run) for i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        # a single object was built, none was leaked:
+        self.assertEqual(self.live_objects()['KeysMngr'],
+            live['KeysMngr'] + 1)
+
+
+class BlockingBackend (object):
+    """
+    backend of AsyncXmldsig whose operations wait until they are allowed to
+    finish, to test queued operations.
+    """
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.finish = threading.Event()
+
+    def sign_xmlstring(self, xmlstring):
+        self.started.set()
+        self.finish.wait()
+        return 'signed ' + xmlstring
+
+    verify_xmlstring = sign_xmlstring
+
+
+class AsyncXmldsigTest (XmldsigTestCase):
+    """
+    asynchronous operations returning futures.
+    """
+
+    def test_round_trip(self):
+        xdsig_async = pyxmldsig.AsyncXmldsig(xmldsig=self.signer, max_workers=2)
+        try:
+            futures = [xdsig_async.sign(document('doc%d' % i)) for i in xrange(4)]
+            signed = [future.result(30) for future in futures]
+        finally:
+            xdsig_async.shutdown()
+        verifier = pyxmldsig.AsyncXmldsig(xmldsig=self.verifier)
+        try:
+            self.assertTrue(verifier.verify(signed[3]).result(30))
+            self.assertFalse(verifier.verify(
+                signed[3].replace('doc3', 'docX')).result(30))
+            self.assertRaises(Exception, verifier.verify('<bad').result, 30)
+        finally:
+            verifier.shutdown()
+
+    def test_cancel_and_limits(self):
+        backend = BlockingBackend()
+        xdsig_async = pyxmldsig.AsyncXmldsig(xmldsig=backend, max_workers=1,
+            max_queued=1)
+        try:
+            running = xdsig_async.sign('a')
+            backend.started.wait(30)
+            self.assertTrue(backend.started.isSet())
+            queued = xdsig_async.sign('b')
+            # the queue is full:
+            self.assertRaises(RuntimeError, xdsig_async.sign, 'c')
+            done = []
+            queued.add_done_callback(done.append)
+            self.assertTrue(queued.cancel())
+            self.assertTrue(queued.cancelled())
+            self.assertEqual(done, [queued])
+            self.assertRaises(pyxmldsig.OperationCancelled, queued.result)
+            # the running operation cannot be cancelled:
+            self.assertFalse(running.cancel())
+            self.assertRaises(pyxmldsig.OperationTimeout, running.result, 0.01)
+            backend.finish.set()
+            self.assertEqual(running.result(30), 'signed a')
+        finally:
+            backend.finish.set()
+            xdsig_async.shutdown()
+
+    def test_deadline(self):
+        backend = BlockingBackend()
+        xdsig_async = pyxmldsig.AsyncXmldsig(xmldsig=backend, max_workers=1,
+            timeout=0.05)
+        try:
+            future = xdsig_async.sign('a')
+            self.assertRaises(pyxmldsig.OperationTimeout, future.result)
+            backend.finish.set()
+            # finished after its deadline: reported as failed
+            time.sleep(0.1)
+            self.assertRaises(pyxmldsig.OperationTimeout, future.result)
+        finally:
+            backend.finish.set()
+            xdsig_async.shutdown()
+
+
+    def test_owned_backend(self):
+        for wait in (True, False):
+            xdsig_async = pyxmldsig.AsyncXmldsig(KEY_FILE, CERT_FILE,
+                certificates=[CERT_FILE], max_workers=2)
+            signed = xdsig_async.sign(document()).result(30)
+            self.assertTrue(xdsig_async.verify(signed).result(30))
+            xdsig_async.shutdown(wait)
+            # the Xmldsig created by AsyncXmldsig is destroyed by its last
+            # worker thread:
+            deadline = time.time() + 30
+            while (xdsig_async._backend.keysmngr is not None
+                   and time.time() < deadline):
+                time.sleep(0.01)
+            self.assertEqual(xdsig_async._backend.keysmngr, None)
+
+
+class CommandLineTest (XmldsigTestCase):
+    """
+    sign and verify subcommands of the command-line tool.
+    """
+
+    def make_dir(self, name):
+        path = temp_path(name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def test_sign_verify(self):
+        path = write_file('cli.xml', document())
+        status, stdout, stderr = run_tool(['sign', '-k', KEY_FILE, '-c',
+            CERT_FILE, '-j', '1', path])
+        self.assertEqual(status, 0, stderr)
+        signed = temp_path('cli_signed.xml')
+        self.assertTrue(os.path.isfile(signed))
+        status, stdout, stderr = run_tool(['verify', '-c', CERT_FILE, '-j',
+            '1', '-v', signed])
+        self.assertEqual(status, 0, stderr)
+        self.assertTrue('OK' in stdout)
+        write_file('cli_signed.xml', open(signed, 'rb').read().replace(
+            'hello', 'hellO'))
+        status, stdout, stderr = run_tool(['verify', '-c', CERT_FILE, '-j',
+            '1', signed])
+        self.assertEqual(status, 1)
+        self.assertTrue('INVALID' in stdout)
+
+    def test_output_collision(self):
+        first = os.path.join(self.make_dir('cli1'), 'same.xml')
+        second = os.path.join(self.make_dir('cli2'), 'same.xml')
+        write_file(first, document('first'))
+        write_file(second, document('second'))
+        outdir = self.make_dir('cli_out')
+        status, stdout, stderr = run_tool(['sign', '-k', KEY_FILE, '-j', '1',
+            '-o', outdir, first, second])
+        self.assertEqual(status, 1)
+        self.assertTrue('same output file' in stderr, stderr)
+        # the first output is not replaced by the second one:
+        signed = open(os.path.join(outdir, 'same_signed.xml'), 'rb').read()
+        self.assertTrue('first' in signed and 'second' not in signed)
+        # without suffix nor output directory, the input would be replaced:
+        status, stdout, stderr = run_tool(['sign', '-k', KEY_FILE, '-j', '1',
+            '-s', '', first])
+        self.assertEqual(status, 1)
+        self.assertTrue('replace the input' in stderr, stderr)
+        self.assertEqual(open(first, 'rb').read(), document('first'))
+
+    def test_signed_files_skipped(self):
+        directory = self.make_dir('cli_skip')
+        write_file(os.path.join(directory, 'a.xml'), document())
+        previous = write_file(os.path.join(directory, 'b_signed.xml'),
+            document())
+        status, stdout, stderr = run_tool(['sign', '-k', KEY_FILE, '-j', '1',
+            '-v', directory])
+        self.assertEqual(status, 0, stderr)
+        # the output of a previous run found in a directory is skipped:
+        self.assertTrue('SKIPPED %s' % previous in stdout, stdout)
+        self.assertTrue('1 files' in stderr and '1 skipped' in stderr, stderr)
+        self.assertFalse(os.path.exists(temp_path(
+            os.path.join('cli_skip', 'b_signed_signed.xml'))))
+        # but not a file given on the command line:
+        status, stdout, stderr = run_tool(['sign', '-k', KEY_FILE, '-j', '1',
+            previous])
+        self.assertEqual(status, 0, stderr)
+        self.assertTrue('skipped' not in stderr, stderr)
+        self.assertTrue(os.path.isfile(temp_path(
+            os.path.join('cli_skip', 'b_signed_signed.xml'))))
+
+    def test_invalid_public_key(self):
+        status, stdout, stderr = run_tool(['verify', '-K', CERT_FILE,
+            temp_path('missing.xml')])
+        self.assertEqual(status, 2)
+        self.assertTrue('expected NAME=FILE' in stderr, stderr)
+
+    def test_file_named_like_subcommand(self):
+        cwd = self.make_dir('cli_sign')
+        write_file(os.path.join(cwd, 'sign'), document())
+        status, stdout, stderr = run_tool(['-k', KEY_FILE, '-c', CERT_FILE,
+            '--', 'sign'], cwd=cwd)
+        self.assertEqual(status, 0, stderr)
+        self.assertTrue(self.verifier.verify_xmlstring(stdout))
+
+
+class InitTest (unittest.TestCase):
+    """
+    references to the libraries taken by init and released by shutdown, the
+    initialization and shutdown of the libraries being counted instead of
+    done.
+    """
+
+    def setUp(self):
+        self.saved = (pyxmldsig._init, pyxmldsig._shutdown,
+            pyxmldsig._init_pid, pyxmldsig._init_refs)
+        self.calls = []
+        pyxmldsig._init = lambda: self.calls.append('init')
+        pyxmldsig._shutdown = lambda: self.calls.append('shutdown')
+        pyxmldsig._init_pid = None
+        pyxmldsig._init_refs = 0
+
+    def tearDown(self):
+        (pyxmldsig._init, pyxmldsig._shutdown, pyxmldsig._init_pid,
+            pyxmldsig._init_refs) = self.saved
+
+    def test_init_before_use(self):
+        # shutdown without init does nothing:
+        pyxmldsig.shutdown()
+        pyxmldsig.init()
+        pyxmldsig._ensure_init()
+        self.assertEqual(self.calls, ['init'])
+        pyxmldsig.shutdown()
+        self.assertEqual(self.calls, ['init', 'shutdown'])
+        self.assertEqual(pyxmldsig._init_pid, None)
+        pyxmldsig.shutdown()
+        self.assertEqual(self.calls, ['init', 'shutdown'])
+
+    def test_init_after_use(self):
+        pyxmldsig._ensure_init()
+        # the automatic initialization does not hold a reference:
+        pyxmldsig.shutdown()
+        self.assertEqual(self.calls, ['init'])
+        pyxmldsig.init()
+        pyxmldsig.init()
+        self.assertEqual(self.calls, ['init'])
+        pyxmldsig.shutdown()
+        self.assertEqual(self.calls, ['init'])
+        pyxmldsig.shutdown()
+        self.assertEqual(self.calls, ['init', 'shutdown'])
+        # initialized again when used after shutdown:
+        pyxmldsig._ensure_init()
+        self.assertEqual(self.calls, ['init', 'shutdown', 'init'])
+
+    def test_shutdown_waits_for_cached_objects(self):
+        pyxmldsig.init()
+        shared = pyxmldsig._get_xmldsig(KEY_FILE, CERT_FILE, '', None)
+        thread = threading.Thread(target=pyxmldsig.shutdown)
+        thread.start()
+        try:
+            thread.join(0.2)
+            # the libraries are not stopped while the object is used:
+            self.assertTrue(thread.isAlive())
+            self.assertEqual(self.calls, ['init'])
+            self.assertTrue('SignatureValue' in
+                shared.xmldsig.sign_xmlstring(document()))
+        finally:
+            shared.release()
+            thread.join(30)
+        self.assertEqual(self.calls, ['init', 'shutdown'])
+        self.assertEqual(pyxmldsig._shared_xmldsig_count, 0)
+
+
+    def test_use_while_shutting_down(self):
+        pyxmldsig.init()
+        shared = pyxmldsig._get_xmldsig(KEY_FILE, CERT_FILE, '', None)
+        thread = threading.Thread(target=pyxmldsig.shutdown)
+        thread.start()
+        try:
+            thread.join(0.2)
+            self.assertTrue(thread.isAlive())
+            # the module functions still work, without caching new objects,
+            # and init does not wait for shutdown:
+            other = pyxmldsig._get_xmldsig(KEY_FILE, None, '', None)
+            self.assertEqual(pyxmldsig._xmldsig_cache._items.keys(), [])
+            other.release()
+            pyxmldsig.init()
+        finally:
+            shared.release()
+            thread.join(30)
+        self.assertFalse(thread.isAlive())
+        # stopped by the last shutdown only:
+        self.assertEqual(self.calls, ['init'])
+        pyxmldsig.shutdown()
+        self.assertEqual(self.calls, ['init', 'shutdown'])
+        self.assertEqual(pyxmldsig._shared_xmldsig_count, 0)
+
+
+class IncrementalSignerTest (XmldsigTestCase):
+    """
+    signature of documents divided into sections with IncrementalSigner.
+    """
+
+    CATALOG = ('<catalog>\n<item>one</item>\n<item>two</item>\n'
+               '<item>three</item>\n</catalog>\n')
+
+    def setUp(self):
+        XmldsigTestCase.setUp(self)
+        self.incremental_signer = pyxmldsig.IncrementalSigner(self.signer)
+        self.incremental_verifier = pyxmldsig.IncrementalSigner(
+            self.verifier)
+
+    def tearDown(self):
+        self.incremental_signer.template.destroy()
+        self.incremental_verifier.template.destroy()
+        XmldsigTestCase.tearDown(self)
+
+    def verify(self, xml):
+        return self.incremental_verifier.verify_xmlstring(xml)
+
+    def test_round_trip(self):
+        signed = self.incremental_signer.sign_xmlstring(self.CATALOG)
+        self.assertEqual(signed.count('Id="section-'), 4)
+        self.assertTrue(self.verify(signed))
+        self.assertFalse(self.verify(signed.replace('two', 'tw0')))
+        # signed again after a change, with the digests of the other
+        # sections taken from the previous signature:
+        changed = signed.replace('two', 'TWO')
+        resigned = self.incremental_signer.sign_xmlstring(changed,
+            changed=['section-1'])
+        self.assertEqual(resigned.count('<Signature xmlns'), 1)
+        self.assertTrue(self.verify(resigned))
+        self.assertFalse(self.verify(resigned.replace('one', 'ONE')))
+
+    def test_unsigned_contents(self):
+        signed = self.incremental_signer.sign_xmlstring(self.CATALOG)
+        end = signed.index('</catalog>')
+        def insert(xml):
+            return signed[:end] + xml + signed[end:]
+        # comments and whitespace are allowed:
+        self.assertTrue(self.verify(insert('<!-- comment -->\n')))
+        # new sections, with or without Id:
+        self.assertFalse(self.verify(insert('<item>four</item>')))
+        self.assertFalse(self.verify(insert('<item Id="new">four</item>')))
+        self.assertFalse(self.verify(insert(
+            '<item Id="section-1">two</item>')))
+        # contents outside the sections:
+        self.assertFalse(self.verify(insert('unsigned text')))
+        self.assertFalse(self.verify(insert('<![CDATA[unsigned]]>')))
+
+    def test_versions(self):
+        catalog = self.CATALOG.replace('<item>', '<item Id="i">')
+        catalog = catalog.replace('"i">one', '"i1">one').replace(
+            '"i">two', '"i2">two').replace('"i">three', '"i3">three')
+        versions = {'i1': 1, 'i2': 1}
+        signed = self.incremental_signer.sign_xmlstring(catalog,
+            versions=versions)
+        self.assertTrue(self.verify(signed))
+        # the digest of a section is taken from the cache while its version
+        # is the same (the caller is responsible for the versions):
+        changed = catalog.replace('two', 'TWO')
+        stale = self.incremental_signer.sign_xmlstring(changed,
+            versions=versions)
+        self.assertFalse(self.verify(stale))
+        resigned = self.incremental_signer.sign_xmlstring(changed,
+            versions={'i1': 1, 'i2': 2})
+        self.assertTrue(self.verify(resigned))
+        # sections without version are always digested:
+        resigned = self.incremental_signer.sign_xmlstring(
+            catalog.replace('three', 'THREE'), versions=versions)
+        self.assertTrue(self.verify(resigned))
+
+    def test_entity_references(self):
+        xml = ('<!DOCTYPE catalog [\n<!ENTITY e "one">\n]>\n'
+               + self.CATALOG.replace('one', '&e;'))
+        signed = self.incremental_signer.sign_xmlstring(xml)
+        # entities are substituted by the default parser profile:
+        self.assertTrue(self.verify(signed))
+        signed = signed.replace('>one<', '>&e;<')
+        self.assertTrue(self.verify(signed))
+        # parsed without substituting entities:
+        doc = pyxmldsig.libxml2.readMemory(signed, len(signed), None, None,
+            pyxmldsig.libxml2.XML_PARSE_NONET)
+        try:
+            self.assertRaises(RuntimeError,
+                self.incremental_verifier.verify_doc, doc)
+            self.assertRaises(RuntimeError,
+                self.incremental_signer.sign_doc, doc)
+        finally:
+            doc.freeDoc()
+
+    def test_nested_sections(self):
+        xml = ('<catalog><items><item>one</item><item>two</item></items>'
+               '</catalog>')
+        incremental_signer = pyxmldsig.IncrementalSigner(self.signer,
+            sections='/catalog/items/item')
+        try:
+            signed = incremental_signer.sign_xmlstring(xml)
+        finally:
+            incremental_signer.template.destroy()
+        incremental_verifier = pyxmldsig.IncrementalSigner(self.verifier,
+            sections='/catalog/items/item')
+        try:
+            self.assertTrue(incremental_verifier.verify_xmlstring(signed))
+            # elements and text around the sections are not signed:
+            for old, new in [('<items>', '<items><extra/>'),
+                             ('<items>', '<header>unsigned</header><items>'),
+                             ('</items>', 'unsigned</items>')]:
+                self.assertFalse(incremental_verifier.verify_xmlstring(
+                    signed.replace(old, new, 1)), new)
+        finally:
+            incremental_verifier.template.destroy()
+
+
+class SigningServerTest (XmldsigTestCase):
+    """
+    signature and verification through a SigningServer with
+    pyxmldsig_client.
+    """
+
+    def setUp(self):
+        XmldsigTestCase.setUp(self)
+        if not hasattr(socket, 'AF_UNIX'):
+            self.skipTest('Unix domain sockets are required')
+        import pyxmldsig_client
+        self.path = temp_path('server.sock')
+        self.server = pyxmldsig.SigningServer(self.path,
+            {'test': self.signer, 'verifier': self.verifier}, 'test',
+            max_request_size=1024 * 1024)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = pyxmldsig_client.Client(self.path, timeout=30)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.close()
+        XmldsigTestCase.tearDown(self)
+
+    def test_round_trip(self):
+        signed = self.client.sign(document())
+        self.assertTrue(self.client.verify(signed, key='verifier'))
+        self.assertFalse(self.client.verify(signed.replace('hello', 'hellO'),
+            key='verifier'))
+        self.assertRaises(RuntimeError, self.client.sign, document(),
+            key='unknown')
+        # a large document, received in several chunks:
+        large = self.client.sign(document('x' * 600000))
+        self.assertTrue(self.verifier.verify_xmlstring(large))
+
+    def test_many(self):
+        xmlstrings = [document('doc %d' % i) for i in range(50)]
+        xmlstrings[7] = '<doc'
+        results = list(self.client.sign_many(xmlstrings, max_pending=8))
+        self.assertEqual(len(results), 50)
+        self.assertTrue(results[7][0] is None and results[7][1] is not None)
+        signed = [output for output, error in results if error is None]
+        self.assertTrue('doc 8' in signed[7])
+        self.assertEqual([valid for valid, error in self.client.verify_many(
+            signed, key='verifier', max_pending=8)], [True] * 49)
+
+    def test_many_large(self):
+        # many large responses buffered by the client while it sends:
+        xmlstrings = [document('doc %d ' % i + 'x' * 100000)
+            for i in range(24)]
+        results = list(self.client.sign_many(xmlstrings, max_pending=16))
+        self.assertEqual([error for signed, error in results], [None] * 24)
+        for i, (signed, error) in enumerate(results):
+            self.assertTrue('doc %d ' % i in signed)
+        self.assertTrue(self.verifier.verify_xmlstring(results[-1][0]))
+
+    def test_early_exit(self):
+        xmlstrings = [document('doc %d' % i) for i in range(40)]
+        for signed, error in self.client.sign_many(xmlstrings, max_pending=16):
+            break
+        for valid, error in self.client.verify_many(xmlstrings,
+                                                    key='verifier'):
+            break
+        # the responses of the requests sent are not mixed up with the next
+        # ones:
+        signed = self.client.sign(document('next'))
+        self.assertTrue('next' in signed)
+        self.assertTrue(self.verifier.verify_xmlstring(signed))
+
+    def test_connection_closed(self):
+        # too large: the server closes the connection
+        self.assertRaises((RuntimeError, socket.error), self.client.sign,
+            'x' * (2 * 1024 * 1024))
+        # the client cannot be used anymore:
+        self.assertRaises(RuntimeError, self.client.sign, document())
+
+    def test_invalid_requests(self):
+        # rejected before anything is sent, the connection can still be used:
+        self.assertRaises(TypeError, self.client.sign, unicode(document()))
+        self.assertRaises(ValueError, self.client.sign, document(),
+            key='k' * 65536)
+        self.assertRaises(TypeError, list, self.client.sign_many(
+            [document(), unicode(document())]))
+        signed = self.client.sign(document(), key=u'test')
+        self.assertTrue(self.client.verify(signed, key=u'verifier'))
+
+    def test_socket_mode(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0600)
+        # the umask of the process is not changed:
+        umask = os.umask(022)
+        os.umask(umask)
+        self.assertEqual(umask, 022)
+        # a server is already running:
+        self.assertRaises(RuntimeError, pyxmldsig.SigningServer, self.path,
+            {'test': self.signer})
+        self.assertEqual([name for name in os.listdir(TMPDIR)
+            if name.startswith('.pyxmldsig')], [])
+
+
+class BenchCompareTest (unittest.TestCase):
+    """
+    comparison of benchmark results with bench_pyxmldsig.
+    """
+
+    def compare(self, old, new):
+        import bench_pyxmldsig
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            regressions = bench_pyxmldsig.compare_results(
+                {'results': [old]}, {'results': [new]}, 0.1)
+        finally:
+            sys.stdout = stdout
+        return regressions, output.getvalue()
+
+    def test_regression(self):
+        regressions, output = self.compare(
+            {'name': 'sign', 'ops_per_s': 100.0, 'p99': 1.0},
+            {'name': 'sign', 'ops_per_s': 50.0, 'p99': 1.0})
+        self.assertEqual(regressions, 1)
+        self.assertTrue('-50.0%' in output and 'REGRESSION' in output)
+
+    def test_zero_baseline(self):
+        regressions, output = self.compare(
+            {'name': 'sign', 'ops_per_s': 0, 'p99': 0.0},
+            {'name': 'sign', 'ops_per_s': 10.0, 'p99': 1.0})
+        self.assertEqual(regressions, 0)
+        self.assertTrue('n/a' in output)
+        regressions, output = self.compare({'name': 'memory', 'rss_kb': 0},
+                                           {'name': 'memory', 'rss_kb': 5})
+        self.assertEqual(regressions, 0)
+        self.assertTrue('n/a' in output)
+
+
+if __name__ == '__main__':
+    unittest.main()